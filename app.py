@@ -3,8 +3,15 @@ from PIL import Image
 import os
 import requests
 import io
-import re
-import json
+import hashlib
+import threading
+import time
+
+from document_reader import PDF_SUPPORT, count_pages, iter_pages
+from page_cache import PageCache
+from pdf_processor import DocumentJob
+from structured_output import extract_json
+from tables import column_names, page_block, stitch_tables, to_csv
 
 # Page config
 st.set_page_config(
@@ -16,26 +23,64 @@ st.set_page_config(
 # Server configuration (use env var for Docker, fallback to localhost for dev)
 MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL", "http://localhost:8508")
 
-# PDF support using PyMuPDF (no poppler needed!)
-try:
-    import fitz  # PyMuPDF
-    PDF_SUPPORT = True
-except ImportError:
-    PDF_SUPPORT = False
-
-def convert_pdf_to_images(pdf_path, dpi=150):
-    """Convert PDF to images using PyMuPDF"""
-    doc = fitz.open(pdf_path)
-    images = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        mat = fitz.Matrix(dpi/72, dpi/72)
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
-        images.append(img)
-    doc.close()
-    return images
+# Seconds before the cached server status is refreshed in the background
+STATUS_TTL = float(os.getenv("STATUS_TTL", 10))
+
+# Per-page DPI chosen from font size / scan resolution (see document_reader.choose_dpi), no higher
+# than the app's old fixed 150 DPI except for small print
+PDF_DPI = 'auto'
+PDF_AUTO_DPI_CAP = 150
+
+# Pages in flight per PDF job, and finished jobs kept for reuse
+PDF_WORKERS = 4
+PDF_JOB_LIMIT = 32
+
+PDF_TASK_PROMPTS = {
+    "Text Recognition": "Text Recognition:",
+    "Table Recognition (HTML)": "Table Recognition:",
+    "Document Understanding": "Extract all key information:",
+    # Transcription prompt picked per page by page_router from the SAMPLE_CONFIGS prompts
+    "Auto-detect per page": None,
+}
+
+@st.cache_resource
+def pdf_jobs():
+    """
+    Background PDF jobs shared across reruns (and sessions), keyed by file hash + task, and the
+    lock guarding them: sessions run on their own threads, and the script re-runs on every
+    interaction, so the lock has to live in the cached resource rather than at module level
+    """
+    return {}, threading.Lock()
+
+@st.cache_resource
+def page_cache():
+    """Results of already-processed pages, so a re-uploaded revision only OCRs changed pages"""
+    return PageCache()
+
+def pdf_job_key(pdf_bytes, prompt, max_pages):
+    return f"{hashlib.sha256(pdf_bytes).hexdigest()}:{max_pages}:{prompt}"
+
+def start_pdf_job(job_key, pdf_bytes, prompt, max_pages):
+    """Start a background job unless one for the same document and task already exists"""
+    jobs, lock = pdf_jobs()
+    with lock:
+        if job_key not in jobs:
+            # Drop the oldest finished jobs once the registry is full
+            for key in [k for k, job in jobs.items() if job.done][:max(0, len(jobs) - PDF_JOB_LIMIT + 1)]:
+                del jobs[key]
+            router = None
+            if prompt is None:
+                from page_router import SAMPLE_LABELS, PageRouter
+                router = PageRouter(prompts={
+                    SAMPLE_LABELS[name]: config["prompt"]
+                    for name, config in SAMPLE_CONFIGS.items() if name in SAMPLE_LABELS
+                })
+            jobs[job_key] = DocumentJob(
+                pdf_bytes, prompt, max_pages,
+                workers=PDF_WORKERS, dpi=PDF_DPI, server_url=MODEL_SERVER_URL, router=router,
+                cache=page_cache(), auto_dpi_cap=PDF_AUTO_DPI_CAP
+            )
+        return jobs[job_key]
 
 # Custom CSS (same as before)
 st.markdown("""
@@ -109,13 +154,51 @@ def check_server_status():
     except:
         return None
 
+class ServerStatusCache:
+    """
+    Last known server status. Reruns read it instantly; once it is older than `ttl`
+    a background thread refreshes it, so the blocking health probe never runs on a rerun
+    (except the very first one).
+    """
+
+    def __init__(self, ttl=STATUS_TTL):
+        self.ttl = ttl
+        self.status = check_server_status()
+        self.checked_at = time.monotonic()
+        self._refreshing = threading.Lock()
+
+    def _refresh(self):
+        try:
+            self.status = check_server_status()
+            self.checked_at = time.monotonic()
+        finally:
+            self._refreshing.release()
+
+    def get(self):
+        if time.monotonic() - self.checked_at > self.ttl and self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return self.status
+
+@st.cache_resource
+def server_status_cache():
+    return ServerStatusCache()
+
+@st.cache_data(max_entries=256)
+def load_thumbnail(path, mtime, size=(300, 300)):
+    """PNG thumbnail bytes for a gallery image; `mtime` is part of the cache key so edits invalidate it"""
+    with Image.open(path) as img:
+        img.thumbnail(size)
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+    return buf.getvalue()
+
 def process_image_api(image, prompt):
     img_byte_arr = io.BytesIO()
     image.save(img_byte_arr, format='PNG')
     img_byte_arr.seek(0)
 
     files = {'image': ('image.png', img_byte_arr, 'image/png')}
-    data = {'prompt': prompt}
+    data = {'prompt': prompt, 'timeout': 120}
 
     response = requests.post(
         f"{MODEL_SERVER_URL}/predict",
@@ -126,34 +209,41 @@ def process_image_api(image, prompt):
 
     return response.json()
 
-def render_result(output, task_type):
+def show_table(table):
+    """One compact table (header + rows from the server's table pipeline) as a dataframe"""
+    st.dataframe([dict(zip(column_names(table), row)) for row in table["rows"]])
+
+
+def render_result(output, task_type, structured=None):
     if "Table Recognition" in task_type:
         st.markdown("### 📊 Table Output")
         with st.expander("📝 HTML Source"):
             st.code(output, language="html")
-        st.markdown("### Rendered Table")
-        try:
-            st.markdown(output, unsafe_allow_html=True)
-        except:
-            st.warning("Could not render HTML")
+
+        # The server parses the HTML once into normalized grids; older servers only send raw HTML
+        block = page_block({"success": True, "output": output, "structured": structured})
+        tables = block["tables"] if block else []
+        if not tables:
+            st.warning("No table found in the output")
+        for n, table in enumerate(tables, 1):
+            st.markdown(f"### Table {n} ({len(table['rows'])} rows × {table['columns']} columns)")
+            show_table(table)
+            st.download_button("💾 CSV", to_csv(table), file_name=f"table_{n}.csv", key=f"table_csv_{n}")
 
     elif "(JSON)" in task_type:
         st.markdown("### 📋 JSON Output")
-        json_match = re.search(r'```json\s*(.*?)\s*```', output, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
+        if structured:
+            json_str, parsed = structured["json"], structured["data"]
+            if structured.get("error"):
+                st.warning(f"Output does not match the requested schema: {structured['error']}")
         else:
-            json_match = re.search(r'\{.*\}', output, re.DOTALL)
-            json_str = json_match.group(0) if json_match else output
+            json_str, parsed = extract_json(output)
 
         st.code(json_str, language="json")
 
-        try:
-            parsed = json.loads(json_str)
+        if parsed is not None:
             with st.expander("🌲 JSON Tree"):
                 st.json(parsed)
-        except:
-            pass
 
     elif "LaTeX" in task_type or "Formula" in task_type:
         st.markdown("### 🔢 Math Formulas")
@@ -185,7 +275,7 @@ st.markdown("---")
 with st.sidebar:
     st.header("⚙️ Status")
 
-    server_status = check_server_status()
+    server_status = server_status_cache().get()
 
     if server_status and server_status.get('model_loaded'):
         st.success("✅ Server Online")
@@ -249,73 +339,98 @@ with col1:
                 horizontal=True
             )
 
-            temp_pdf = None
+            pdf_bytes = None
 
             if pdf_option == "Sample PDF (3 pages)":
                 sample_pdf = "samples/sample_document.pdf"
                 if os.path.exists(sample_pdf):
-                    temp_pdf = sample_pdf
+                    with open(sample_pdf, 'rb') as f:
+                        pdf_bytes = f.read()
                     st.success("✓ Using sample: Text, Tables, Formulas")
                 else:
                     st.error("Sample PDF not found")
             else:
                 pdf_file = st.file_uploader(
-                    "Upload PDF (max 50MB, 100 pages)",
-                    type=["pdf"]
+                    "Upload PDF or multi-page TIFF (max 50MB, 100 pages)",
+                    type=["pdf", "tif", "tiff"]
                 )
                 if pdf_file:
-                    temp_pdf = "temp_upload.pdf"
-                    with open(temp_pdf, 'wb') as f:
-                        f.write(pdf_file.read())
+                    # The upload's own bytes: Streamlit wraps them as BytesIO(data) on each rerun, and
+                    # getvalue() of an unmodified BytesIO returns that object without a copy
+                    # (getbuffer() would unshare and copy it). PyMuPDF opens it with
+                    # fitz.open(stream=...) and background jobs keep their own reference
+                    pdf_bytes = pdf_file.getvalue()
 
-            if temp_pdf:
+            if pdf_bytes:
                 pdf_mode = True
 
-                # Convert PDF to images
                 try:
-                    images = convert_pdf_to_images(temp_pdf, dpi=150)
-                    st.success(f"✓ PDF loaded: {len(images)} pages")
+                    total_pages = count_pages(pdf_bytes)
+                    st.success(f"✓ PDF loaded: {total_pages} pages")
 
-                    max_pages = st.slider("Pages to process:", 1, min(len(images), 100), min(5, len(images)))
+                    max_pages = st.slider("Pages to process:", 1, min(total_pages, 100), min(5, total_pages))
 
-                    # Show first page preview
+                    # Show first page preview (only page 1 is rendered here)
                     st.markdown("### Preview (Page 1)")
-                    st.image(images[0], use_column_width=True)
+                    preview = next(iter_pages(pdf_bytes, dpi=PDF_DPI, max_pages=1, auto_dpi_cap=PDF_AUTO_DPI_CAP))
+                    st.image(preview['image'], use_column_width=True)
 
                     # Select task
-                    task_type = st.selectbox("Task:", [
-                        "Text Recognition",
-                        "Table Recognition (HTML)",
-                        "Document Understanding"
-                    ])
+                    task_type = st.selectbox("Task:", list(PDF_TASK_PROMPTS))
+                    prompt = PDF_TASK_PROMPTS[task_type]
+                    job_key = pdf_job_key(pdf_bytes, prompt, max_pages)
 
                     if st.button("🚀 Process PDF"):
+                        start_pdf_job(job_key, pdf_bytes, prompt, max_pages)
+                        st.session_state.pdf_job_key = job_key
+
+                    # Keep showing (and following) the job across reruns while inputs are unchanged
+                    if st.session_state.get('pdf_job_key') == job_key:
+                        job = start_pdf_job(job_key, pdf_bytes, prompt, max_pages)
                         with col2:
                             st.header("📋 Results")
                             progress = st.progress(0)
-
-                            for i, img in enumerate(images[:max_pages]):
-                                progress.progress((i + 1) / max_pages)
-                                st.markdown(f"### 📄 Page {i+1}/{max_pages}")
-
-                                # Get prompt
-                                prompts = {
-                                    "Text Recognition": "Text Recognition:",
-                                    "Table Recognition (HTML)": "Table Recognition:",
-                                    "Document Understanding": "Extract all key information:"
-                                }
-                                prompt = prompts.get(task_type, "Text Recognition:")
-
-                                result = process_image_api(img, prompt)
-                                if result.get('success'):
-                                    # Simple display without nested expanders
-                                    output = result['output']
-                                    if "Table" in task_type:
-                                        st.markdown(output, unsafe_allow_html=True)
+                            shown = 0
+
+                            while True:
+                                for result in job.wait(shown, timeout=1.0):
+                                    shown += 1
+                                    progress.progress(shown / max_pages)
+                                    route = result['metadata'].get('route')
+                                    st.markdown(f"### 📄 Page {result['page']}/{max_pages}"
+                                                + (f" · {route['label']}" if route else "")
+                                                + (" · ♻️ reused" if result.get('reused') else ""))
+                                    if result.get('success'):
+                                        # Simple display without nested expanders
+                                        output = result['output']
+                                        block = page_block(result)
+                                        if block and block["tables"]:
+                                            for table in block["tables"]:
+                                                show_table(table)
+                                        else:
+                                            st.code(output, language="text")
                                     else:
-                                        st.code(output, language="text")
+                                        st.error(f"Page {result['page']} failed: {result.get('error')}")
                                     st.markdown("---")
 
+                                if job.done and shown == len(job.results):
+                                    break
+
+                            # Tables that run across page breaks, joined into one
+                            for n, table in enumerate(stitch_tables([page_block(r) for r in job.results]), 1):
+                                if len(table['pages']) > 1:
+                                    st.markdown(f"### 🧩 Table {n}: pages {table['pages'][0]}-{table['pages'][-1]} "
+                                                f"({len(table['rows'])} rows)")
+                                    show_table(table)
+                                    st.download_button("💾 CSV", to_csv(table), file_name=f"table_{n}.csv",
+                                                       key=f"stitched_{job_key}_{n}")
+
+                            reused = sum(1 for r in job.results if r.get('reused'))
+                            if reused:
+                                st.caption(f"♻️ {reused} unchanged page(s) reused from earlier runs")
+                            if job.error:
+                                st.error(f"Error processing PDF: {job.error}")
+
                 except Exception as e:
                     st.error(f"Error processing PDF: {str(e)}")
 
@@ -343,10 +458,9 @@ with col1:
                                 })
 
                                 sample_path = os.path.join(samples_dir, sample_file)
-                                img = Image.open(sample_path)
-                                img.thumbnail((300, 300))
+                                thumbnail = load_thumbnail(sample_path, os.path.getmtime(sample_path))
 
-                                st.image(img, use_column_width=True)
+                                st.image(thumbnail, use_column_width=True)
                                 st.markdown(f"**{config['name']}**")
 
                                 if st.button(f"🚀 Process", key=f"btn_{idx}"):
@@ -382,7 +496,7 @@ with col1:
                             result = process_image_api(uploaded_image, prompt)
 
                             if result.get('success'):
-                                render_result(result['output'], task_name)
+                                render_result(result['output'], task_name, result.get('structured'))
 
                                 file_ext = "json" if "(JSON)" in task_name else "html" if "Table" in task_name else "txt"
                                 st.download_button(
@@ -0,0 +1,432 @@
+"""
+Continuous (iteration-level) batching for the GLM-OCR server
+Each replica runs one scheduler loop. At every decode step, waiting requests are prefilled and
+join the running batch, and sequences that hit EOS, a stopping criterion or their token limit
+leave it. A short receipt therefore no longer waits behind a full-page table. KV memory is
+handed out in fixed-size blocks as sequences grow, instead of being reserved for
+max_new_tokens. When the blocks run out, the newest sequence is preempted and recomputed later.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import torch
+from transformers.cache_utils import Cache, CacheLayerMixin
+
+# "continuous" batches greedy requests at the decode-step level; "off" (default) runs one
+# generate() at a time per replica
+BATCHING = os.getenv("GLM_OCR_BATCHING", "off")
+# Sequences decoded together per step, and prompt tokens prefilled per scheduler iteration
+MAX_BATCH = int(os.getenv("GLM_OCR_MAX_BATCH", 32))
+MAX_PREFILL_TOKENS = int(os.getenv("GLM_OCR_MAX_PREFILL_TOKENS", 8192))
+# Tokens per KV block, and KV pool size per replica (0 = 60% of free GPU memory, 2 GB on CPU),
+# allocated when the first request arrives
+KV_BLOCK_SIZE = int(os.getenv("GLM_OCR_KV_BLOCK_SIZE", 16))
+KV_CACHE_MB = float(os.getenv("GLM_OCR_KV_CACHE_MB", 0))
+KV_MEMORY_FRACTION = 0.6
+CPU_KV_CACHE_MB = 2048
+
+
+def kv_pool_bytes(device):
+    """Bytes to give a replica's KV pool on `device`"""
+    if KV_CACHE_MB:
+        return int(KV_CACHE_MB * 1024 * 1024)
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return int(free * KV_MEMORY_FRACTION)
+    return CPU_KV_CACHE_MB * 1024 * 1024
+
+
+class BlockAllocator:
+    """Free list of KV blocks; a sequence holds ceil(tokens / block_size) of them"""
+
+    def __init__(self, num_blocks, block_size=KV_BLOCK_SIZE):
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self._free = list(range(num_blocks - 1, -1, -1))
+
+    @property
+    def free(self):
+        return len(self._free)
+
+    def blocks_for(self, tokens):
+        return math.ceil(tokens / self.block_size)
+
+    def allocate(self, count):
+        """`count` block ids, or None if there aren't that many free"""
+        if count > len(self._free):
+            return None
+        return [self._free.pop() for _ in range(count)]
+
+    def release(self, blocks):
+        self._free.extend(blocks)
+        blocks.clear()
+
+
+class Sequence:
+    """One request's generation state while it waits for or sits in the running batch"""
+
+    def __init__(self, inputs, max_new_tokens, stopping_criteria, cancel):
+        self.inputs = inputs
+        self.prompt_ids = inputs["input_ids"]
+        self.prompt_length = self.prompt_ids.shape[1]
+        self.max_new_tokens = max_new_tokens
+        self.stopping_criteria = stopping_criteria
+        self.cancel = cancel
+        self.generated = []
+        self.blocks = []
+        # Tokens whose keys/values are in the pool; the last generated token is fed at the next step
+        self.cached = 0
+        self.rope_delta = 0
+        self.state = None  # backend-specific (the stub's planned output)
+        self.preemptions = 0
+        # Replica time charged to this request: its prefills plus its share of each decode step
+        self.gpu_seconds = 0.0
+        self.future = Future()
+
+    @property
+    def length(self):
+        return self.prompt_length + len(self.generated)
+
+    def sequence(self):
+        """Prompt plus generated ids as one [1, length] tensor, like generate() returns"""
+        new = torch.tensor([self.generated], dtype=self.prompt_ids.dtype, device=self.prompt_ids.device)
+        return torch.cat([self.prompt_ids, new], dim=1)
+
+
+class PagedLayer(CacheLayerMixin):
+    """
+    One decoder layer's view of the block pool for a single forward pass: new keys/values are
+    written to their slots, and attention reads each sequence's slots back in order
+    """
+
+    is_sliding = False
+
+    def __init__(self, keys, values, slots, gather, past_length):
+        super().__init__()
+        self.pool_keys, self.pool_values = keys, values
+        self.slots, self.gather, self.past_length = slots, gather, past_length
+        self.is_initialized = True
+
+    def lazy_initialization(self, key_states, value_states):
+        pass
+
+    def update(self, key_states, value_states, *args, **kwargs):
+        batch, heads, length, head_dim = key_states.shape
+        self.pool_keys[self.slots] = key_states.transpose(1, 2).reshape(-1, heads, head_dim)
+        self.pool_values[self.slots] = value_states.transpose(1, 2).reshape(-1, heads, head_dim)
+        if self.past_length == 0:
+            return key_states, value_states
+        keys = self.pool_keys[self.gather].view(batch, -1, heads, head_dim).transpose(1, 2)
+        values = self.pool_values[self.gather].view(batch, -1, heads, head_dim).transpose(1, 2)
+        return keys, values
+
+    def get_mask_sizes(self, query_length, *args):
+        return self.past_length + query_length, 0
+
+    def get_seq_length(self):
+        return self.past_length
+
+    def get_max_length(self):
+        return -1
+
+
+class ModelStepper:
+    """
+    Prefill and batched greedy decode steps of a transformers vision-language model, with keys
+    and values kept in a paged pool: per layer one [blocks * block_size, kv_heads, head_dim]
+    tensor, addressed through each sequence's block list
+    """
+
+    def __init__(self, model, block_size=KV_BLOCK_SIZE):
+        self.model = model
+        config = model.config.get_text_config()
+        self.layers = config.num_hidden_layers
+        heads = config.num_key_value_heads
+        head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+        dtype = model.dtype
+        block_bytes = 2 * self.layers * heads * head_dim * block_size * torch.finfo(dtype).bits // 8
+        self.num_blocks = max(1, kv_pool_bytes(model.device) // block_bytes)
+        self.block_size = block_size
+        self._shape = (self.num_blocks * block_size, heads, head_dim)
+        self.keys = self.values = None
+
+        eos = model.generation_config.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [] if eos is None else [eos])
+        # Batched steps are greedy-exact only if generate() itself would decode greedily
+        generation = model.generation_config
+        self.greedy = not generation.do_sample and (getattr(generation, "num_beams", None) or 1) == 1 \
+            and (getattr(generation, "repetition_penalty", None) or 1.0) == 1.0
+
+    def _slots(self, seq, start, end):
+        positions = torch.arange(start, end)
+        blocks = torch.tensor(seq.blocks)[positions // self.block_size]
+        return (blocks * self.block_size + positions % self.block_size).to(self.model.device)
+
+    def _pool(self):
+        """Allocate the block pool when the first request arrives rather than at startup"""
+        if self.keys is None:
+            # Zeroed, not empty: padded slots are masked out, and 0 * NaN would still poison attention
+            device, dtype = self.model.device, self.model.dtype
+            self.keys = [torch.zeros(self._shape, dtype=dtype, device=device) for _ in range(self.layers)]
+            self.values = [torch.zeros(self._shape, dtype=dtype, device=device) for _ in range(self.layers)]
+
+    def _cache(self, slots, gather, past_length):
+        self._pool()
+        return Cache(layers=[
+            PagedLayer(self.keys[i], self.values[i], slots, gather, past_length) for i in range(self.layers)
+        ])
+
+    def prefill(self, seq):
+        """Run the prompt (plus tokens generated before a preemption) and return the next token"""
+        inputs = dict(seq.inputs)
+        inputs.pop("stub_request", None)
+        if seq.generated:
+            extra = torch.tensor([seq.generated], dtype=seq.prompt_ids.dtype, device=seq.prompt_ids.device)
+            inputs["input_ids"] = torch.cat([seq.prompt_ids, extra], dim=1)
+            inputs["attention_mask"] = torch.ones_like(inputs["input_ids"])
+            if "mm_token_type_ids" in inputs:
+                inputs["mm_token_type_ids"] = torch.cat(
+                    [inputs["mm_token_type_ids"], torch.zeros_like(extra, dtype=inputs["mm_token_type_ids"].dtype)], dim=1
+                )
+        length = inputs["input_ids"].shape[1]
+        slots = self._slots(seq, 0, length)
+        logits = self.model(
+            **inputs, past_key_values=self._cache(slots, slots, 0), use_cache=True, logits_to_keep=1
+        ).logits
+        # Multimodal RoPE: text positions after the image are offset by this much (kept per sequence)
+        deltas = getattr(getattr(self.model, "model", self.model), "rope_deltas", None)
+        seq.rope_delta = int(deltas.view(-1)[0]) if deltas is not None else 0
+        seq.cached = length
+        return int(logits[0, -1].argmax())
+
+    def decode(self, seqs):
+        """One decode step for every running sequence; returns their next tokens"""
+        device = self.model.device
+        past = max(seq.cached for seq in seqs)
+        # Right-padded per sequence: its cached tokens, the token fed now, then padding (masked)
+        gather = torch.zeros(len(seqs), past + 1, dtype=torch.long)
+        mask = torch.zeros(len(seqs), past + 1, dtype=torch.long)
+        for row, seq in enumerate(seqs):
+            gather[row, :seq.cached + 1] = self._slots(seq, 0, seq.cached + 1).cpu()
+            mask[row, :seq.cached + 1] = 1
+        slots = gather[torch.arange(len(seqs)), [seq.cached for seq in seqs]].to(device)
+        positions = torch.tensor([seq.cached + seq.rope_delta for seq in seqs], device=device)
+        input_ids = torch.tensor([[seq.generated[-1]] for seq in seqs], device=device)
+        logits = self.model(
+            input_ids=input_ids,
+            attention_mask=mask.to(device),
+            position_ids=positions.view(1, -1, 1).expand(3, -1, -1),
+            past_key_values=self._cache(slots, gather.view(-1).to(device), past),
+            use_cache=True,
+            logits_to_keep=1,
+        ).logits
+        for seq in seqs:
+            seq.cached += 1
+        return logits[:, -1].argmax(-1).tolist()
+
+
+class ContinuousBatcher:
+    """
+    Iteration-level scheduler for one replica. generate() is called from request threads and
+    blocks until its sequence finishes; a single loop thread owns the model and, every
+    iteration, drops cancelled waiters, prefills new sequences within the KV and prefill
+    budgets, then runs one decode step for the whole running batch.
+    """
+
+    def __init__(self, replica, stepper, max_batch=MAX_BATCH, max_prefill_tokens=MAX_PREFILL_TOKENS):
+        self.replica = replica
+        self.stepper = stepper
+        self.allocator = BlockAllocator(stepper.num_blocks, stepper.block_size)
+        self.max_batch = max_batch
+        self.max_prefill_tokens = max_prefill_tokens
+        self.waiting = deque()
+        self.running = []
+        self._exclusive = deque()
+        self._cond = threading.Condition()
+        self.stats = {"steps": 0, "batched_tokens": 0, "prefills": 0, "preemptions": 0, "exclusive": 0}
+        self.busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{replica.index}", daemon=True)
+        self._thread.start()
+
+    def generate(self, inputs, max_new_tokens, stopping_criteria, generate_kwargs, cancel=None):
+        """
+        Same ids as model.generate(**inputs, ...) (prompt plus generated ids as [1, length]), and
+        the replica seconds to charge the request: its prefills plus its share of each batched step
+        """
+        if generate_kwargs or not self.stepper.greedy:
+            # Speculative / sampling modes keep their own generate loop; run it between steps
+            def run():
+                start = time.perf_counter()
+                ids = self.replica.model.generate(
+                    **inputs, max_new_tokens=max_new_tokens, stopping_criteria=stopping_criteria, **generate_kwargs
+                )
+                return ids, time.perf_counter() - start
+            return self.exclusive(run)
+        seq = Sequence(inputs, max_new_tokens, stopping_criteria, cancel)
+        with self._cond:
+            self.waiting.append(seq)
+            self._cond.notify()
+        return seq.future.result()
+
+    def exclusive(self, fn):
+        """Run fn() on the loop thread while the batch is paused"""
+        future = Future()
+        with self._cond:
+            self._exclusive.append((fn, future))
+            self._cond.notify()
+        return future.result()
+
+    @contextmanager
+    def pause(self):
+        """
+        Hold the loop between steps while the caller uses the model on its own thread, e.g. a
+        request traced by the profiler (torch traces only see ops on the profiled thread)
+        """
+        paused, resume = threading.Event(), threading.Event()
+        with self._cond:
+            self._exclusive.append((lambda: (paused.set(), resume.wait()), Future()))
+            self._cond.notify()
+        paused.wait()
+        try:
+            yield
+        finally:
+            resume.set()
+
+    def status(self):
+        steps = self.stats["steps"]
+        return {
+            "running": len(self.running),
+            "waiting": len(self.waiting),
+            "kv_blocks_free": self.allocator.free,
+            "kv_blocks_total": self.allocator.num_blocks,
+            "mean_batch_size": round(self.stats["batched_tokens"] / steps, 2) if steps else 0.0,
+            **self.stats,
+        }
+
+    def _loop(self):
+        self.replica._pin()
+        with torch.inference_mode():
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self.waiting or self.running or self._exclusive)
+                    exclusive, self._exclusive = self._exclusive, deque()
+                start = time.monotonic()
+                for fn, future in exclusive:
+                    self.stats["exclusive"] += 1
+                    self._settle(future, fn)
+                self._admit()
+                if self.running:
+                    self._step()
+                self.busy_seconds += time.monotonic() - start
+
+    @staticmethod
+    def _settle(future, fn):
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+
+    def _finish(self, seq, error=None):
+        self.allocator.release(seq.blocks)
+        if error is not None:
+            seq.future.set_exception(error)
+        else:
+            seq.future.set_result((seq.sequence(), seq.gpu_seconds))
+
+    def _done(self, seq):
+        """Whether the token just appended ends the sequence (same checks as generate)"""
+        token = seq.generated[-1]
+        if token in self.stepper.eos_token_ids or len(seq.generated) >= seq.max_new_tokens:
+            return True
+        return bool(seq.stopping_criteria) and bool(seq.stopping_criteria(seq.sequence(), None).all())
+
+    def _admit(self):
+        with self._cond:
+            # Never started: the caller sees zero new tokens and raises RequestCancelled
+            for seq in [seq for seq in self.waiting if seq.cancel is not None and seq.cancel.cancelled]:
+                self.waiting.remove(seq)
+                self._finish(seq)
+        budget = self.max_prefill_tokens
+        while self.waiting and len(self.running) < self.max_batch:
+            with self._cond:
+                seq = self.waiting[0]
+                # One sequence always fits the budget, so a huge page can't starve
+                if seq.length > budget and budget < self.max_prefill_tokens:
+                    return
+                blocks = self.allocator.allocate(self.allocator.blocks_for(seq.length + 1))
+                if blocks is None:
+                    if not self.running and not seq.blocks:
+                        self.waiting.popleft()
+                        self._finish(seq, MemoryError(
+                            f"Sequence of {seq.length} tokens doesn't fit the KV pool "
+                            f"({self.allocator.num_blocks} blocks of {self.allocator.block_size})"
+                        ))
+                        continue
+                    return
+                self.waiting.popleft()
+            seq.blocks = blocks
+            budget -= seq.length
+            self.stats["prefills"] += 1
+            start = time.perf_counter()
+            try:
+                seq.generated.append(self.stepper.prefill(seq))
+            except Exception as e:
+                self._finish(seq, e)
+                continue
+            finally:
+                seq.gpu_seconds += time.perf_counter() - start
+            if self._done(seq):
+                self._finish(seq)
+            else:
+                self.running.append(seq)
+
+    def _reserve(self):
+        """Give every running sequence room for one more token, preempting the newest if needed"""
+        for seq in list(self.running):
+            if seq not in self.running:
+                continue
+            while len(seq.blocks) * self.allocator.block_size < seq.cached + 1:
+                block = self.allocator.allocate(1)
+                if block is not None:
+                    seq.blocks.extend(block)
+                    continue
+                victim = self.running.pop()
+                self.allocator.release(victim.blocks)
+                victim.cached = 0
+                victim.preemptions += 1
+                self.stats["preemptions"] += 1
+                with self._cond:
+                    self.waiting.appendleft(victim)
+                if victim is seq:
+                    break
+
+    def _step(self):
+        self._reserve()
+        if not self.running:
+            return
+        start = time.perf_counter()
+        try:
+            tokens = self.stepper.decode(self.running)
+        except Exception as e:
+            for seq in self.running:
+                self._finish(seq, e)
+            self.running = []
+            return
+        share = (time.perf_counter() - start) / len(self.running)
+        self.stats["steps"] += 1
+        self.stats["batched_tokens"] += len(self.running)
+        still_running = []
+        for seq, token in zip(self.running, tokens):
+            seq.gpu_seconds += share
+            seq.generated.append(token)
+            if self._done(seq):
+                self._finish(seq)
+            else:
+                still_running.append(seq)
+        self.running = still_running
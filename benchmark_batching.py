@@ -0,0 +1,95 @@
+"""
+Benchmark continuous batching on a mixed workload
+Sends demo.py's seven task types, with each sample scaled to a few sizes so output lengths
+range from a short receipt to a long table, from a fixed number of concurrent clients. Reports
+throughput and p50/p99 latency overall and per task, plus the server's mean decode batch size.
+Run it once against a server started with the default (GLM_OCR_BATCHING=off) and once with
+GLM_OCR_BATCHING=continuous to compare.
+
+Usage:
+  python benchmark_batching.py
+  python benchmark_batching.py --requests 280 --concurrency 32
+"""
+
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+from demo import SAMPLES_DIR, SERVER_URL, TESTS
+
+# Sample scales: output length grows with page area, so this spreads lengths about 10x
+SCALES = (0.5, 0.8, 1.2, 1.6)
+
+
+def workload(count):
+    """(task name, PNG bytes, prompt) cycling through tasks and scales"""
+    images = {}
+    jobs = []
+    for i in range(count):
+        filename, prompt, name = TESTS[i % len(TESTS)]
+        scale = SCALES[(i // len(TESTS)) % len(SCALES)]
+        if (filename, scale) not in images:
+            image = Image.open(os.path.join(SAMPLES_DIR, filename)).convert("RGB")
+            image = image.resize((int(image.width * scale), int(image.height * scale)))
+            buf = io.BytesIO()
+            image.save(buf, format="PNG")
+            images[filename, scale] = buf.getvalue()
+        jobs.append((name, images[filename, scale], prompt))
+    return jobs
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(url, jobs, concurrency):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def post(job):
+        name, image_bytes, prompt = job
+        start = time.perf_counter()
+        response = session.post(f"{url}/predict", files={"image": ("page.png", image_bytes, "image/png")},
+                                data={"prompt": prompt}, timeout=600)
+        result = response.json()
+        return name, time.perf_counter() - start, result.get("usage", {}).get("output_tokens", 0), result.get("success")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(post, jobs))
+    return results, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark a mixed-length workload (continuous vs request-level batching)")
+    parser.add_argument("--server-url", default=SERVER_URL)
+    parser.add_argument("--requests", type=int, default=140)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    mode = requests.get(f"{args.server_url}/", timeout=10).json().get("batching", "off")
+    results, seconds = run(args.server_url, workload(args.requests), args.concurrency)
+    failures = sum(1 for *_, ok in results if not ok)
+    latencies = [latency for _, latency, _, _ in results]
+    tokens = sum(tokens for _, _, tokens, _ in results)
+
+    print(f"batching={mode}  requests={len(results)}  concurrency={args.concurrency}  failures={failures}")
+    print(f"{seconds:.1f}s  {len(results) / seconds:.2f} req/s  {tokens / seconds:.0f} output tok/s  "
+          f"p50 {percentile(latencies, 0.5):.2f}s  p99 {percentile(latencies, 0.99):.2f}s")
+    print(f"\n{'task':<24} {'tokens':>7} {'p50 s':>7} {'p99 s':>7}")
+    for _, _, name in TESTS:
+        task = [(latency, tokens) for n, latency, tokens, _ in results if n == name]
+        if task:
+            mean_tokens = sum(t for _, t in task) / len(task)
+            print(f"{name:<24} {mean_tokens:>7.0f} {percentile([l for l, _ in task], 0.5):>7.2f} "
+                  f"{percentile([l for l, _ in task], 0.99):>7.2f}")
+
+    for replica in requests.get(f"{args.server_url}/metrics", timeout=10).json().get("batching", []):
+        print(f"\nmean decode batch {replica['mean_batch_size']}  steps {replica['steps']}  "
+              f"preemptions {replica['preemptions']}  KV blocks {replica['kv_blocks_total']}")
@@ -0,0 +1,127 @@
+"""
+Benchmark assisted decoding against normal (greedy) decoding
+Reports tokens per second and exact-match parity per decoding mode
+
+Usage:
+  python benchmark_decoding.py                 # against a running server, demo.py samples
+  python benchmark_decoding.py --cpu           # offline, small CPU model (no server or GPU needed)
+  python benchmark_decoding.py --cpu --model distilgpt2
+"""
+
+import argparse
+import os
+import time
+
+import requests
+
+from demo import SAMPLES_DIR, SERVER_URL, TESTS
+
+# OCR-like text: the continuation mostly repeats what is already in the context
+CPU_PROMPTS = [
+    "Invoice INV-2024-001\nItem: Widget A, Qty: 2, Price: 10.00\nItem: Widget B, Qty: 1, Price: 5.00\n" * 4,
+    "<table><tr><td>Region</td><td>Q1</td><td>Q2</td></tr><tr><td>North</td><td>120</td><td>130</td></tr>" * 4,
+    "The quick brown fox jumps over the lazy dog. " * 12,
+]
+
+
+def _summarize(mode, tokens, seconds, matches, total):
+    rate = tokens / seconds if seconds else 0
+    print(f"{mode:<15} {tokens:>8} tok {seconds:>8.2f}s {rate:>9.1f} tok/s   exact match {matches}/{total}")
+    return rate
+
+
+def bench_server(modes, server_url):
+    """Send every demo.py sample once per decoding mode and compare outputs with greedy"""
+    status = requests.get(f"{server_url}/", timeout=2).json()
+    available = status.get("decoding_modes", ["greedy"])
+    modes = [m for m in modes if m in available]
+
+    outputs = {}
+    for mode in ["greedy"] + modes:
+        tokens = seconds = matches = 0
+        for filename, prompt, name in TESTS:
+            with open(os.path.join(SAMPLES_DIR, filename), 'rb') as f:
+                result = requests.post(
+                    f"{server_url}/predict",
+                    files={'image': ('image.png', f, 'image/png')},
+                    data={'prompt': prompt, 'decoding': mode},
+                    timeout=300
+                ).json()
+            if not result.get('success'):
+                print(f"✗ {name} ({mode}): {result.get('error')}")
+                continue
+            stats = result['generation']
+            tokens += stats['new_tokens']
+            seconds += stats['seconds']
+            outputs.setdefault(filename, result['output'])
+            matches += result['output'] == outputs[filename]
+        _summarize(mode, tokens, seconds, matches, len(TESTS))
+
+
+def tiny_cpu_models():
+    """Tiny random GPT-2 target and draft over byte-level ids, plus CPU_PROMPTS as ids: no download"""
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(n_layer=4, n_embd=128, n_head=4, vocab_size=256)).eval()
+    draft = GPT2LMHeadModel(GPT2Config(n_layer=1, n_embd=128, n_head=4, vocab_size=256)).eval()
+    prompts = [torch.tensor([list(p.encode("utf-8"))]) for p in CPU_PROMPTS]
+    return model, draft, prompts
+
+
+def bench_cpu(modes, model_name, max_new_tokens):
+    """Compare decoding modes on a small CPU causal LM (random weights unless --model is given)"""
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from decoding import generation_kwargs
+
+    if model_name:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+        prompts = [tokenizer(p, return_tensors="pt").input_ids for p in CPU_PROMPTS]
+        draft = model
+    else:
+        # Offline, so no download is needed
+        model, draft, prompts = tiny_cpu_models()
+
+    reference = {}
+    for mode in ["greedy"] + modes:
+        tokens = seconds = matches = 0
+        for n, input_ids in enumerate(prompts):
+            kwargs = generation_kwargs(mode, draft)
+            start = time.perf_counter()
+            with torch.no_grad():
+                output = model.generate(
+                    input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    max_new_tokens=max_new_tokens,
+                    min_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=0,
+                    **kwargs
+                )
+            seconds += time.perf_counter() - start
+            new_tokens = output[0][input_ids.shape[1]:].tolist()
+            tokens += len(new_tokens)
+            reference.setdefault(n, new_tokens)
+            matches += new_tokens == reference[n]
+        _summarize(mode, tokens, seconds, matches, len(prompts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark GLM-OCR decoding modes")
+    parser.add_argument("--cpu", action="store_true", help="Run offline on a small CPU model instead of the server")
+    parser.add_argument("--model", help="HF causal LM for --cpu (default: tiny random GPT-2)")
+    parser.add_argument("--modes", default="prompt_lookup,assisted", help="Modes to compare with greedy")
+    parser.add_argument("--max-new-tokens", type=int, default=256, help="Tokens generated per prompt in --cpu mode")
+    parser.add_argument("--server-url", default=SERVER_URL)
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip() and m.strip() != "greedy"]
+    print(f"{'mode':<15} {'tokens':>12} {'time':>9} {'rate':>15}")
+    if args.cpu:
+        bench_cpu(modes, args.model, args.max_new_tokens)
+    else:
+        bench_server(modes, args.server_url)
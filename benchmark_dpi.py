@@ -0,0 +1,94 @@
+"""
+Benchmark adaptive DPI against fixed render DPIs
+Compares pixels per page, render + PNG encode time and upload size; with --server,
+also OCR time, accuracy against the PDF's text layer (the ground truth for born-digital pages)
+and text similarity to the highest fixed DPI
+
+Usage:
+  python benchmark_dpi.py                                  # samples/sample_document.pdf
+  python benchmark_dpi.py document.pdf --fixed 150,200 --auto-caps 150,200 --server
+"""
+
+import argparse
+import difflib
+import io
+import re
+import time
+
+from document_reader import AUTO_DPI_CAP, iter_pages
+from pdf_processor import process_pdf_page
+
+
+def _words(text):
+    """Whitespace-normalised text, so line breaks and indentation don't count as OCR errors"""
+    return " ".join(re.sub(r"[*#|`_]", " ", text).split())
+
+
+def accuracy(output, truth):
+    """Similarity of OCR output to the page's text layer, or None for pages without one"""
+    if not truth or not truth.strip():
+        return None
+    return difflib.SequenceMatcher(None, _words(output), _words(truth), autojunk=False).ratio()
+
+
+def bench(pdf_path, dpi, server_url=None, prompt="Text Recognition:", auto_dpi_cap=AUTO_DPI_CAP):
+    """Render every page at `dpi`; returns per-page stats"""
+    stats = []
+    pages = iter_pages(pdf_path, dpi=dpi, with_text=True, auto_dpi_cap=auto_dpi_cap)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        if page is None:
+            break
+        buf = io.BytesIO()
+        page['image'].save(buf, format='PNG')
+        row = {
+            'page': page['page'],
+            'dpi': page['metadata']['dpi'],
+            'pixels': page['width'] * page['height'],
+            'png_bytes': buf.tell(),
+            'render_s': time.perf_counter() - start,
+        }
+        if server_url:
+            start = time.perf_counter()
+            result = process_pdf_page(page['image'], prompt, server_url)
+            row['ocr_s'] = time.perf_counter() - start
+            row['output'] = result.get('output', '')
+            row['accuracy'] = accuracy(row['output'], page.get('text'))
+        stats.append(row)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark adaptive vs fixed PDF render DPI")
+    parser.add_argument("pdf_file", nargs="?", default="samples/sample_document.pdf")
+    parser.add_argument("--fixed", default="150,200", help="Comma-separated fixed DPIs to compare")
+    parser.add_argument("--auto-caps", default="150,200",
+                        help="Comma-separated caps for auto DPI: the app's (150) and the CLI's (200)")
+    parser.add_argument("--server", action="store_true", help="Also OCR every page via the server")
+    parser.add_argument("--server-url", default="http://localhost:8508")
+    args = parser.parse_args()
+
+    fixed = [int(d) for d in args.fixed.split(",")]
+    server_url = args.server_url if args.server else None
+    runs = {f"{d} dpi": bench(args.pdf_file, d, server_url) for d in fixed}
+    for cap in (int(c) for c in args.auto_caps.split(",")):
+        runs[f"auto<={cap}"] = bench(args.pdf_file, "auto", server_url, auto_dpi_cap=cap)
+    reference = runs[f"{max(fixed)} dpi"]
+
+    print(f"{args.pdf_file}: {len(reference)} pages\n")
+    print(f"{'mode':<10} {'dpi/page':<16} {'Mpixels':>8} {'PNG KB':>8} {'render s':>9}", end="")
+    print(f" {'OCR s':>7} {'accuracy':>9} {'similarity':>10}" if server_url else "")
+    for name, stats in runs.items():
+        dpis = ",".join(str(row['dpi']) for row in stats)
+        line = (f"{name:<10} {dpis:<16} {sum(r['pixels'] for r in stats) / 1e6:>8.2f} "
+                f"{sum(r['png_bytes'] for r in stats) / 1024:>8.0f} {sum(r['render_s'] for r in stats):>9.2f}")
+        if server_url:
+            similarity = sum(
+                difflib.SequenceMatcher(None, r['output'], ref['output']).ratio()
+                for r, ref in zip(stats, reference)
+            ) / len(stats)
+            scored = [r['accuracy'] for r in stats if r['accuracy'] is not None]
+            score = f"{sum(scored) / len(scored):.3f}" if scored else "n/a"
+            line += f" {sum(r['ocr_s'] for r in stats):>7.2f} {score:>9} {similarity:>10.3f}"
+        print(line)
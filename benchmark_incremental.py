@@ -0,0 +1,73 @@
+"""
+Benchmark incremental re-OCR: process a generated N-page PDF, change a few pages (edited text,
+an added signature annotation, an appended page), and process it again with the page cache
+Reports pages sent to the server and wall time for the first run and the resubmission.
+
+Usage:
+  python benchmark_incremental.py
+  python benchmark_incremental.py --pages 100 --changed 2
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import fitz
+
+from demo import SERVER_URL
+from ocr_client import OCRClient
+from page_cache import PageCache
+from pdf_processor import process_pdf
+
+
+def make_pdf(path, pages, edited=(), signed=(), extra=0):
+    """Text pages; `edited` pages get different text, `signed` pages a signature stamp"""
+    doc = fitz.open()
+    for i in range(pages + extra):
+        page = doc.new_page()
+        body = f"Page {i + 1}\n" + "\n".join(f"Clause {i + 1}.{n}: terms and conditions apply." for n in range(30))
+        if i in edited:
+            body = body.replace("terms and conditions", "amended terms")
+        page.insert_text((72, 72), body, fontsize=10)
+        if i in signed:
+            page.add_stamp_annot(fitz.Rect(350, 700, 550, 760), stamp=fitz.STAMP_Approved)
+    doc.save(path)
+    doc.close()
+
+
+def run(path, client, cache):
+    """Returns (results, seconds) with process_pdf's console output suppressed"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = process_pdf(path, client=client, cache=cache)
+    return results, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark incremental re-OCR with per-page fingerprints")
+    parser.add_argument("--server-url", default=SERVER_URL)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--changed", type=int, default=1, help="Pages whose text is edited")
+    args = parser.parse_args()
+
+    client = OCRClient([args.server_url])
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PageCache(os.path.join(tmp, "page_cache.db"))
+        original = os.path.join(tmp, "original.pdf")
+        revised = os.path.join(tmp, "revised.pdf")
+        make_pdf(original, args.pages)
+        edited = set(range(1, args.pages, max(1, args.pages // max(1, args.changed))))
+        make_pdf(revised, args.pages, edited=list(edited)[:args.changed], signed=[args.pages - 1], extra=1)
+
+        print(f"{'run':<14} {'pages':>6} {'sent':>6} {'reused':>7} {'seconds':>8}")
+        for name, path in (("original", original), ("resubmitted", revised), ("unchanged", revised)):
+            results, seconds = run(path, client, cache)
+            reused = [r['page'] for r in results if r.get('reused')]
+            print(f"{name:<14} {len(results):>6} {len(results) - len(reused):>6} {len(reused):>7} {seconds:>8.2f}")
+            if name == "resubmitted":
+                sent = sorted(set(r['page'] for r in results) - set(reused))
+                print(f"{'':<14} sent pages: {sent}")
+    client.close()
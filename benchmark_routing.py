@@ -0,0 +1,203 @@
+"""
+Benchmark per-page prompt routing against a single fixed prompt
+Reports routing accuracy and classification time on the labelled samples (which the thresholds
+were tuned on) and, separately, on held-out synthetic pages rendered from seeded random layouts;
+with --server, also OCR time, generated tokens and similarity to the output of each page's
+correct prompt
+
+Usage:
+  python benchmark_routing.py
+  python benchmark_routing.py --labels all --held-out 100
+  python benchmark_routing.py --server --fixed-prompt "Text Recognition:"
+"""
+
+import argparse
+import difflib
+import io
+import os
+import random
+import time
+
+from demo import SAMPLES_DIR, SERVER_URL
+from document_reader import iter_pages
+from ocr_client import OCRClient
+from page_router import PROMPTS, SAMPLE_LABELS, TRANSCRIPTION_LABELS, PageRouter
+
+# Expected labels for the pages of samples/sample_document.pdf
+PDF_LABELS = {"sample_document.pdf": ["table", "table", "formula"]}
+
+# Held-out page kinds: (expected label, renderer name). Prose is expected as "text" at any
+# length: "document" (summarize) is a task choice, not something a page looks like. Image pages
+# have no text layer, so formulas aren't generated
+HELD_OUT_KINDS = (("text", "prose"), ("table", "grid"), ("form", "fields"),
+                  ("invoice", "receipt"), ("handwriting", "photo"))
+
+WORDS = ("the of and to in is for on with as by at from this that are be or an it which report "
+         "results data page section total amount date name value method system model number "
+         "table figure analysis review quarterly revenue customer account address signature").split()
+
+
+def labelled_pages():
+    """Yield (name, page dict with text layer, expected label) for every labelled sample page"""
+    for filename, label in SAMPLE_LABELS.items():
+        for page in iter_pages(os.path.join(SAMPLES_DIR, filename), with_text=True):
+            yield f"{filename}#1", page, label
+    for filename, labels in PDF_LABELS.items():
+        for page, label in zip(iter_pages(os.path.join(SAMPLES_DIR, filename), dpi='auto', with_text=True), labels):
+            yield f"{filename}#{page['page']}", page, label
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def _render(kind, rng):
+    """One synthetic page image of the given kind (A4 at ~100-150 DPI, random font size and margins)"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    width = rng.randint(830, 1240)
+    height = int(width * 1.414)
+    paper = (255, 255, 255)
+    if kind == "photo":
+        # Notes photographed on coloured / grey paper
+        paper = rng.choice([(250, 235, 150), (200, 200, 195), (180, 210, 240), (245, 200, 210)])
+    image = Image.new("RGB", (width, height), paper)
+    draw = ImageDraw.Draw(image)
+    size = rng.randint(14, 24)
+    font = ImageFont.load_default(size)
+    margin = rng.randint(40, 120)
+    line = int(size * rng.uniform(1.4, 1.9))
+    ink = (20, 20, 20) if kind != "photo" else rng.choice([(20, 30, 120), (30, 30, 30)])
+    y = margin
+
+    if kind in ("prose", "photo"):
+        for _ in range(rng.randint(4, 60 if kind == "prose" else 20)):
+            if y > height - margin:
+                break
+            draw.text((margin, y), _words(rng, rng.randint(4, (width - 2 * margin) // (size * 4))), font=font, fill=ink)
+            y += line * rng.choice([1, 1, 1, 2])
+    elif kind == "grid":
+        draw.text((margin, y), _words(rng, 4), font=font, fill=ink)
+        y += 2 * line
+        rows, cols = rng.randint(4, 14), rng.randint(3, 6)
+        cell_w, cell_h = (width - 2 * margin) // cols, line + 8
+        for r in range(rows + 1):
+            draw.line([(margin, y + r * cell_h), (margin + cols * cell_w, y + r * cell_h)], fill=ink, width=2)
+        for c in range(cols + 1):
+            draw.line([(margin + c * cell_w, y), (margin + c * cell_w, y + rows * cell_h)], fill=ink, width=2)
+        for r in range(rows):
+            for c in range(cols):
+                draw.text((margin + c * cell_w + 6, y + r * cell_h + 4), _words(rng, 1), font=font, fill=ink)
+    elif kind == "fields":
+        draw.text((margin, y), _words(rng, 3).upper(), font=font, fill=ink)
+        y += 2 * line
+        for _ in range(rng.randint(4, 10)):
+            label = _words(rng, rng.randint(1, 2)) + ":"
+            draw.text((margin, y), label, font=font, fill=ink)
+            start = margin + int(draw.textlength(label, font=font)) + 10
+            draw.line([(start, y + size), (start + rng.randint(150, 350), y + size)], fill=ink, width=1)
+            y += 2 * line
+    elif kind == "receipt":
+        left = rng.randint(margin, width // 4)
+        right = width - left
+        draw.text((left, y), _words(rng, 2).upper(), font=font, fill=ink)
+        y += 2 * line
+        dash = "-" * int((right - left) / draw.textlength("-", font=font))
+        for _ in range(rng.randint(2, 4)):
+            draw.text((left, y), dash, font=font, fill=ink)
+            y += line
+            for _ in range(rng.randint(2, 6)):
+                draw.text((left, y), _words(rng, 2), font=font, fill=ink)
+                draw.text((right - size * 4, y), f"{rng.uniform(1, 99):.2f}", font=font, fill=ink)
+                y += line
+        draw.text((left, y), dash, font=font, fill=ink)
+    return image
+
+
+def held_out_pages(n, seed=0):
+    """Yield (name, page dict, expected label) for n synthetic pages, cycling through HELD_OUT_KINDS"""
+    rng = random.Random(seed)
+    for i in range(n):
+        label, kind = HELD_OUT_KINDS[i % len(HELD_OUT_KINDS)]
+        image = _render(kind, rng)
+        yield f"held-out {kind} {i + 1}", {'image': image, 'page': i + 1, 'metadata': {}}, label
+
+
+def ocr(client, page, prompt):
+    """Returns (output, new tokens, seconds) for one page"""
+    buf = io.BytesIO()
+    page['image'].save(buf, format='PNG')
+    start = time.perf_counter()
+    result = client.predict(buf.getvalue(), prompt)
+    seconds = time.perf_counter() - start
+    return result.get('output', ''), result.get('generation', {}).get('new_tokens', 0), seconds
+
+
+def evaluate(pages, router, client=None, fixed_prompt=None, verbose=True):
+    """Route each page; the expected label goes through the router's fallback like the routed one"""
+    rows = []
+    for name, page, expected in pages:
+        if expected not in router.labels:
+            expected = router.fallback
+        start = time.perf_counter()
+        _, info = router.route(page)
+        label = info['label']
+        row = {'name': name, 'expected': expected, 'label': label, 'classify_s': time.perf_counter() - start}
+        if client:
+            oracle = ocr(client, page, PROMPTS[expected])
+            for mode, prompt in (("fixed", fixed_prompt), ("routed", PROMPTS[label])):
+                output, tokens, seconds = oracle if prompt == PROMPTS[expected] else ocr(client, page, prompt)
+                row[mode] = {
+                    'tokens': tokens,
+                    'seconds': seconds,
+                    'similarity': difflib.SequenceMatcher(None, output, oracle[0]).ratio(),
+                }
+        rows.append(row)
+        if verbose or label != expected:
+            print(f"{name:<32} expected {expected:<12} routed {label:<12} {row['classify_s'] * 1000:>5.0f} ms"
+                  f"{'' if label == expected else '   ✗'}")
+    return rows
+
+
+def report(title, rows, client=None):
+    correct = sum(r['label'] == r['expected'] for r in rows)
+    classify_s = sum(r['classify_s'] for r in rows)
+    print(f"\n{title}: routing accuracy {correct}/{len(rows)} ({correct / len(rows):.0%}), "
+          f"{classify_s / len(rows) * 1000:.0f} ms/page ({len(rows) / classify_s:.1f} pages/s)")
+    for expected in sorted({r['expected'] for r in rows}):
+        group = [r for r in rows if r['expected'] == expected]
+        hits = sum(r['label'] == expected for r in group)
+        print(f"  {expected:<12} {hits}/{len(group)}")
+
+    if client:
+        print(f"\n{'mode':<8} {'tokens':>8} {'OCR s':>8} {'pages/s':>8} {'similarity to correct prompt':>30}")
+        for mode in ("fixed", "routed"):
+            tokens = sum(r[mode]['tokens'] for r in rows)
+            seconds = sum(r[mode]['seconds'] for r in rows)
+            similarity = sum(r[mode]['similarity'] for r in rows) / len(rows)
+            if mode == "routed":
+                seconds += classify_s
+            print(f"{mode:<8} {tokens:>8} {seconds:>8.2f} {len(rows) / seconds:>8.2f} {similarity:>30.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-page prompt routing vs a fixed prompt")
+    parser.add_argument("--fixed-prompt", default="Text Recognition:", help="Prompt used for every page in the baseline")
+    parser.add_argument("--labels", default=",".join(TRANSCRIPTION_LABELS),
+                        help="Allowed labels as for pdf_processor.py --route, or 'all' (default: transcription labels)")
+    parser.add_argument("--held-out", type=int, default=50, help="Number of held-out synthetic pages (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the held-out pages")
+    parser.add_argument("--server", action="store_true", help="Also OCR every page via the server")
+    parser.add_argument("--server-url", default=SERVER_URL)
+    args = parser.parse_args()
+
+    router = PageRouter(labels="all" if args.labels == "all" else args.labels.split(","))
+    client = OCRClient([args.server_url]) if args.server else None
+    print(f"Allowed labels: {', '.join(sorted(router.labels))} (others fall back to {router.fallback})\n")
+
+    # The thresholds in page_router.classify were tuned on these pages, so this score is optimistic
+    report("Tuning samples", evaluate(labelled_pages(), router, client, args.fixed_prompt), client)
+    if args.held_out:
+        print()
+        rows = evaluate(held_out_pages(args.held_out, args.seed), router, client, args.fixed_prompt, verbose=False)
+        report("Held-out pages", rows, client)
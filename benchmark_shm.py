@@ -0,0 +1,98 @@
+"""
+Benchmark same-host page transports: PNG over HTTP /predict, PNG over the stream API,
+and raw pixels through shared memory (shm_transport.py)
+Pages are the rendered sample PDF and sample images at full size; each transport is timed
+end to end from a PIL page to its result, including PNG encoding where it applies.
+Run the server on this host with the stub backend and zero model latency
+(GLM_OCR_BACKEND=stub GLM_OCR_STUB_PREFILL_BASE_MS=0 ...) to see transport cost alone.
+
+Usage:
+  python benchmark_shm.py
+  python benchmark_shm.py --pages 200 --workers 8
+"""
+
+import argparse
+import glob
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from PIL import Image
+
+from demo import SAMPLES_DIR, SERVER_URL
+from document_reader import iter_pages
+from ocr_client import OCRClient
+from shm_transport import SharedMemoryClient
+from stream_client import DEFAULT_STREAM_PORT, StreamClient
+
+
+def sample_pages(count):
+    """`count` PIL pages cycling through the rendered sample PDF and the sample PNGs"""
+    pages = [page['image'] for page in iter_pages(os.path.join(SAMPLES_DIR, "sample_document.pdf"))]
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.png"))):
+        pages.append(Image.open(path).convert("RGB"))
+    return [pages[i % len(pages)] for i in range(count)]
+
+
+class StreamPNG:
+    """Stream API with PNG payloads, for comparison"""
+
+    def __init__(self, host, port):
+        self.stream = StreamClient(host, port)
+
+    def predict_image(self, image, prompt):
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        return self.stream.predict(buf.getvalue(), prompt)
+
+    def close(self):
+        self.stream.close()
+
+
+def run(client, pages, workers, prompt):
+    """Returns (pages/s, p50 latency s, client CPU ms per page, failures)"""
+    def one(image):
+        start = time.perf_counter()
+        result = client.predict_image(image, prompt)
+        return time.perf_counter() - start, bool(result.get('success'))
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(one, pages))
+    seconds = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    latencies = sorted(r[0] for r in results)
+    return len(pages) / seconds, latencies[len(latencies) // 2], cpu / len(pages) * 1000, sum(not r[1] for r in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark HTTP, stream and shared-memory page transports")
+    parser.add_argument("--server-url", default=SERVER_URL)
+    parser.add_argument("--stream-port", type=int, default=DEFAULT_STREAM_PORT)
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4, help="Pages in flight, as in pdf_processor.py")
+    parser.add_argument("--prompt", default="Text Recognition:")
+    args = parser.parse_args()
+
+    host = urlparse(args.server_url).hostname
+    pages = sample_pages(args.pages)
+    megapixels = sum(p.width * p.height for p in pages) / len(pages) / 1e6
+    print(f"{len(pages)} pages, {megapixels:.2f} MP avg, {args.workers} workers\n")
+    print(f"{'transport':<12} {'pages/s':>9} {'p50 ms':>9} {'client CPU ms/page':>20} {'failures':>9}")
+
+    transports = [
+        ("http+png", lambda: OCRClient([args.server_url])),
+        ("stream+png", lambda: StreamPNG(host, args.stream_port)),
+        ("shm", lambda: SharedMemoryClient(host, args.stream_port)),
+    ]
+    for name, make in transports:
+        client = make()
+        try:
+            run(client, pages[:args.workers], args.workers, args.prompt)  # warm-up
+            rate, p50, cpu_ms, failures = run(client, pages, args.workers, args.prompt)
+        finally:
+            client.close()
+        print(f"{name:<12} {rate:>9.1f} {p50 * 1000:>9.1f} {cpu_ms:>20.1f} {failures:>9}")
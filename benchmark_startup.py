@@ -0,0 +1,65 @@
+"""
+Measure client cold start: wall time and peak memory of fresh interpreters
+importing the client modules / running the CLI, plus which heavy packages got loaded
+
+Usage:
+  python benchmark_startup.py
+  python benchmark_startup.py --runs 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HEAVY = ("torch", "transformers", "fitz", "pymupdf", "PIL", "pyarrow", "streamlit")
+
+TARGETS = [
+    ("import pdf_processor", ["-c", "import pdf_processor"]),
+    ("import ocr_client", ["-c", "import ocr_client"]),
+    ("import demo", ["-c", "import demo"]),
+    ("pdf_processor.py --help", ["pdf_processor.py", "--help"]),
+]
+
+# Runs in each child at exit (also after --help's SystemExit): heavy packages loaded and peak RSS
+PROBE = """
+import atexit, resource, sys
+def _report():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    heavy = sorted({m.split('.')[0] for m in sys.modules} & set(%r))
+    print('PROBE', peak // 1024 if sys.platform == 'darwin' else peak, *heavy, file=sys.stderr)
+atexit.register(_report)
+""" % (HEAVY,)
+
+
+def measure(args, runs):
+    """Median wall time (s), peak RSS (MB) and heavy modules loaded over `runs` fresh processes"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    if args[0] == "-c":
+        code = PROBE + args[1]
+    else:
+        code = PROBE + f"import runpy; sys.argv = {args!r}; runpy.run_path({args[0]!r}, run_name='__main__')"
+
+    times, peaks, heavy = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        report = next((line.split()[1:] for line in proc.stderr.splitlines() if line.startswith("PROBE")), None)
+        if report:
+            peaks.append(int(report[0]) / 1024)
+            heavy = report[1:]
+    return sorted(times)[len(times) // 2], max(peaks, default=0.0), " ".join(heavy) or "-"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark GLM-OCR client cold start")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per target")
+    args = parser.parse_args()
+
+    baseline, _, _ = measure(["-c", "pass"], args.runs)
+    print(f"{'target':<26} {'median':>8} {'over bare':>10} {'peak RSS':>9}  heavy modules loaded")
+    for name, target in TARGETS:
+        seconds, peak_mb, heavy = measure(target, args.runs)
+        print(f"{name:<26} {seconds * 1000:>6.0f}ms {(seconds - baseline) * 1000:>8.0f}ms {peak_mb:>7.1f}MB  {heavy}")
@@ -0,0 +1,103 @@
+"""
+Benchmark the binary stream API against multipart /predict on small images
+Sends the same small receipt crops both ways at the same concurrency and reports requests/s
+and latency. Run the server with the stub backend and zero model latency
+(GLM_OCR_STUB_PREFILL_BASE_MS=0 ...) to see transport overhead alone.
+
+Usage:
+  python benchmark_stream.py
+  python benchmark_stream.py --requests 2000 --concurrency 32 --width 320
+"""
+
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from PIL import Image
+
+from demo import SAMPLES_DIR, SERVER_URL
+from stream_client import DEFAULT_STREAM_PORT, StreamClient
+
+
+def small_images(count, width):
+    """`count` distinct PNG crops of the receipt sample, `width` pixels wide"""
+    receipt = Image.open(os.path.join(SAMPLES_DIR, "3_invoice_receipt.png")).convert("L")
+    receipt.thumbnail((width * 2, width * 8))
+    images = []
+    for i in range(count):
+        top = (i * 7) % max(1, receipt.height - width // 2)
+        buf = io.BytesIO()
+        receipt.crop((i % width, top, i % width + width, top + width // 2)).save(buf, format="PNG")
+        images.append(buf.getvalue())
+    return images
+
+
+def summarize(name, latencies, seconds, failures):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{name:<10} {len(latencies) / seconds:>9.1f} {p50:>9.1f} {p95:>9.1f} {failures:>9}")
+
+
+def run_multipart(url, images, concurrency, prompt):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def post(image_bytes):
+        start = time.perf_counter()
+        response = session.post(f"{url}/predict", files={"image": ("page.png", image_bytes, "image/png")},
+                                data={"prompt": prompt})
+        return time.perf_counter() - start, response.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(post, images))
+    return [r[0] for r in results], time.perf_counter() - start, sum(not r[1] for r in results)
+
+
+def run_stream(host, port, images, concurrency, prompt):
+    latencies, failures = [], 0
+    with StreamClient(host, port) as client:
+        start = time.perf_counter()
+        sent = {}
+        futures = []
+        for image_bytes in images:
+            future = client.submit(image_bytes, prompt)
+            sent[id(future)] = time.perf_counter()
+            future.add_done_callback(lambda f: latencies.append(time.perf_counter() - sent[id(f)]))
+            futures.append(future)
+            # Keep `concurrency` requests in flight, like the multipart worker pool
+            if len(futures) >= concurrency:
+                futures.pop(0).result()
+        for future in futures:
+            future.result()
+        seconds = time.perf_counter() - start
+        failures = sum(1 for f in futures if f.result()["status"] != 200)
+    return latencies, seconds, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the binary stream API vs multipart /predict")
+    parser.add_argument("--server-url", default=SERVER_URL)
+    parser.add_argument("--stream-port", type=int, default=DEFAULT_STREAM_PORT)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--width", type=int, default=256, help="Width of the small images in pixels")
+    parser.add_argument("--prompt", default="Text Recognition:")
+    args = parser.parse_args()
+
+    images = small_images(args.requests, args.width)
+    print(f"{args.requests} images, {sum(map(len, images)) // len(images)} bytes avg, concurrency {args.concurrency}\n")
+    print(f"{'transport':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'failures':>9}")
+
+    # Warm up both paths (connections, replica threads) before timing
+    run_multipart(args.server_url, images[:args.concurrency], args.concurrency, args.prompt)
+    host = urlparse(args.server_url).hostname
+    run_stream(host, args.stream_port, images[:args.concurrency], args.concurrency, args.prompt)
+
+    summarize("multipart", *run_multipart(args.server_url, images, args.concurrency, args.prompt))
+    summarize("stream", *run_stream(host, args.stream_port, images, args.concurrency, args.prompt))
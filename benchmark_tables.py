@@ -0,0 +1,97 @@
+"""
+Benchmark the table pipeline on a generated multi-page statement
+Builds the HTML the model emits for an N-page ledger table (header repeated on every page,
+a running page header above it) and times, per document:
+  - parsing every page into compact grids (done once on the server, per page)
+  - stitching the pages into tables and exporting them to CSV / Arrow
+  - what a client did before on every UI rerun: re-parse the raw HTML of every page
+It also compares the raw HTML and compact JSON sizes. No server is needed.
+
+Usage:
+  python benchmark_tables.py
+  python benchmark_tables.py --pages 200 --rows 60
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from result_writers import ARROW_SUPPORT
+from structured_output import parse_html_tables
+from tables import TableExporter, stitch_tables, table_block
+
+
+def make_pages(pages, rows):
+    """Model-style table HTML: a ledger split over `pages` pages with a repeated two-row header"""
+    header = ('<thead><tr><th rowspan="2">Date</th><th rowspan="2">Description</th>'
+              '<th colspan="2">Amount</th><th rowspan="2">Balance</th></tr>'
+              '<tr><th>Debit</th><th>Credit</th></tr></thead>')
+    outputs = []
+    balance = 10_000.0
+    for page in range(pages):
+        body = []
+        for row in range(rows):
+            amount = (page * rows + row) % 977 + 0.5
+            debit = row % 3 == 0
+            balance += -amount if debit else amount
+            body.append(f"<tr><td>2024-{page % 12 + 1:02d}-{row % 28 + 1:02d}</td>"
+                        f"<td>Transfer&nbsp;ref {page}-{row}</td>"
+                        f"<td>{f'{amount:,.2f}' if debit else ''}</td><td>{'' if debit else f'{amount:,.2f}'}</td>"
+                        f"<td>{balance:,.2f}</td></tr>")
+        outputs.append(f"Account statement — page {page + 1}\n<table>{header}<tbody>{''.join(body)}</tbody></table>")
+    return outputs
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return value, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark table parsing, stitching and export")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=45, help="Table rows per page")
+    args = parser.parse_args()
+
+    outputs = make_pages(args.pages, args.rows)
+    blocks, parse_s = timed(lambda: [table_block(output) for output in outputs])
+    tables, stitch_s = timed(lambda: stitch_tables(blocks))
+    _, rerender_s = timed(lambda: [parse_html_tables(output) for output in outputs])
+    results = [
+        {"page": page, "success": True, "output": output, "structured": {"type": "table", **block}}
+        for page, (output, block) in enumerate(zip(outputs, blocks), 1)
+    ]
+
+    print(f"pages={args.pages}  rows/page={args.rows}  stitched tables={len(tables)}  "
+          f"rows={sum(len(t['rows']) for t in tables)}  pages of table 1={len(tables[0]['pages'])}")
+    print(f"\n{'step':<40} {'ms':>9} {'ms/page':>8}")
+    print(f"{'parse to compact grids (server)':<40} {parse_s * 1000:>9.1f} {parse_s * 1000 / args.pages:>8.2f}")
+    print(f"{'stitch pages':<40} {stitch_s * 1000:>9.1f} {stitch_s * 1000 / args.pages:>8.2f}")
+    print(f"{'re-parse raw HTML (old client rerun)':<40} {rerender_s * 1000:>9.1f} {rerender_s * 1000 / args.pages:>8.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in TableExporter.FORMATS:
+            if fmt == 'arrow' and not ARROW_SUPPORT:
+                continue
+
+            def export():
+                with TableExporter(os.path.join(tmp, "statement"), fmt) as exporter:
+                    for result in results:
+                        exporter.write(result)
+                return exporter.paths
+
+            paths, export_s = timed(export)
+            size = sum(os.path.getsize(path) for path in paths)
+            print(f"{'export ' + fmt + f' ({size / 1024:.0f} KB)':<40} {export_s * 1000:>9.1f} "
+                  f"{export_s * 1000 / args.pages:>8.2f}")
+
+    html_kb = sum(len(output.encode()) for output in outputs) / 1024
+    compact_kb = sum(len(json.dumps(block["tables"]).encode()) for block in blocks) / 1024
+    print(f"\nraw HTML {html_kb:.0f} KB  compact grids {compact_kb:.0f} KB ({compact_kb / html_kb:.0%})")
@@ -0,0 +1,93 @@
+"""
+Request cancellation and deadline propagation for the GLM-OCR server
+A CancellationToken is tripped when the client disconnects or its deadline passes;
+CancellationCriteria checks it after every decode step so generation stops mid-decode.
+"""
+
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+
+
+class RequestCancelled(Exception):
+    """Generation was aborted because the client went away or its deadline passed"""
+
+    def __init__(self, reason, generated_tokens=0):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+        self.generated_tokens = generated_tokens
+
+
+class CancellationToken:
+    """Thread-safe cancel flag shared between the event loop and a replica's worker thread"""
+
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("deadline")
+        return self._event.is_set()
+
+    def check(self):
+        """Raise RequestCancelled if the request should stop"""
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+class CancellationCriteria(StoppingCriteria):
+    """Stops generate() at the next decode step once the token is cancelled"""
+
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        stop = self.token.cancelled
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+
+class CancellationMetrics:
+    """
+    Counts cancelled requests and the decode work they avoided.
+    Tokens saved is estimated from the mean length of completed generations:
+    a request cut off after n tokens would on average have gone on to that length.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.completed_tokens = 0
+        self.cancelled = {"disconnect": 0, "deadline": 0}
+        self.tokens_before_cancel = 0
+        self.tokens_saved = 0
+
+    def record_completed(self, new_tokens):
+        with self._lock:
+            self.completed += 1
+            self.completed_tokens += new_tokens
+
+    def record_cancelled(self, reason, generated_tokens):
+        with self._lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            self.tokens_before_cancel += generated_tokens
+            expected = self.completed_tokens / self.completed if self.completed else 0
+            self.tokens_saved += max(0, round(expected) - generated_tokens)
+
+    def report(self):
+        with self._lock:
+            return {
+                "completed_generations": self.completed,
+                "cancelled_requests": dict(self.cancelled),
+                "tokens_generated_before_cancel": self.tokens_before_cancel,
+                "estimated_tokens_saved": self.tokens_saved,
+            }
@@ -0,0 +1,52 @@
+"""
+Decoding modes for GLM-OCR generation
+OCR output is mostly copied from the image, so drafting candidate tokens and verifying
+them in a single forward pass (assisted generation) skips most sequential decode steps.
+Both assisted modes are greedy-exact: they produce the same tokens as plain greedy decoding.
+"""
+
+import os
+import time
+
+# greedy: one token per forward pass (default)
+# prompt_lookup: draft n-grams by matching the tail of the text generated so far
+# assisted: draft with a small model (GLM_OCR_DRAFT_MODEL) sharing the tokenizer
+DECODING_MODES = ("greedy", "prompt_lookup", "assisted")
+
+PROMPT_LOOKUP_TOKENS = int(os.getenv("GLM_OCR_PROMPT_LOOKUP_TOKENS", 10))
+PROMPT_LOOKUP_MAX_NGRAM = int(os.getenv("GLM_OCR_PROMPT_LOOKUP_MAX_NGRAM", 3))
+DRAFT_MODEL_PATH = os.getenv("GLM_OCR_DRAFT_MODEL")
+
+
+def generation_kwargs(mode, draft_model=None):
+    """Extra MODEL.generate kwargs for a decoding mode; raises ValueError for unusable modes"""
+    if mode not in DECODING_MODES:
+        raise ValueError(f"Unknown decoding mode {mode!r}, expected one of {', '.join(DECODING_MODES)}")
+
+    if mode == "prompt_lookup":
+        return {
+            "prompt_lookup_num_tokens": PROMPT_LOOKUP_TOKENS,
+            "max_matching_ngram_size": PROMPT_LOOKUP_MAX_NGRAM,
+        }
+    if mode == "assisted":
+        if draft_model is None:
+            raise ValueError("Assisted decoding needs a draft model: set GLM_OCR_DRAFT_MODEL")
+        return {"assistant_model": draft_model}
+    return {}
+
+
+class GenerationTimer:
+    """Times one generate call and reports tokens per second"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.start = time.perf_counter()
+
+    def report(self, new_tokens):
+        seconds = time.perf_counter() - self.start
+        return {
+            "mode": self.mode,
+            "new_tokens": int(new_tokens),
+            "seconds": round(seconds, 3),
+            "tokens_per_s": round(new_tokens / seconds, 1) if seconds > 0 else None,
+        }
@@ -36,7 +36,7 @@ def test_sample(filename, prompt, name):
         filepath = os.path.join(SAMPLES_DIR, filename)
         with open(filepath, 'rb') as f:
             files = {'image': ('image.png', f, 'image/png')}
-            data = {'prompt': prompt}
+            data = {'prompt': prompt, 'timeout': 60}
 
             start = datetime.now()
             response = requests.post(f"{SERVER_URL}/predict", files=files, data=data, timeout=60)
@@ -0,0 +1,292 @@
+"""
+Unified document reader for GLM-OCR
+Yields pages lazily from PDFs, multi-page TIFFs / image files and image folders,
+so large documents never have every page decoded at once
+"""
+
+import hashlib
+import importlib.util
+import io
+import math
+import os
+
+# PDF support using PyMuPDF (no poppler needed!). Only checks that it is installed:
+# PyMuPDF and Pillow are imported on first use, so importing this module stays cheap
+PDF_SUPPORT = importlib.util.find_spec("fitz") is not None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp', '.gif')
+DEFAULT_DPI = 200
+
+# Adaptive DPI (dpi='auto'): render each PDF page just large enough that its small body text
+# is about TARGET_TEXT_PX pixels tall, within [MIN_DPI, MAX_DPI]
+MIN_DPI = int(os.getenv("GLM_OCR_MIN_DPI", 100))
+MAX_DPI = int(os.getenv("GLM_OCR_MAX_DPI", 300))
+TARGET_TEXT_PX = float(os.getenv("GLM_OCR_TARGET_TEXT_PX", 24))
+# ...but no higher than the caller's old fixed DPI (DEFAULT_DPI for the CLI; the app passes its
+# own), unless small text would be under MIN_TEXT_PX there; then only as high as that text needs
+AUTO_DPI_CAP = int(os.getenv("GLM_OCR_AUTO_DPI_CAP", DEFAULT_DPI))
+MIN_TEXT_PX = float(os.getenv("GLM_OCR_MIN_TEXT_PX", 16))
+# Font size percentile (by character count) that sets the DPI; low values favour small print
+TEXT_SIZE_PERCENTILE = 0.1
+
+
+def _read_head(source, size=8):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:size])
+    if hasattr(source, 'read'):
+        pos = source.tell()
+        head = source.read(size)
+        source.seek(pos)
+        return head
+    with open(source, 'rb') as f:
+        return f.read(size)
+
+
+def detect_kind(source):
+    """Return 'folder', 'pdf' or 'image' for a path, bytes or file-like object"""
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        return 'folder'
+    return 'pdf' if _read_head(source).startswith(b'%PDF') else 'image'
+
+
+def _source_name(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, 'name', '<stream>')
+
+
+def iter_frames(pil_image, before_decode=None):
+    """
+    Yield (frame_index, RGB image) for each frame, decoding one frame at a time.
+    before_decode(index, pil_image) runs once a frame is selected, before its pixels are read
+    (the server rejects oversized frames there). Decoded RGB images are yielded without a copy.
+    """
+    from PIL import ImageFile
+
+    if pil_image.mode == 'RGB' and not isinstance(pil_image, ImageFile.ImageFile):
+        if before_decode:
+            before_decode(0, pil_image)
+        yield 0, pil_image
+        return
+    for index in range(getattr(pil_image, 'n_frames', 1)):
+        pil_image.seek(index)
+        if before_decode:
+            before_decode(index, pil_image)
+        yield index, pil_image.convert('RGB')
+
+
+def _open_pdf(source):
+    if not PDF_SUPPORT:
+        raise RuntimeError("PDF support requires PyMuPDF: pip install PyMuPDF")
+    import fitz  # PyMuPDF
+
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    pos = source.tell()
+    data = source.read()
+    source.seek(pos)
+    return fitz.open(stream=data, filetype="pdf")
+
+
+def choose_dpi(page, min_dpi=MIN_DPI, max_dpi=MAX_DPI, target_px=TARGET_TEXT_PX, cap=AUTO_DPI_CAP,
+               min_text_px=MIN_TEXT_PX):
+    """
+    Pick the lowest DPI that keeps a PDF page's text legible, without rendering it.
+    Pages with a text layer use font sizes from PyMuPDF span metadata; image-only pages
+    (scans) use the embedded image's native resolution, since rendering above it adds no detail.
+    Either way the result stays at or below `cap` unless text under `min_text_px` there needs more.
+    Returns (dpi, info) where info records what the choice was based on.
+    """
+    sizes = []
+    for block in page.get_text("dict", flags=0)["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                chars = len(span["text"].strip())
+                if chars and span["size"] > 0:
+                    sizes.append((span["size"], chars))
+
+    if sizes:
+        sizes.sort()
+        cutoff = sum(chars for _, chars in sizes) * TEXT_SIZE_PERCENTILE
+        seen = 0
+        for size, chars in sizes:
+            seen += chars
+            if seen >= cutoff:
+                break
+        dpi = min(target_px * 72 / size, max(cap, min_text_px * 72 / size))
+        info = {'dpi_source': 'text', 'text_size_pt': round(size, 1)}
+    else:
+        native = [
+            image['width'] * 72 / (image['bbox'][2] - image['bbox'][0])
+            for image in page.get_image_info()
+            if image['bbox'][2] > image['bbox'][0]
+        ]
+        if native:
+            dpi = min(max(native), cap)
+            info = {'dpi_source': 'image', 'native_dpi': round(max(native))}
+        else:
+            dpi = min_dpi
+            info = {'dpi_source': 'default'}
+
+    # Round up to a multiple of 10 so similar pages render at the same size
+    dpi = int(math.ceil(min(max(dpi, min_dpi), max_dpi) / 10) * 10)
+    return dpi, info
+
+
+def _stream_bytes(doc, xref):
+    return (doc.xref_stream_raw(xref) or b"") if xref > 0 else b""
+
+
+def pdf_page_fingerprint(doc, page):
+    """
+    Hash of what a PDF page draws, read from the file without rendering it: size and rotation,
+    content streams, images and form XObjects, fonts, annotations and form fields (e.g. a signature).
+    Object numbers are left out, so a rewritten file with the same page content still matches.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((tuple(round(v, 2) for v in page.rect), page.rotation)).encode())
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(image[7].encode() + _stream_bytes(doc, image[0]))
+    for xobject in page.get_xobjects():
+        digest.update(xobject[1].encode() + _stream_bytes(doc, xobject[0]))
+    for font in page.get_fonts():
+        digest.update(repr(font[1:]).encode())
+    for annot in list(page.annots()) + list(page.widgets()):
+        digest.update(repr((annot.type, tuple(annot.rect), getattr(annot, 'field_value', None))).encode())
+        kind, value = doc.xref_get_key(annot.xref, "AP/N")
+        if kind == "xref":
+            digest.update(_stream_bytes(doc, int(value.split()[0])))
+    return digest.hexdigest()
+
+
+def image_fingerprint(image):
+    """Hash of a decoded image's pixels"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.width}x{image.height}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _iter_pdf_pages(source, dpi, with_text=False, fingerprints=False, skip=None, auto_dpi_cap=AUTO_DPI_CAP):
+    import fitz
+    from PIL import Image
+
+    doc = _open_pdf(source)
+    try:
+        for page_index in range(len(doc)):
+            page = doc[page_index]
+            fingerprint = pdf_page_fingerprint(doc, page) if fingerprints else None
+            if skip is not None and skip(fingerprint):
+                # Unchanged page: the caller already has its result, so don't render it
+                yield None, {'format': 'pdf', 'frame': page_index, 'fingerprint': fingerprint}, None
+                continue
+            if dpi == 'auto':
+                page_dpi, info = choose_dpi(page, cap=auto_dpi_cap)
+            else:
+                page_dpi, info = dpi, {}
+            matrix = fitz.Matrix(page_dpi / 72, page_dpi / 72)
+            pix = page.get_pixmap(matrix=matrix)
+            image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            yield image, {
+                'format': 'pdf',
+                'frame': page_index,
+                'dpi': page_dpi,
+                'page_size_pt': (round(page.rect.width, 2), round(page.rect.height, 2)),
+                **info,
+                **({'fingerprint': fingerprint} if fingerprints else {}),
+            }, page.get_text() if with_text else None
+    finally:
+        doc.close()
+
+
+def _iter_image_pages(source, fingerprints=False, skip=None):
+    from PIL import Image
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with Image.open(source) as pil_image:
+        image_format = pil_image.format
+        for frame_index, frame in iter_frames(pil_image):
+            metadata = {
+                'format': (image_format or 'image').lower(),
+                'frame': frame_index,
+                'dpi': pil_image.info.get('dpi'),
+            }
+            if fingerprints:
+                metadata['fingerprint'] = image_fingerprint(frame)
+                if skip is not None and skip(metadata['fingerprint']):
+                    frame = None
+            yield frame, metadata, None
+
+
+def _folder_files(folder):
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS + ('.pdf',))
+    )
+
+
+def iter_pages(source, dpi=DEFAULT_DPI, max_pages=None, with_text=False, fingerprints=False, skip=None,
+               auto_dpi_cap=AUTO_DPI_CAP):
+    """
+    Lazily yield pages of a document as dicts:
+        {'page': 1-based page number, 'image': PIL RGB image, 'source': file name,
+         'width': px, 'height': px, 'metadata': {format, frame, dpi, ...}}
+
+    `source` may be a PDF, an image file (every frame of a multi-page TIFF becomes a page),
+    a folder of images/PDFs (sorted by name), or the bytes / file object of a PDF or image.
+    `dpi` only applies to PDF rendering; 'auto' picks it per page with choose_dpi, capped at
+    `auto_dpi_cap` (the DPI the caller used to render at) except for small print.
+    With `with_text`, each dict also has 'text': the PDF text layer (None for images).
+    With `fingerprints`, metadata has a 'fingerprint' of the page content (see pdf_page_fingerprint).
+    Pages for which skip(fingerprint) is true are yielded with 'image' None and are not rendered.
+    """
+    fingerprints = fingerprints or skip is not None
+    kind = detect_kind(source)
+    if kind == 'folder':
+        parts = [(path, detect_kind(path)) for path in _folder_files(source)]
+    else:
+        parts = [(source, kind)]
+
+    page_number = 0
+    for part, part_kind in parts:
+        if part_kind == 'pdf':
+            pages = _iter_pdf_pages(part, dpi, with_text, fingerprints, skip, auto_dpi_cap)
+        else:
+            pages = _iter_image_pages(part, fingerprints, skip)
+        for image, metadata, text in pages:
+            page_number += 1
+            page = {
+                'page': page_number,
+                'image': image,
+                'source': _source_name(part),
+                'width': image.width if image else None,
+                'height': image.height if image else None,
+                'metadata': metadata,
+            }
+            if with_text:
+                page['text'] = text
+            yield page
+            if max_pages and page_number >= max_pages:
+                pages.close()
+                return
+
+
+def count_pages(source):
+    """Count pages without rendering them (reads PDF page trees and image frame tables only)"""
+    kind = detect_kind(source)
+    if kind == 'folder':
+        return sum(count_pages(path) for path in _folder_files(source))
+    if kind == 'pdf':
+        with _open_pdf(source) as doc:
+            return len(doc)
+
+    from PIL import Image
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as pil_image:
+        return getattr(pil_image, 'n_frames', 1)
@@ -0,0 +1,98 @@
+"""
+Idempotency-key deduplication for the GLM-OCR server
+Requests carrying the same `Idempotency-Key` header share one execution: a retry that arrives
+while the original is still running waits for it, and a retry after it finished gets the stored
+response instead of running the model again. Keys are scoped to the caller's API key, and a
+key reused with a different request body is rejected with 422 rather than replayed.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from fastapi.responses import JSONResponse, Response
+
+IDEMPOTENCY_TTL = float(os.getenv("GLM_OCR_IDEMPOTENCY_TTL", 600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("GLM_OCR_IDEMPOTENCY_MAX_ENTRIES", 4096))
+
+
+def request_fingerprint(data, **fields):
+    """SHA-256 of a request's image (bytes or a seekable file, rewound after) and its options"""
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8"))
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+    else:
+        data.seek(0)
+        for chunk in iter(lambda: data.read(1 << 20), b""):
+            digest.update(chunk)
+        data.seek(0)
+    return digest.hexdigest()
+
+
+class IdempotencyCache:
+    """Bounded LRU of in-flight and completed responses, keyed by (API key, idempotency key)"""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.replays = 0
+        self._entries = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (created, future, _) in self._entries.items() if future.done() and now - created > self.ttl]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            key, (created, future, _) = next(iter(self._entries.items()))
+            if not future.done():
+                break
+            del self._entries[key]
+
+    async def run(self, key, handler, scope, fingerprint):
+        """
+        Return handler()'s response, or a replay of the response for `key` within `scope`
+        (the caller's API key). `fingerprint` identifies the request body (request_fingerprint);
+        the same key with another body gets 422. Only successful responses are replayed; if the
+        original attempt failed or was cancelled, the retry runs the handler itself.
+        """
+        key = (scope, key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] != fingerprint:
+            return JSONResponse(status_code=422, content={
+                "success": False,
+                "error": "Idempotency-Key was already used with a different request",
+            })
+        if entry is not None:
+            status_code, body = await asyncio.shield(entry[1])
+            if 200 <= status_code < 300:
+                self.replays += 1
+                self._entries.move_to_end(key)
+                content = json.loads(body)
+                content["cached"] = True
+                return Response(
+                    content=json.dumps(content),
+                    status_code=status_code,
+                    media_type="application/json",
+                    headers={"Idempotent-Replayed": "true"}
+                )
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (time.monotonic(), future, fingerprint)
+        self._evict()
+        try:
+            response = await handler()
+        except BaseException:
+            future.set_result((500, b"{}"))
+            self._entries.pop(key, None)
+            raise
+
+        future.set_result((response.status_code, bytes(response.body)))
+        if not 200 <= response.status_code < 300:
+            self._entries.pop(key, None)
+        return response
+
+    def status(self):
+        return {"entries": len(self._entries), "replays": self.replays}
@@ -0,0 +1,172 @@
+"""
+Resilient HTTP client for the GLM-OCR server
+Retries failed pages with jittered exponential backoff under a per-page idempotency key,
+so the server runs a retried page once, and can hedge slow pages with a duplicate request.
+"""
+
+import io
+import itertools
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+DEFAULT_SERVER_URL = "http://localhost:8508"
+
+# Worth retrying: the server was overloaded, unreachable or out of time. Not 500: the server
+# answers bad input with 4xx, so a 500 is a deterministic failure that would just run again
+RETRY_STATUS = {429, 502, 503, 504}
+# The server's deadline is this much shorter than the HTTP timeout, so it gives up (504) and
+# frees the replica before the client does; a client-side timeout would otherwise look like
+# a disconnect and the retry couldn't join the cancelled attempt
+DEADLINE_MARGIN = 0.1
+
+
+class LatencyTracker:
+    """Rolling window of recent request latencies"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """p-th percentile in seconds, or None until min_samples latencies are seen"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class OCRClient:
+    """
+    Sends /predict requests with retries and optional hedging.
+
+    Each page gets one idempotency key that is reused across its retries: if the server is
+    still working on (or already finished) an attempt whose response was lost, the retry
+    joins it or gets the stored response instead of running the model again.
+
+    With hedge_percentile set, a request still unanswered after that percentile of recent
+    latencies gets a duplicate on the next server URL; whichever answers first wins.
+    The losing request can't be interrupted mid-flight; its response is discarded.
+    """
+
+    def __init__(self, server_urls=(DEFAULT_SERVER_URL,), retries=3, backoff=0.5, max_backoff=8.0,
+                 hedge_percentile=None, timeout=120, max_hedges=16, api_key=None):
+        if isinstance(server_urls, str):
+            server_urls = [server_urls]
+        self.server_urls = [url.rstrip("/") for url in server_urls]
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.timeout = timeout
+        self.api_key = api_key
+        self.latency = LatencyTracker()
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "replayed": 0}
+        self._lock = threading.Lock()
+        self._next_url = itertools.count()
+        # Hedged requests run here; a discarded loser keeps its thread until it returns
+        self._executor = ThreadPoolExecutor(max_workers=max_hedges * 2, thread_name_prefix="ocr-hedge")
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _post(self, url, image_bytes, filename, prompt, key, data):
+        response = requests.post(
+            f"{url}/predict",
+            files={"image": (filename, image_bytes, "image/png")},
+            data={"prompt": prompt, "timeout": self.timeout * (1 - DEADLINE_MARGIN), **data},
+            headers={"Idempotency-Key": key, **({"X-API-Key": self.api_key} if self.api_key else {})},
+            timeout=self.timeout
+        )
+        try:
+            result = response.json()
+        except ValueError:
+            result = {"success": False, "error": f"HTTP {response.status_code}"}
+        return response, result
+
+    def _send(self, attempt_urls, image_bytes, filename, prompt, key, data):
+        """One attempt, hedged onto the next URL if it runs past the latency threshold"""
+        primary = self._executor.submit(self._post, attempt_urls[0], image_bytes, filename, prompt, key, data)
+        threshold = self.latency.percentile(self.hedge_percentile) if self.hedge_percentile else None
+        if threshold is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+
+        # Another server has its own idempotency cache, so it can share the key; on the same
+        # server the key would just join the slow request, so the hedge gets its own
+        hedge_url = attempt_urls[1] if len(attempt_urls) > 1 else attempt_urls[0]
+        hedge_key = key if hedge_url != attempt_urls[0] else f"{key}-hedge"
+        hedge = self._executor.submit(self._post, hedge_url, image_bytes, filename, prompt, hedge_key, data)
+        self._count("hedges")
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result()[0].ok:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+        # Both failed; report the primary's outcome
+        return primary.result()
+
+    def predict(self, image_bytes, prompt, filename="page.png", **data):
+        """
+        POST one image, retrying transport errors and 429 / 502 / 503 / 504 responses.
+        Returns the server's JSON plus `attempts` and `latency_s`; raises the last
+        transport error if every attempt failed to get an answer.
+        """
+        key = str(uuid.uuid4())
+        start = next(self._next_url)
+        self._count("requests")
+        began = time.perf_counter()
+
+        for attempt in range(self.retries + 1):
+            urls = [self.server_urls[(start + attempt + i) % len(self.server_urls)]
+                    for i in range(len(self.server_urls))]
+            retry_after = None
+            try:
+                response, result = self._send(urls, image_bytes, filename, prompt, key, data)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    if response.ok:
+                        self.latency.record(time.perf_counter() - began)
+                        if result.get("cached"):
+                            self._count("replayed")
+                    result["attempts"] = attempt + 1
+                    result["latency_s"] = round(time.perf_counter() - began, 3)
+                    return result
+                retry_after = response.headers.get("Retry-After")
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+
+            self._count("retries")
+            # Full jitter: spreads retries of pages that failed together
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            time.sleep(delay)
+
+    def predict_image(self, image, prompt, **data):
+        """predict() for a PIL image, sent as PNG"""
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        return self.predict(buf.getvalue(), prompt, **data)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,151 @@
+"""
+Per-page result cache for incremental re-OCR
+Successful page results are stored under the page's content fingerprint (see
+document_reader.pdf_page_fingerprint) plus the prompt and render settings. When a document is
+resubmitted, unchanged pages are answered from here without being rendered or sent, so the
+work scales with what changed. One SQLite file serves every document, so a page that moved or
+also appears in another document is reused as well. Pages unused for PAGE_CACHE_MAX_DAYS are
+dropped, and least recently used pages go first once the results exceed PAGE_CACHE_MAX_MB.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+def _user_cache_dir():
+    """Per-user cache directory: ~/.cache (or $XDG_CACHE_HOME), ~/Library/Caches, %LOCALAPPDATA%"""
+    if sys.platform == "win32":
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "glm-ocr")
+
+
+PAGE_CACHE = os.getenv("GLM_OCR_PAGE_CACHE") or os.path.join(_user_cache_dir(), "page_cache.db")
+PAGE_CACHE_MAX_MB = float(os.getenv("GLM_OCR_PAGE_CACHE_MAX_MB", 512))
+PAGE_CACHE_MAX_DAYS = float(os.getenv("GLM_OCR_PAGE_CACHE_MAX_DAYS", 30))
+
+# Result fields that describe the page's OCR output rather than one run of it
+STORED_FIELDS = ("output", "width", "height", "metadata", "structured")
+
+
+class PageCache:
+    """
+    Page results in SQLite, evicted by last use: older than max_days, then least recently used
+    beyond max_mb of stored results. Eviction runs on open and every PRUNE_EVERY stored pages.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path=PAGE_CACHE, max_mb=PAGE_CACHE_MAX_MB, max_days=PAGE_CACHE_MAX_DAYS):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_days * 86400
+        self._puts = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL, used REAL)"
+        )
+        # Caches written before eviction existed have no `used` column
+        if "used" not in [row[1] for row in self._conn.execute("PRAGMA table_info(pages)")]:
+            self._conn.execute("ALTER TABLE pages ADD COLUMN used REAL")
+            self._conn.execute("UPDATE pages SET used = created")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._prune()
+
+    @staticmethod
+    def key(fingerprint, prompt_key, dpi):
+        return hashlib.sha256(json.dumps([fingerprint, prompt_key, str(dpi)]).encode()).hexdigest()
+
+    def get(self, fingerprint, prompt_key, dpi):
+        """Stored result or None; a hit counts as a use, so the page is evicted last"""
+        key = self.key(fingerprint, prompt_key, dpi)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT result FROM pages WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE pages SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]) if row else None
+
+    def lookup(self, prompt_key, dpi):
+        """skip callable for document_reader.iter_pages: true for pages with a stored result"""
+        return Lookup(self, prompt_key, dpi)
+
+    def put(self, result, prompt_key, dpi):
+        """Store a successful page result (its metadata must carry the fingerprint)"""
+        if not result.get('success') or result.get('reused'):
+            return
+        stored = {field: result.get(field) for field in STORED_FIELDS}
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (key, result, created, used) VALUES (?, ?, ?, ?)",
+                (self.key(result['metadata']['fingerprint'], prompt_key, dpi), json.dumps(stored), now, now),
+            )
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self):
+        self._conn.execute("DELETE FROM pages WHERE used < ?", (time.time() - self.max_age,))
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(result)), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used pages until the rest fit
+        self._conn.execute(
+            "DELETE FROM pages WHERE key IN (SELECT key FROM (SELECT key, SUM(LENGTH(result)) "
+            "OVER (ORDER BY used DESC, key) AS kept FROM pages) WHERE kept > ?)",
+            (self.max_bytes,),
+        )
+
+    @staticmethod
+    def reuse(page, lookup):
+        """
+        Result for an unrendered page from iter_pages(skip=lookup), built from the row the lookup
+        fetched: the page may have been evicted since, so it isn't read again
+        """
+        stored = lookup.found.pop(page['metadata']['fingerprint'])
+        return {
+            'page': page['page'],
+            'source': page['source'],
+            'width': stored['width'],
+            'height': stored['height'],
+            # Route, DPI etc. from the stored run; frame and fingerprint from this document
+            'metadata': dict(stored['metadata'], **page['metadata']),
+            'success': True,
+            'output': stored['output'],
+            'reused': True,
+            'attempts': 0,
+            'elapsed_s': 0.0,
+        }
+
+
+class Lookup:
+    """
+    skip callable from PageCache.lookup. Keeps each result it found until PageCache.reuse takes
+    it, so a page skipped here can still be answered if it's evicted before it's reused
+    """
+
+    def __init__(self, cache, prompt_key, dpi):
+        self.cache = cache
+        self.prompt_key = prompt_key
+        self.dpi = dpi
+        self.found = {}
+
+    def __call__(self, fingerprint):
+        stored = self.cache.get(fingerprint, self.prompt_key, self.dpi)
+        if stored is None:
+            return False
+        self.found[fingerprint] = stored
+        return True
@@ -0,0 +1,205 @@
+"""
+Per-page task routing for GLM-OCR
+Picks a task prompt for each page from a cheap classification pass instead of using one
+prompt for the whole document. Layout features (ruling lines, fill-in underlines, dashed
+rules, line count, colour) come from a downscaled binarized copy of the page; PDF pages
+with a text layer add keyword, symbol and script counts. No model is involved.
+"""
+
+import json
+import re
+import unicodedata
+
+from demo import TESTS
+
+# Route label for each demo sample; prompts are looked up from demo.py's TESTS
+# (app.py builds its own table from SAMPLE_CONFIGS with the same labels)
+SAMPLE_LABELS = {
+    "1_text_recognition.png": "text",
+    "2_table_recognition.png": "table",
+    "3_invoice_receipt.png": "invoice",
+    "4_math_formulas.png": "formula",
+    "5_form_recognition.png": "form",
+    "6_handwriting_sample.png": "handwriting",
+    "7_document_understanding.png": "document",
+}
+
+PROMPTS = {SAMPLE_LABELS[filename]: prompt for filename, prompt, _ in TESTS if filename in SAMPLE_LABELS}
+
+# Labels whose prompts transcribe the page; the rest (invoice / form JSON, document summary)
+# return something other than the page's text, so routing to them is opt-in
+TRANSCRIPTION_LABELS = ("text", "table", "formula", "handwriting")
+
+# Pages are analysed at this width; ~30-50 ms per page on one CPU core
+ANALYSIS_WIDTH = 600
+
+INVOICE_TERMS = ("invoice", "receipt", "subtotal", "tax", "total", "bill to", "amount due", "payment")
+MATH_CHARS = set("∫∑∏√∂∞≈≠≤≥±×÷πθλμσΔΩ∇²³^")
+FORM_MARKS = ("___", "☐", "☑", "☒", "□")
+
+# Code point ranges counted by dominant_script (anything else is named by unicodedata)
+SCRIPTS = (
+    ("latin", 0x0000, 0x024F), ("greek", 0x0370, 0x03FF), ("cyrillic", 0x0400, 0x04FF),
+    ("hebrew", 0x0590, 0x05FF), ("arabic", 0x0600, 0x06FF), ("devanagari", 0x0900, 0x097F),
+    ("thai", 0x0E00, 0x0E7F), ("hangul", 0x1100, 0x11FF), ("kana", 0x3040, 0x30FF),
+    ("cjk", 0x4E00, 0x9FFF), ("hangul", 0xAC00, 0xD7AF),
+)
+
+
+def _bands(rows, gap=0):
+    """Merge sorted row indices into [first, last] bands, allowing `gap` missing rows"""
+    bands = []
+    for y in rows:
+        if bands and y - bands[-1][1] <= gap + 1:
+            bands[-1][1] = y
+        else:
+            bands.append([y, y])
+    return bands
+
+
+def _binary_rows(gray):
+    """Rows of a grayscale image as bytes, ink 0x00 and paper 0xFF"""
+    width, height = gray.size
+    data = gray.point(lambda p: 0 if p < 128 else 255).tobytes()
+    return [data[y * width:(y + 1) * width] for y in range(height)]
+
+
+def layout_features(image):
+    """
+    Cheap layout statistics of a page image.
+    Runs are found with regexes over the binarized rows, so the scan stays in C.
+    """
+    from PIL import Image
+
+    gray = image.convert("L")
+    gray.thumbnail((ANALYSIS_WIDTH, ANALYSIS_WIDTH * 4))
+    width, height = gray.size
+
+    # Photos (handwritten notes, whiteboards) are colourful or lack a white background
+    thumb = image.convert("RGB").resize((64, 64)).convert("HSV")
+    saturated = sum(thumb.getchannel("S").histogram()[81:]) / (64 * 64)
+    white = sum(gray.histogram()[200:]) / (width * height)
+
+    rows = _binary_rows(gray)
+    columns = _binary_rows(gray.transpose(Image.Transpose.ROTATE_90))
+
+    long_h = re.compile(rb"\x00{%d,}" % int(0.4 * width))
+    long_v = re.compile(rb"\x00{%d,}" % int(0.1 * height))
+    segment = re.compile(rb"\x00{%d,}" % int(0.05 * width))
+    run = re.compile(rb"\x00+")
+
+    # Dashed rules ("-------") are thin bands of many short runs spanning much of the width
+    inked = [y for y, row in enumerate(rows) if b"\x00" in row]
+    dashed = 0
+    for first, last in _bands(inked):
+        if last - first > 3:
+            continue
+        runs = list(run.finditer(rows[(first + last) // 2]))
+        if (len(runs) >= 10 and runs[-1].end() - runs[0].start() > 0.3 * width
+                and max(r.end() - r.start() for r in runs) < 0.05 * width):
+            dashed += 1
+
+    return {
+        "saturated": round(saturated, 3),
+        "white": round(white, 3),
+        "h_rules": len(_bands([y for y, row in enumerate(rows) if long_h.search(row)], gap=2)),
+        "v_rules": len(_bands([x for x, col in enumerate(columns) if long_v.search(col)], gap=2)),
+        # Fill-in blanks: shorter than a rule, longer than any glyph stroke
+        "underlines": len(_bands([y for y, row in enumerate(rows)
+                                  if segment.search(row) and not long_h.search(row)], gap=2)),
+        "dashed_rules": dashed,
+        "text_lines": sum(1 for first, last in _bands(inked, gap=2) if last - first >= 3),
+    }
+
+
+def dominant_script(text):
+    """Most frequent script among the letters of `text`, or None if it has none"""
+    counts = {}
+    for char in text:
+        if not char.isalpha():
+            continue
+        code = ord(char)
+        script = next((name for name, start, end in SCRIPTS if start <= code <= end), None)
+        if script is None:
+            script = unicodedata.name(char, "other").split(" ")[0].lower()
+        counts[script] = counts.get(script, 0) + 1
+    return max(counts, key=counts.get) if counts else None
+
+
+def text_features(text):
+    """Keyword, symbol and script counts from a PDF page's text layer"""
+    lower = text.lower()
+    return {
+        "chars": len(text),
+        "invoice_terms": sum(term in lower for term in INVOICE_TERMS),
+        "math_chars": sum(char in MATH_CHARS for char in text),
+        "form_marks": sum(text.count(mark) for mark in FORM_MARKS),
+        "script": dominant_script(text),
+    }
+
+
+def classify(image, text=None):
+    """
+    Return (label, features) for a page; label is one of SAMPLE_LABELS' values.
+    Without a text layer, formulas can't be told apart from plain text and fall back to "text".
+    """
+    features = layout_features(image)
+    if text:
+        features.update(text_features(text))
+
+    if features["saturated"] > 0.2 or features["white"] < 0.6:
+        label = "handwriting"
+    elif features.get("math_chars", 0) >= 10:
+        label = "formula"
+    elif features["h_rules"] >= 3 and features["v_rules"] >= 3:
+        label = "table"
+    elif features["underlines"] >= 4 or features.get("form_marks", 0) >= 3:
+        label = "form"
+    elif features["dashed_rules"] >= 2 or features.get("invoice_terms", 0) >= 3:
+        label = "invoice"
+    elif features.get("math_chars", 0) >= 5:
+        label = "formula"
+    elif features["text_lines"] >= 25:
+        label = "document"
+    else:
+        label = "text"
+    return label, features
+
+
+class PageRouter:
+    """
+    Chooses each page's prompt from `prompts` (label -> prompt).
+    Labels outside `labels` (default: TRANSCRIPTION_LABELS) fall back to `fallback`, so JSON
+    extraction and summaries only happen when asked for; labels="all" allows every label.
+    """
+
+    def __init__(self, prompts=PROMPTS, labels=TRANSCRIPTION_LABELS, fallback="text"):
+        self.prompts = prompts
+        self.labels = set(prompts) if labels == "all" else set(labels)
+        self.fallback = fallback
+
+    def cache_key(self):
+        """Identifies the routing configuration, for caching routed results (see page_cache.py)"""
+        return "route:" + json.dumps([sorted(self.labels), self.fallback, self.prompts], sort_keys=True)
+
+    def route(self, page):
+        """Return (prompt, route info) for a page dict from document_reader.iter_pages"""
+        label, features = classify(page["image"], page.get("text"))
+        chosen = label if label in self.labels and label in self.prompts else self.fallback
+        info = {"label": chosen, "detected": label}
+        if features.get("script"):
+            info["script"] = features["script"]
+        return self.prompts[chosen], info
+
+    def grouped(self, pages, window=16):
+        """
+        Yield (page, prompt, route info), reordered within each window of `window` pages so that
+        pages sharing a prompt are sent back to back. Callers restore page order on output.
+        """
+        buffer = []
+        for page in pages:
+            buffer.append((page, *self.route(page)))
+            if len(buffer) >= window:
+                yield from sorted(buffer, key=lambda item: item[1])
+                buffer = []
+        yield from sorted(buffer, key=lambda item: item[1])
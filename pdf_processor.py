@@ -1,113 +1,244 @@
 """
 PDF processing module for GLM-OCR
-Converts PDF pages to images and processes them
+Converts PDF pages (or TIFF frames / image folders) to images and processes them
 """
 
 import sys
 import io
+import os
+import time
+import argparse
+import importlib.util
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Fix Windows console encoding
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-from PIL import Image
-import requests
+from document_reader import AUTO_DPI_CAP, PDF_SUPPORT, count_pages, iter_pages
+from ocr_client import DEFAULT_SERVER_URL, OCRClient
+from page_cache import PAGE_CACHE, PageCache
+from result_writers import ARROW_SUPPORT, WRITERS, open_writer
+from tables import TableExporter, page_block, stitch_tables
+
+# Pages in flight at once: overlaps rendering/encoding/upload with server inference
+DEFAULT_WORKERS = 4
+
+def capabilities():
+    """Optional client features and whether their packages are installed (nothing is imported)"""
+    return {
+        'images': (importlib.util.find_spec("PIL") is not None, "pillow"),
+        'pdf': (PDF_SUPPORT, "PyMuPDF"),
+        'parquet/arrow': (ARROW_SUPPORT, "pyarrow"),
+    }
+
+def print_capabilities():
+    for feature, (available, package) in capabilities().items():
+        print(f"{'✓' if available else '✗'} {feature:<14} {package}{'' if available else f' (pip install {package})'}")
 
 def convert_pdf_to_images(pdf_path, dpi=200):
     """
-    Convert PDF pages to images using pdf2image
-    Returns list of PIL Images
+    Convert PDF pages to images using PyMuPDF
+    Returns list of PIL Images (prefer iter_pages for large documents)
+    """
+    return [page['image'] for page in iter_pages(pdf_path, dpi=dpi)]
+
+def process_pdf_page(image, prompt, server_url=DEFAULT_SERVER_URL, timeout=120, client=None):
+    """
+    Process a single PDF page (as image) with GLM-OCR
+    Failed attempts are retried by the client under the same idempotency key
+    (a SharedMemoryClient instead hands the raw pixels to a server on this host)
     """
+    # The server aborts generation once the client timeout passes instead of finishing unread work
+    client = client or OCRClient([server_url], timeout=timeout)
+    return client.predict_image(image, prompt)
+
+def _process_page(page, prompt, client, route=None):
+    """OCR one page from the document reader; never raises"""
+    i = page['page']
+    result = {
+        'page': i,
+        'source': page['source'],
+        'width': page['width'],
+        'height': page['height'],
+        'metadata': dict(page['metadata'], route=route) if route else page['metadata'],
+    }
+    start = time.perf_counter()
     try:
-        from pdf2image import convert_from_path
-        images = convert_from_path(pdf_path, dpi=dpi)
-        return images
-    except ImportError:
-        print("⚠️ pdf2image not installed. Installing...")
-        import subprocess
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "pdf2image"])
-        from pdf2image import convert_from_path
-        images = convert_from_path(pdf_path, dpi=dpi)
-        return images
-
-def process_pdf_page(image, prompt, server_url="http://localhost:8508"):
-    """Process a single PDF page (as image) with GLM-OCR"""
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0)
-
-    files = {'image': ('page.png', img_byte_arr, 'image/png')}
-    data = {'prompt': prompt}
-
-    response = requests.post(
-        f"{server_url}/predict",
-        files=files,
-        data=data,
-        timeout=120
-    )
+        response = process_pdf_page(page['image'], prompt, client=client)
+
+        if response.get('success'):
+            output = response['output']
+            print(f"✓ Page {i} processed ({len(output)} chars{', ' + route['label'] if route else ''})")
+            result.update(success=True, output=output, cached=response.get('cached', False),
+                          usage=response.get('usage'), structured=response.get('structured'))
+        else:
+            print(f"✗ Page {i} failed: {response.get('error')}")
+            result.update(success=False, error=response.get('error'))
+        result['attempts'] = response.get('attempts', 1)
+
+    except Exception as e:
+        print(f"✗ Page {i} exception: {str(e)}")
+        result.update(success=False, error=str(e))
+
+    result['elapsed_s'] = round(time.perf_counter() - start, 3)
+    return result
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def iter_document_results(source, prompt="Text Recognition:", max_pages=None, workers=DEFAULT_WORKERS,
+                          dpi='auto', server_url=DEFAULT_SERVER_URL, client=None, router=None, cache=None,
+                          auto_dpi_cap=AUTO_DPI_CAP):
+    """
+    Pipelined OCR over any document the reader supports (PDF, multi-page TIFF, image folder).
+    Pages are rendered lazily and at most `workers` are in flight, so memory stays bounded.
+    Yields results in page order as soon as each page (and all before it) completes.
+    Pass an OCRClient to spread pages over several servers, tune retries or enable hedging.
+    With a PageRouter, each page gets its own prompt instead of `prompt`, and pages are sent
+    grouped by prompt within windows of 4 * workers pages (results still come in page order).
+    With a PageCache, pages whose content fingerprint already has a result for this prompt are
+    neither rendered nor sent; their results are marked 'reused'. New results are stored.
+    """
+    client = client or OCRClient([server_url])
+    prompt_key = router.cache_key() if router else prompt
+    # Auto renders differ by cap, so results cached under one cap don't stand in for another
+    render_key = f"auto<={auto_dpi_cap}" if dpi == 'auto' else dpi
+    lookup = cache.lookup(prompt_key, render_key) if cache else None
+    pages = iter_pages(source, dpi=dpi, max_pages=max_pages, with_text=router is not None, skip=lookup,
+                       auto_dpi_cap=auto_dpi_cap)
+    pending = {}
+
+    def changed(pages):
+        """Pages that need OCR; unchanged ones are answered from the cache as they stream past"""
+        for page in pages:
+            if page['image'] is None:
+                print(f"✓ Page {page['page']} unchanged, reused")
+                pending[page['page']] = _completed(cache.reuse(page, lookup))
+            else:
+                yield page
+
+    if cache:
+        pages = changed(pages)
+    if router:
+        jobs = router.grouped(pages, window=workers * 4)
+    else:
+        jobs = ((page, prompt, None) for page in pages)
+
+    def finish(result):
+        if cache:
+            cache.put(result, prompt_key, render_key)
+        return result
+
+    next_page = 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page, page_prompt, route in jobs:
+            print(f"Submitting page {page['page']}...")
+            pending[page['page']] = pool.submit(_process_page, page, page_prompt, client, route)
+            # Hand back finished pages in order; block on the next one once the pool is full
+            while next_page in pending and (pending[next_page].done() or len(pending) >= workers):
+                yield finish(pending.pop(next_page).result())
+                next_page += 1
 
-    return response.json()
+        while pending:
+            yield finish(pending.pop(next_page).result())
+            next_page += 1
 
-def process_pdf(pdf_path, prompt="Text Recognition:", max_pages=None):
+class DocumentJob:
+    """
+    Runs iter_document_results on a background thread.
+    Callers (e.g. the Streamlit app) poll `results`, which fills in page order as pages
+    complete, instead of blocking on the whole document.
+    """
+
+    def __init__(self, source, prompt="Text Recognition:", max_pages=None, workers=DEFAULT_WORKERS,
+                 dpi='auto', server_url=DEFAULT_SERVER_URL, client=None, router=None, cache=None,
+                 auto_dpi_cap=AUTO_DPI_CAP):
+        self.results = []
+        self.error = None
+        self.done = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(source, prompt, max_pages, workers, dpi, server_url, client, router, cache, auto_dpi_cap),
+            daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, *args):
+        try:
+            for result in iter_document_results(*args):
+                with self._cond:
+                    self.results.append(result)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def wait(self, seen, timeout=None):
+        """Block until more than `seen` results are available or the job is done"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.results) > seen or self.done, timeout)
+            return self.results[seen:]
+
+def _page_ranges(pages):
+    """Compact page list: [1, 2, 3, 7] -> '1-3, 7'"""
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+def process_pdf(pdf_path, prompt="Text Recognition:", max_pages=None, workers=DEFAULT_WORKERS, writers=(), dpi='auto',
+                client=None, router=None, cache=None, auto_dpi_cap=AUTO_DPI_CAP):
     """
     Process entire PDF with GLM-OCR
 
     Args:
-        pdf_path: Path to PDF file
+        pdf_path: Path to PDF file (or multi-page TIFF / image folder)
         prompt: OCR task prompt
         max_pages: Maximum pages to process (None = all)
+        workers: Pages processed concurrently
+        writers: Result writers (see result_writers.py, or a tables.TableExporter); each page is
+            written as soon as it completes
+        dpi: PDF render DPI, or 'auto' to pick the lowest legible DPI per page
+        auto_dpi_cap: Highest DPI 'auto' picks except for small print (default: DEFAULT_DPI)
+        client: OCRClient (server URLs, retries, hedging) or SharedMemoryClient; defaults to the local server
+        router: PageRouter to pick the prompt per page (prompt is then ignored)
+        cache: PageCache; unchanged pages of a resubmitted document reuse their stored results
 
     Returns:
         List of results, one per page
     """
     print(f"\n{'='*80}")
     print(f"Processing PDF: {pdf_path}")
-    print(f"Prompt: {prompt}")
+    print(f"Prompt: {'routed per page' if router else prompt}")
     print(f"{'='*80}\n")
 
-    # Convert PDF to images
-    print("📄 Converting PDF to images...")
-    images = convert_pdf_to_images(pdf_path)
-    total_pages = len(images)
-    print(f"✓ Converted {total_pages} pages")
+    total_pages = count_pages(pdf_path)
+    print(f"📄 Document has {total_pages} pages")
 
     # Limit pages if specified
     if max_pages:
-        images = images[:max_pages]
         print(f"Processing first {max_pages} pages")
 
-    # Process each page
+    # Pages are rendered on demand and processed concurrently
+    client = client or OCRClient()
     results = []
-    for i, image in enumerate(images, 1):
-        print(f"\nProcessing page {i}/{len(images)}...")
-
-        try:
-            result = process_pdf_page(image, prompt)
-
-            if result.get('success'):
-                output = result['output']
-                print(f"✓ Page {i} processed ({len(output)} chars)")
-                results.append({
-                    'page': i,
-                    'success': True,
-                    'output': output
-                })
-            else:
-                print(f"✗ Page {i} failed: {result.get('error')}")
-                results.append({
-                    'page': i,
-                    'success': False,
-                    'error': result.get('error')
-                })
-
-        except Exception as e:
-            print(f"✗ Page {i} exception: {str(e)}")
-            results.append({
-                'page': i,
-                'success': False,
-                'error': str(e)
-            })
+    for result in iter_document_results(pdf_path, prompt, max_pages, workers, dpi, client=client, router=router,
+                                        cache=cache, auto_dpi_cap=auto_dpi_cap):
+        for writer in writers:
+            writer.write(result)
+        results.append(result)
 
     # Summary
     successful = sum(1 for r in results if r.get('success'))
@@ -116,35 +247,120 @@ def process_pdf(pdf_path, prompt="Text Recognition:", max_pages=None):
     print(f"{'='*80}")
     print(f"Total pages: {len(results)}")
     print(f"Successful: {successful}/{len(results)}")
+    if cache:
+        reused = [r['page'] for r in results if r.get('reused')]
+        print(f"Reused unchanged: {len(reused)}/{len(results)}" + (f" (pages {_page_ranges(reused)})" if reused else ""))
+    latencies = sorted(r['elapsed_s'] for r in results if not r.get('reused'))
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"Page latency: p50 {latencies[len(latencies) // 2]:.2f}s, p95 {p95:.2f}s, max {latencies[-1]:.2f}s")
+    if router:
+        routes = {}
+        for r in results:
+            label = r['metadata']['route']['label']
+            routes[label] = routes.get(label, 0) + 1
+        print(f"Routes: {', '.join(f'{label} {n}' for label, n in sorted(routes.items()))}")
+    tables = stitch_tables([page_block(r) for r in results])
+    if tables:
+        print(f"Tables: {len(tables)} (pages {'; '.join(_page_ranges(t['pages']) for t in tables)}), "
+              f"{sum(len(t['rows']) for t in tables)} rows")
+    usages = [r['usage'] for r in results if r.get('usage')]
+    if usages:
+        print(f"Tokens: {sum(u['input_tokens'] for u in usages)} in "
+              f"({sum(u['vision_tokens'] for u in usages)} vision), {sum(u['output_tokens'] for u in usages)} out, "
+              f"{sum(u['gpu_seconds'] for u in usages):.1f} GPU-s")
+    stats = client.stats
+    print(f"Retries: {stats['retries']}, hedged: {stats['hedges']} (won {stats['hedge_wins']}), "
+          f"replayed: {stats['replayed']}")
     print(f"{'='*80}\n")
 
     return results
 
 if __name__ == "__main__":
-    # Example usage
-    if len(sys.argv) < 2:
-        print("Usage: python pdf_processor.py <pdf_file> [prompt] [max_pages]")
-        print("\nExample:")
-        print('  python pdf_processor.py document.pdf "Text Recognition:" 5')
-        sys.exit(1)
-
-    pdf_file = sys.argv[1]
-    prompt = sys.argv[2] if len(sys.argv) > 2 else "Text Recognition:"
-    max_pages = int(sys.argv[3]) if len(sys.argv) > 3 else None
-
-    results = process_pdf(pdf_file, prompt, max_pages)
-
-    # Save results
-    output_file = pdf_file.replace('.pdf', '_ocr_results.txt')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for result in results:
-            f.write(f"\n{'='*80}\n")
-            f.write(f"PAGE {result['page']}\n")
-            f.write(f"{'='*80}\n")
-            if result.get('success'):
-                f.write(result['output'])
-            else:
-                f.write(f"ERROR: {result.get('error')}\n")
-            f.write(f"\n")
+    parser = argparse.ArgumentParser(
+        description="Process a PDF, multi-page TIFF or image folder with GLM-OCR",
+        epilog='Example: python pdf_processor.py document.pdf "Text Recognition:" 5 --format txt,jsonl'
+    )
+    parser.add_argument("pdf_file", nargs="?", help="PDF file, TIFF file or folder of images")
+    parser.add_argument("prompt", nargs="?", default="Text Recognition:", help="OCR task prompt")
+    parser.add_argument("max_pages", nargs="?", type=int, default=None, help="Maximum pages to process")
+    parser.add_argument("--format", default="txt",
+                        help=f"Comma-separated output formats: {', '.join(WRITERS)} (default: txt)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Pages processed concurrently")
+    parser.add_argument("--dpi", default="auto",
+                        help="PDF render DPI, or 'auto' to pick it per page from font size (default: auto)")
+    parser.add_argument("--servers", default=DEFAULT_SERVER_URL,
+                        help="Comma-separated server URLs; retries and hedges go to the next one")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="Retries per page on connection errors, timeouts, 429 and 502-504 (also with --shm)")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Send a duplicate request once a page exceeds this latency percentile (e.g. 95)")
+    parser.add_argument("--route", nargs="?", const="transcribe", default=None,
+                        help="Pick a transcription prompt per page (text, table, formula, handwriting); "
+                             "optionally a comma-separated list of allowed labels, others fall back to "
+                             "text, or 'all' to also allow invoice/form JSON and document summaries")
+    parser.add_argument("--api-key", default=os.getenv("GLM_OCR_API_KEY"),
+                        help="Sent as X-API-Key for usage accounting and quotas (default: $GLM_OCR_API_KEY)")
+    parser.add_argument("--shm", action="store_true",
+                        help="Server runs on this host: pass raw pixels through shared memory and the stream "
+                             "port (GLM_OCR_STREAM_PORT) instead of PNG over HTTP")
+    parser.add_argument("--cache", nargs="?", const=PAGE_CACHE, default=None, metavar="PATH",
+                        help=f"Incremental mode: reuse results of unchanged pages from this cache "
+                             f"(default {PAGE_CACHE}) and store new ones")
+    parser.add_argument("--tables", choices=TableExporter.FORMATS, default=None,
+                        help="Also write each table, stitched across pages, to <name>_table_NNN.csv / .arrow")
+    parser.add_argument("--check", action="store_true", help="List which optional features are installed and exit")
+    args = parser.parse_args()
+    if args.check:
+        print_capabilities()
+        sys.exit(0)
+    if args.pdf_file is None:
+        parser.error("the following arguments are required: pdf_file")
+    dpi = args.dpi if args.dpi == "auto" else int(args.dpi)
+    # Hedging sends a slow page to the next server; --shm talks to the one server on this host
+    if args.shm and (args.hedge_percentile is not None or "," in args.servers.strip(", ")):
+        parser.error("--shm uses the single server on this host: --hedge-percentile and several --servers "
+                     "aren't supported with it")
+
+    formats = [fmt.strip() for fmt in args.format.split(",") if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in WRITERS]
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(unknown)}")
+
+    # Results are written page by page as they complete
+    base_path = os.path.splitext(args.pdf_file.rstrip('/\\'))[0]
+    writers = [open_writer(fmt, base_path) for fmt in formats]
+    # Tables are stitched across pages and exported alongside, also page by page
+    exporter = TableExporter(base_path, args.tables) if args.tables else None
+    outputs = writers + [exporter] if exporter else writers
+    router = None
+    if args.route:
+        from page_router import PageRouter
+        router = PageRouter() if args.route == "transcribe" else PageRouter(
+            labels="all" if args.route == "all" else args.route.split(","))
+
+    if args.shm:
+        from urllib.parse import urlparse
+        from shm_transport import SharedMemoryClient
+        client = SharedMemoryClient(urlparse(args.servers.split(",")[0].strip()).hostname, api_key=args.api_key,
+                                    retries=args.retries)
+    else:
+        client = OCRClient(
+            [url.strip() for url in args.servers.split(",") if url.strip()],
+            retries=args.retries,
+            hedge_percentile=args.hedge_percentile,
+            api_key=args.api_key
+        )
+    cache = PageCache(args.cache) if args.cache else None
+    try:
+        process_pdf(args.pdf_file, args.prompt, args.max_pages, args.workers, outputs, dpi, client, router,
+                    cache)
+    finally:
+        client.close()
+        for writer in outputs:
+            writer.close()
 
-    print(f"Results saved to: {output_file}")
+    for writer in writers:
+        print(f"Results saved to: {writer.path}")
+    for path in exporter.paths if exporter else ():
+        print(f"Table saved to: {path}")
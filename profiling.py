@@ -0,0 +1,296 @@
+"""
+On-demand profiling for the GLM-OCR server
+POST /admin/profile arms a session for the next N requests or T seconds. While it runs, a
+sampler thread records the Python stacks of every thread in collapsed-stack format (as written
+by py-spy and read by speedscope / flamegraph.pl), and each request's apply_chat_template,
+generate and decode stages are timed and traced with the torch profiler (Chrome trace JSON,
+for Perfetto or chrome://tracing). With no session armed, requests get a shared no-op handle.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+PROFILE_DIR = os.getenv("GLM_OCR_PROFILE_DIR", "profiles")
+MAX_SECONDS = 600
+# Sessions kept on disk; older ones are deleted when a new session starts
+KEEP_SESSIONS = 10
+
+# Leaf frames of threads that are only waiting (py-spy drops these unless --idle is given)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+ARTIFACT_NAME = re.compile(r"^[\w.-]+$")
+
+
+class ProfilerBusy(Exception):
+    """A profiling session is already running"""
+
+
+class _NoProfile:
+    """Handle used while no session is armed (nullcontext is reentrant, so one instance serves all)"""
+
+    _stage = nullcontext()
+    traced = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def stage(self, name):
+        return self._stage
+
+
+NO_PROFILE = _NoProfile()
+
+
+class RequestProfile:
+    """
+    Stage timings for one request, collected on the replica thread running it.
+    The torch profiler allows one trace at a time, so concurrent requests on other
+    replicas are timed but not traced.
+    """
+
+    def __init__(self, session, index):
+        self.session = session
+        self.index = index
+        self.stages = {}
+        self._trace = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.session.trace and self.session.trace_lock.acquire(blocking=False):
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._trace = torch.profiler.profile(activities=activities)
+            self._trace.__enter__()
+        return self
+
+    @property
+    def traced(self):
+        """Whether this request holds the torch trace (then its ops must run on this thread)"""
+        return self._trace is not None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        with torch.profiler.record_function(name) if self._trace else nullcontext():
+            try:
+                yield
+            finally:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def __exit__(self, exc_type, exc, tb):
+        summary = {
+            "index": self.index,
+            "seconds": round(time.perf_counter() - self.start, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "error": exc_type.__name__ if exc_type else None,
+        }
+        if self._trace is not None:
+            try:
+                self._trace.__exit__(None, None, None)
+                summary["trace"] = f"trace-{self.index:03d}.json"
+                self._trace.export_chrome_trace(os.path.join(self.session.directory, summary["trace"]))
+                summary["ops"] = f"ops-{self.index:03d}.txt"
+                with open(os.path.join(self.session.directory, summary["ops"]), "w") as f:
+                    f.write(self._trace.key_averages().table(sort_by="self_cpu_time_total", row_limit=40))
+            finally:
+                self.session.trace_lock.release()
+        self.session.finish_request(summary)
+        return False
+
+
+class ProfileSession:
+    """One capture: ends after `max_requests` profiled requests or `seconds`, whichever comes first"""
+
+    def __init__(self, directory, max_requests, seconds, interval, trace, on_finish):
+        self.id = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+        self.directory = os.path.join(directory, self.id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_requests = max_requests
+        self.seconds = seconds
+        self.interval = interval
+        self.trace = trace
+        self.trace_lock = threading.Lock()
+        self.started = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.samples = Counter()
+        self.sample_count = 0
+        self.requests = []
+        self.claimed = 0
+        self.reason = None
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._on_finish = on_finish
+        self._sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def claim(self):
+        """RequestProfile for the next request, or None once the session is full or over"""
+        with self._lock:
+            if self._done.is_set() or (self.max_requests and self.claimed >= self.max_requests):
+                return None
+            self.claimed += 1
+            return RequestProfile(self, self.claimed)
+
+    def finish_request(self, summary):
+        with self._lock:
+            self.requests.append(summary)
+            if self.max_requests and len(self.requests) >= self.max_requests:
+                self.stop("requests")
+
+    def stop(self, reason="stopped"):
+        if not self._done.is_set():
+            self.reason = reason
+            self._done.set()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            leaf = codes[0]
+            if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                continue
+            stack = [names.get(ident, str(ident))] + [self._label(code) for code in reversed(codes)]
+            self.samples[";".join(stack)] += 1
+        self.sample_count += 1
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                self.stop("seconds")
+                break
+            self._sample()
+        # Let requests already claimed finish writing their traces (bounded)
+        wait_until = time.monotonic() + 30
+        while len(self.requests) < self.claimed and time.monotonic() < wait_until:
+            time.sleep(0.1)
+        self._write()
+        self._on_finish(self)
+
+    def _write(self):
+        with open(os.path.join(self.directory, "stacks.folded"), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        stages = {}
+        for request in self.requests:
+            for name, seconds in request["stages"].items():
+                stages.setdefault(name, []).append(seconds)
+        with open(os.path.join(self.directory, "summary.json"), "w") as f:
+            json.dump({**self.info(), "stage_mean_s": {
+                name: round(sum(values) / len(values), 4) for name, values in stages.items()
+            }, "requests": self.requests}, f, indent=2)
+
+    def info(self):
+        return {
+            "id": self.id,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "max_requests": self.max_requests,
+            "seconds": self.seconds,
+            "interval_ms": self.interval * 1000,
+            "torch_trace": self.trace,
+            "requests_profiled": len(self.requests),
+            "stack_samples": self.sample_count,
+            "ended": self.reason,
+        }
+
+
+class Profiler:
+    """Server-wide entry point; request() is a single attribute check while idle"""
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.session = None
+        self._lock = threading.Lock()
+
+    def request(self):
+        """Context manager for one request: a RequestProfile while a session is armed, else NO_PROFILE"""
+        session = self.session
+        if session is None:
+            return NO_PROFILE
+        return session.claim() or NO_PROFILE
+
+    def start(self, max_requests=0, seconds=0, interval_ms=5, trace=True):
+        """Arm a session; with neither limit given it runs for 10 seconds"""
+        with self._lock:
+            if self.session is not None:
+                raise ProfilerBusy(f"Profiling session {self.session.id} is already running")
+            seconds = min(seconds or (MAX_SECONDS if max_requests else 10), MAX_SECONDS)
+            self._prune()
+            self.session = ProfileSession(
+                self.directory, max_requests, seconds, interval_ms / 1000, trace, self._finished
+            )
+            return self.session
+
+    def stop(self):
+        session = self.session
+        if session is not None:
+            session.stop()
+        return session
+
+    def _finished(self, session):
+        with self._lock:
+            if self.session is session:
+                self.session = None
+
+    def _prune(self):
+        sessions = self.sessions()
+        for session_id in sessions[KEEP_SESSIONS - 1:]:
+            path = os.path.join(self.directory, session_id)
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+
+    def sessions(self):
+        """Session ids on disk, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((name for name in os.listdir(self.directory) if ARTIFACT_NAME.match(name)), reverse=True)
+
+    def status(self):
+        session = self.session
+        return {
+            "active": session.info() if session else None,
+            "sessions": {
+                session_id: sorted(os.listdir(os.path.join(self.directory, session_id)))
+                for session_id in self.sessions()
+            },
+        }
+
+    def artifact_path(self, session_id, name):
+        """Path of a downloadable artifact, or None (also for names that could escape PROFILE_DIR)"""
+        if not (ARTIFACT_NAME.match(session_id) and ARTIFACT_NAME.match(name)) or ".." in (session_id, name):
+            return None
+        path = os.path.join(self.directory, session_id, name)
+        return path if os.path.isfile(path) else None
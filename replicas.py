@@ -0,0 +1,153 @@
+"""
+Data-parallel model replicas for the GLM-OCR server
+One model replica per device (GPU, or CPU NUMA node), each with its own worker thread.
+The pool hands each request to whichever replica is idle; requests wait in line otherwise.
+With continuous batching (batching.py) a replica serves many requests at once, so requests go
+to the least loaded replica and wait in its scheduler instead.
+"""
+
+import asyncio
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# "auto": one replica per GPU when there are several, one per NUMA node on multi-node CPU
+# hosts, otherwise a single replica with device_map="auto". Or an explicit list, e.g.
+# "cuda:0,cuda:1" or "cpu,cpu" (two CPU replicas, handy for testing the dispatcher)
+DEVICES = os.getenv("GLM_OCR_DEVICES", "auto")
+
+
+def _parse_cpulist(text):
+    cpus = set()
+    for part in text.strip().split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """CPU sets of the host's NUMA nodes (Linux only; empty list elsewhere)"""
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path) as f:
+            cpus = _parse_cpulist(f.read())
+        if cpus:
+            nodes.append(cpus)
+    return nodes
+
+
+def plan_replicas(torch, spec=DEVICES):
+    """Return [(device, cpus)] for each replica; cpus pins CPU replicas to a NUMA node"""
+    if spec != "auto":
+        return [(device.strip(), None) for device in spec.split(",") if device.strip()]
+
+    if torch.cuda.is_available():
+        if torch.cuda.device_count() > 1:
+            return [(f"cuda:{i}", None) for i in range(torch.cuda.device_count())]
+    else:
+        nodes = numa_nodes()
+        if len(nodes) > 1:
+            return [("cpu", cpus) for cpus in nodes]
+
+    return [("auto", None)]
+
+
+class Replica:
+    """One model copy plus the single worker thread that runs all of its generations"""
+
+    def __init__(self, index, device, cpus=None):
+        self.index = index
+        self.device = device
+        self.cpus = cpus
+        self.model = None
+        self.processor = None
+        self.draft_model = None
+        self.batcher = None
+        self.busy = False
+        self.in_flight = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.created = time.monotonic()
+        self.executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix=f"replica-{index}",
+            initializer=self._pin
+        )
+
+    def _pin(self):
+        # Keep a CPU replica's worker on its NUMA node (Linux applies this per thread)
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus)
+
+    def status(self):
+        uptime = time.monotonic() - self.created
+        busy_seconds = self.batcher.busy_seconds if self.batcher else self.busy_seconds
+        status = {
+            "replica": self.index,
+            "device": str(self.model.device) if self.model is not None and self.device == "auto" else self.device,
+            "busy": bool(self.batcher.running) if self.batcher else self.busy,
+            "completed": self.completed,
+            "utilization": round(busy_seconds / uptime, 3) if uptime > 0 else 0.0,
+        }
+        if self.batcher:
+            status["batching"] = self.batcher.status()
+        return status
+
+
+class ReplicaPool:
+    """Dispatches work to idle replicas; each call runs on the chosen replica's worker thread"""
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self.waiting = 0
+        self._idle = asyncio.Queue()
+        for replica in replicas:
+            self._idle.put_nowait(replica)
+        # Request threads for batching replicas: they preprocess, then block in batcher.generate()
+        self._batched = None
+        if all(replica.batcher for replica in replicas):
+            workers = sum(2 * replica.batcher.max_batch for replica in replicas)
+            self._batched = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="request")
+
+    async def run(self, fn, *args):
+        """Run fn(replica, *args) on the first idle replica and return its result"""
+        if self._batched is not None:
+            return await self._run_batched(fn, *args)
+        self.waiting += 1
+        try:
+            replica = await self._idle.get()
+        finally:
+            self.waiting -= 1
+
+        replica.busy = True
+        start = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(replica.executor, fn, replica, *args)
+        finally:
+            replica.busy_seconds += time.monotonic() - start
+            replica.completed += 1
+            replica.busy = False
+            self._idle.put_nowait(replica)
+
+    async def _run_batched(self, fn, *args):
+        """Run fn(replica, *args) for the replica with the fewest requests in flight"""
+        replica = min(self.replicas, key=lambda r: r.in_flight)
+        replica.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._batched, fn, replica, *args)
+        finally:
+            replica.in_flight -= 1
+            replica.completed += 1
+
+    def status(self):
+        waiting = sum(len(r.batcher.waiting) for r in self.replicas) if self._batched else self.waiting
+        return {
+            "queue_depth": waiting,
+            "replicas": [replica.status() for replica in self.replicas],
+        }
@@ -0,0 +1,249 @@
+"""
+Streaming output writers for GLM-OCR results
+Each writer appends one page at a time as results complete, so nothing is buffered
+until the end of a document. Formats: txt (legacy banners), jsonl, parquet, arrow, hocr
+"""
+
+import html
+import importlib.util
+import json
+
+# pyarrow is only imported when a Parquet/Arrow writer is opened
+ARROW_SUPPORT = importlib.util.find_spec("pyarrow") is not None
+
+# Separator between page outputs in the concatenated document text that text_offset indexes into
+PAGE_SEPARATOR = "\n\n"
+
+
+class ResultWriter:
+    """Base writer: tracks each page's character offset in the concatenated document text"""
+
+    extension = None
+
+    def __init__(self, path):
+        self.path = path
+        self.text_offset = 0
+
+    def write(self, result):
+        output = result.get('output') or ""
+        usage = result.get('usage') or {}
+        record = {
+            'source': result.get('source'),
+            'page': result['page'],
+            'success': bool(result.get('success')),
+            'output': output,
+            'error': result.get('error'),
+            'elapsed_s': result.get('elapsed_s'),
+            'cached': bool(result.get('cached', False)),
+            'reused': bool(result.get('reused', False)),
+            'input_tokens': usage.get('input_tokens'),
+            'output_tokens': usage.get('output_tokens'),
+            'gpu_seconds': usage.get('gpu_seconds'),
+            'text_offset': self.text_offset,
+            'text_length': len(output),
+            'width': result.get('width'),
+            'height': result.get('height'),
+            'metadata': result.get('metadata') or {},
+        }
+        self.text_offset += len(output) + len(PAGE_SEPARATOR)
+        self._write_record(record)
+
+    def _write_record(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TextWriter(ResultWriter):
+    """Legacy `_ocr_results.txt` format with `=` banners"""
+
+    extension = '.txt'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.f = open(path, 'w', encoding='utf-8')
+
+    def _write_record(self, record):
+        self.f.write(f"\n{'='*80}\n")
+        self.f.write(f"PAGE {record['page']}\n")
+        self.f.write(f"{'='*80}\n")
+        if record['success']:
+            self.f.write(record['output'])
+        else:
+            self.f.write(f"ERROR: {record['error']}\n")
+        self.f.write(f"\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class JSONLWriter(ResultWriter):
+    """One JSON record per page, flushed as each page completes"""
+
+    extension = '.jsonl'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.f = open(path, 'w', encoding='utf-8')
+
+    def _write_record(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class _ArrowWriterBase(ResultWriter):
+    """Collects pages into small record batches and appends them to an Arrow/Parquet file"""
+
+    batch_size = 64
+
+    def __init__(self, path):
+        if not ARROW_SUPPORT:
+            raise RuntimeError("Parquet/Arrow output requires pyarrow: pip install pyarrow")
+        import pyarrow as pa
+
+        super().__init__(path)
+        self.schema = pa.schema([
+            ('source', pa.string()),
+            ('page', pa.int32()),
+            ('success', pa.bool_()),
+            ('output', pa.large_string()),
+            ('error', pa.string()),
+            ('elapsed_s', pa.float64()),
+            ('cached', pa.bool_()),
+            ('reused', pa.bool_()),
+            ('input_tokens', pa.int64()),
+            ('output_tokens', pa.int64()),
+            ('gpu_seconds', pa.float64()),
+            ('text_offset', pa.int64()),
+            ('text_length', pa.int64()),
+            ('width', pa.int32()),
+            ('height', pa.int32()),
+            ('metadata', pa.string()),
+        ])
+        self.rows = []
+        self.writer = self._open_writer()
+
+    def _open_writer(self):
+        raise NotImplementedError
+
+    def _write_record(self, record):
+        record = dict(record, metadata=json.dumps(record['metadata']))
+        self.rows.append(record)
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            import pyarrow as pa
+            self.writer.write_batch(pa.RecordBatch.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+class ParquetWriter(_ArrowWriterBase):
+    """Parquet file, one row group per batch of pages"""
+
+    extension = '.parquet'
+
+    def _open_writer(self):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.path, self.schema, compression='zstd')
+
+
+class ArrowWriter(_ArrowWriterBase):
+    """Arrow IPC file (memory-mappable for fast bulk loads)"""
+
+    extension = '.arrow'
+
+    def _open_writer(self):
+        import pyarrow as pa
+        import pyarrow.ipc
+        self.sink = pa.OSFile(self.path, 'wb')
+        return pa.ipc.new_file(self.sink, self.schema)
+
+    def close(self):
+        super().close()
+        self.sink.close()
+
+
+class HOCRWriter(ResultWriter):
+    """
+    hOCR document with one ocr_page per page and one ocr_line per output line.
+    The model returns no word boxes, so bboxes cover the whole page; each page's
+    x_text_offset locates its text in the concatenated document text.
+    """
+
+    extension = '.hocr'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.f = open(path, 'w', encoding='utf-8')
+        self.f.write(
+            "<?xml version='1.0' encoding='UTF-8'?>\n"
+            "<!DOCTYPE html PUBLIC '-//W3C//DTD XHTML 1.0 Transitional//EN' "
+            "'http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd'>\n"
+            "<html xmlns='http://www.w3.org/1999/xhtml' xml:lang='en' lang='en'>\n"
+            "<head>\n"
+            "<title></title>\n"
+            "<meta http-equiv='Content-Type' content='text/html;charset=utf-8'/>\n"
+            "<meta name='ocr-system' content='GLM-OCR'/>\n"
+            "<meta name='ocr-capabilities' content='ocr_page ocr_par ocr_line'/>\n"
+            "</head>\n"
+            "<body>\n"
+        )
+
+    def _write_record(self, record):
+        width = record['width'] or 0
+        height = record['height'] or 0
+        title = (
+            f"image {html.escape(json.dumps(record['source'] or ''), quote=True)}; "
+            f"bbox 0 0 {width} {height}; ppageno {record['page'] - 1}; "
+            f"x_text_offset {record['text_offset']}"
+        )
+        page_id = record['page']
+        self.f.write(f"<div class='ocr_page' id='page_{page_id}' title='{title}'>\n")
+        if record['success']:
+            self.f.write(f"<p class='ocr_par' id='par_{page_id}_1'>\n")
+            for n, line in enumerate(record['output'].splitlines(), 1):
+                if line.strip():
+                    self.f.write(
+                        f"<span class='ocr_line' id='line_{page_id}_{n}' "
+                        f"title='bbox 0 0 {width} {height}'>{html.escape(line)}</span>\n"
+                    )
+            self.f.write("</p>\n")
+        self.f.write("</div>\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.write("</body>\n</html>\n")
+        self.f.close()
+
+
+WRITERS = {
+    'txt': TextWriter,
+    'jsonl': JSONLWriter,
+    'parquet': ParquetWriter,
+    'arrow': ArrowWriter,
+    'hocr': HOCRWriter,
+}
+
+
+def open_writer(fmt, base_path):
+    """Open a writer for `fmt` at base_path + the format's extension"""
+    writer_cls = WRITERS[fmt]
+    suffix = '_ocr_results' + writer_cls.extension
+    return writer_cls(base_path + suffix)
@@ -4,14 +4,54 @@ Keeps the model loaded in memory and serves predictions via HTTP API
 Run this separately from the Streamlit app for optimal performance
 """
 
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
-from transformers import AutoProcessor, AutoModelForImageTextToText
+from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi.responses import FileResponse, JSONResponse
+from transformers import (
+    AutoModelForCausalLM,
+    AutoModelForImageTextToText,
+    AutoProcessor,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
 import torch
-from PIL import Image
-import io
 import uvicorn
+import asyncio
+import io
+import json
+import math
+import os
+import time
 import logging
+from contextlib import nullcontext
+
+from batching import BATCHING, ContinuousBatcher, ModelStepper
+from cancellation import CancellationCriteria, CancellationMetrics, CancellationToken, RequestCancelled
+from decoding import DECODING_MODES, DRAFT_MODEL_PATH, GenerationTimer, generation_kwargs
+from idempotency import IdempotencyCache, request_fingerprint
+from profiling import NO_PROFILE, Profiler, ProfilerBusy
+from replicas import Replica, ReplicaPool, plan_replicas
+from shm_transport import InvalidDescriptor, SharedImages
+from stream_protocol import FrameError, encode_frame, read_frame
+from tables import page_block, stitch_tables
+from structured_output import (
+    IncrementalJSONValidator,
+    is_json_prompt,
+    is_table_prompt,
+    schema_from_prompt,
+    structure_output,
+)
+from usage import ANONYMOUS, QuotaExceeded, UnknownKey, UsageTracker, request_usage, sum_usage
+from uploads import (
+    MAX_IMAGE_PIXELS,
+    MAX_UPLOAD_BYTES,
+    InvalidImage,
+    MemoryTracker,
+    UploadLimitMiddleware,
+    UploadTooLarge,
+    apply_limits,
+    open_image,
+    upload_frames,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,33 +59,131 @@ logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(title="GLM-OCR Server", version="1.0")
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
 
 # Global model and processor
 MODEL = None
 PROCESSOR = None
+DRAFT_MODEL = None
+POOL = None
 MODEL_PATH = "zai-org/GLM-OCR"
+# "model" loads MODEL_PATH; "stub" simulates it without weights or a GPU (see stub_backend.py)
+BACKEND = os.getenv("GLM_OCR_BACKEND", "model")
+MAX_NEW_TOKENS = 8192
+CANCELLATION_METRICS = CancellationMetrics()
+IDEMPOTENCY = IdempotencyCache()
+# Binary stream API (see stream_protocol.py); 0 disables the listener
+STREAM_PORT = int(os.getenv("GLM_OCR_STREAM_PORT", 8509))
+STREAM_MAX_IN_FLIGHT = int(os.getenv("GLM_OCR_STREAM_MAX_IN_FLIGHT", 64))
+STREAM_STATS = {"connections": 0, "open_connections": 0, "requests": 0}
+PROFILER = Profiler()
+USAGE = UsageTracker()
+# Required in X-Admin-Token for /admin endpoints; without it they only answer loopback clients
+ADMIN_TOKEN = os.getenv("GLM_OCR_ADMIN_TOKEN")
+
+
+class JSONSchemaStoppingCriteria(StoppingCriteria):
+    """
+    Feeds newly decoded text to an IncrementalJSONValidator after every decode step.
+    Stops generation as soon as the output goes off-schema or the JSON value is closed,
+    so malformed or trailing output doesn't burn tokens up to max_new_tokens.
+
+    Only the tokens since the last emitted text are decoded, with the token before them
+    as context (tokenizers that drop or add a leading space need it), so each step costs
+    the same however long the output gets. Text ending in an incomplete byte sequence
+    ("\ufffd") is held back until the next token completes it.
+    """
+
+    def __init__(self, tokenizer, prompt_length, validator):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.validator = validator
+        self.stopped_early = False
+        # Output token offsets: context for the next decode, and end of the emitted text
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        ids = input_ids[0, self.prompt_length + self._prefix_offset:].tolist()
+        emitted = self._read_offset - self._prefix_offset
+        prefix = self.tokenizer.decode(ids[:emitted], skip_special_tokens=True)
+        text = self.tokenizer.decode(ids, skip_special_tokens=True)
+        if len(text) > len(prefix) and not text.endswith("\ufffd"):
+            self.validator.feed(text[len(prefix):])
+            self._prefix_offset, self._read_offset = self._read_offset, self._prefix_offset + len(ids)
+
+        stop = not self.validator.ok or self.validator.complete
+        self.stopped_early = self.stopped_early or stop
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+
+def load_replica(replica):
+    """Load the model (and optional draft model) onto one replica's device"""
+    if BACKEND == "stub":
+        from stub_backend import load_stub_replica
+        load_stub_replica(replica, draft=bool(DRAFT_MODEL_PATH))
+        return
+
+    device_map = "auto" if replica.device == "auto" else replica.device
+    replica.processor = AutoProcessor.from_pretrained(MODEL_PATH)
+    replica.model = AutoModelForImageTextToText.from_pretrained(
+        pretrained_model_name_or_path=MODEL_PATH,
+        torch_dtype="auto",
+        device_map=device_map,
+    )
+
+    # Optional small draft model for assisted decoding (must share the tokenizer)
+    if DRAFT_MODEL_PATH:
+        replica.draft_model = AutoModelForCausalLM.from_pretrained(
+            DRAFT_MODEL_PATH,
+            torch_dtype="auto",
+        ).to(replica.model.device)
+
+def start_batcher(replica):
+    """Attach a continuous-batching scheduler to a loaded replica"""
+    if BACKEND == "stub":
+        from stub_backend import StubStepper
+        stepper = StubStepper(replica.model)
+    else:
+        stepper = ModelStepper(replica.model)
+    replica.batcher = ContinuousBatcher(replica, stepper)
 
 @app.on_event("startup")
 async def load_model():
-    """Load model on server startup"""
-    global MODEL, PROCESSOR
+    """Load one model replica per device on server startup"""
+    global MODEL, PROCESSOR, DRAFT_MODEL, POOL
+
+    apply_limits()
 
     logger.info("="*80)
     logger.info("Loading GLM-OCR Model...")
-    logger.info(f"Model: {MODEL_PATH}")
+    logger.info(f"Model: {MODEL_PATH}" + (" (stub backend, simulated)" if BACKEND == "stub" else ""))
     logger.info("="*80)
 
     try:
-        PROCESSOR = AutoProcessor.from_pretrained(MODEL_PATH)
-        MODEL = AutoModelForImageTextToText.from_pretrained(
-            pretrained_model_name_or_path=MODEL_PATH,
-            torch_dtype="auto",
-            device_map="auto",
-        )
+        replicas = [Replica(i, device, cpus) for i, (device, cpus) in enumerate(plan_replicas(torch))]
+        for replica in replicas:
+            # Load on the replica's own thread so NUMA pinning applies to its allocations
+            replica.executor.submit(load_replica, replica).result()
+            if BATCHING == "continuous":
+                replica.executor.submit(start_batcher, replica).result()
+            logger.info(f"Replica {replica.index} loaded on {replica.model.device} ({replica.model.dtype})")
+
+        POOL = ReplicaPool(replicas)
+        MODEL = replicas[0].model
+        PROCESSOR = replicas[0].processor
+        DRAFT_MODEL = replicas[0].draft_model
+
+        if STREAM_PORT:
+            await asyncio.start_server(handle_stream, "0.0.0.0", STREAM_PORT)
+            logger.info(f"Binary stream API listening on port {STREAM_PORT}")
 
         logger.info(f"Model loaded successfully!")
-        logger.info(f"Device: {MODEL.device}")
-        logger.info(f"Dtype: {MODEL.dtype}")
+        logger.info(f"Replicas: {len(replicas)}")
+        if BATCHING == "continuous":
+            logger.info(f"Continuous batching: {replicas[0].batcher.allocator.num_blocks} KV blocks per replica")
+        if DRAFT_MODEL is not None:
+            logger.info(f"Draft model: {DRAFT_MODEL_PATH}")
         logger.info("="*80)
         logger.info("Server is ready to accept requests!")
 
@@ -59,98 +197,442 @@ async def root():
     return {
         "status": "ok",
         "model": MODEL_PATH,
+        "backend": BACKEND,
         "model_loaded": MODEL is not None,
-        "device": str(MODEL.device) if MODEL else None
+        "device": str(MODEL.device) if MODEL else None,
+        "stream_port": STREAM_PORT or None,
+        "batching": BATCHING,
+        "decoding_modes": [m for m in DECODING_MODES if m != "assisted" or DRAFT_MODEL is not None],
+        **(POOL.status() if POOL else {})
     }
 
+def run_ocr(replica, pil_image, prompt, structured=True, decoding="greedy", cancel=None, profile=NO_PROFILE):
+    """Run one image through the model; returns output text, generation stats, token usage and the structured block"""
+    start = time.perf_counter()
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "image": pil_image
+                },
+                {
+                    "type": "text",
+                    "text": prompt
+                }
+            ],
+        }
+    ]
+
+    # Process
+    with profile.stage("apply_chat_template"):
+        inputs = replica.processor.apply_chat_template(
+            messages,
+            tokenize=True,
+            add_generation_prompt=True,
+            return_dict=True,
+            return_tensors="pt"
+        ).to(replica.model.device)
+
+    inputs.pop("token_type_ids", None)
+
+    # JSON-mode prompts are validated against their template while decoding
+    prompt_length = inputs["input_ids"].shape[1]
+    json_criteria = None
+    generate_kwargs = generation_kwargs(decoding, replica.draft_model)
+    stopping_criteria = StoppingCriteriaList()
+    if structured and is_json_prompt(prompt):
+        validator = IncrementalJSONValidator(schema_from_prompt(prompt))
+        json_criteria = JSONSchemaStoppingCriteria(replica.processor.tokenizer, prompt_length, validator)
+        stopping_criteria.append(json_criteria)
+
+    # Abort mid-decode if the client disconnects or its deadline passes
+    if cancel is not None:
+        stopping_criteria.append(CancellationCriteria(cancel))
+
+    # Generate
+    timer = GenerationTimer(decoding)
+    generate_start = time.perf_counter()
+    batch_seconds = None
+    with profile.stage("generate"):
+        if replica.batcher is not None and not profile.traced:
+            # Joins the replica's running batch at the next decode step and leaves it when done
+            generated_ids, batch_seconds = replica.batcher.generate(
+                inputs, MAX_NEW_TOKENS, stopping_criteria, generate_kwargs, cancel
+            )
+        else:
+            # A traced request pauses the batch and runs here, where the torch profiler sees it
+            with replica.batcher.pause() if replica.batcher is not None else nullcontext():
+                generated_ids = replica.model.generate(
+                    **inputs,
+                    max_new_tokens=MAX_NEW_TOKENS,
+                    stopping_criteria=stopping_criteria,
+                    **generate_kwargs
+                )
+    generate_seconds = time.perf_counter() - generate_start
+    new_ids = generated_ids[0][prompt_length:]
+    if cancel is not None and cancel.cancelled:
+        raise RequestCancelled(cancel.reason, len(new_ids))
+    CANCELLATION_METRICS.record_completed(len(new_ids))
+    with profile.stage("decode"):
+        output_text = replica.processor.decode(
+            new_ids,
+            skip_special_tokens=True
+        )
+
+    # Requests in a batch share its decode steps: charge this one its share, not the time it waited
+    gpu_seconds = time.perf_counter() - start
+    if batch_seconds is not None:
+        gpu_seconds += batch_seconds - generate_seconds
+
+    # Vision tokens are the image placeholder tokens the processor expanded the image into
+    image_token_id = getattr(replica.processor, "image_token_id", None)
+    vision_tokens = int((inputs["input_ids"][0] == image_token_id).sum()) if image_token_id is not None else 0
+    result = {
+        "output": output_text,
+        "generation": timer.report(len(new_ids)),
+        "usage": request_usage(prompt_length, vision_tokens, len(new_ids), gpu_seconds),
+    }
+    if structured:
+        validator = json_criteria.validator if json_criteria else None
+        result["structured"] = structure_output(output_text, prompt, validator)
+        if json_criteria:
+            result["structured"]["aborted"] = json_criteria.stopped_early and not validator.complete
+            if not validator.ok:
+                logger.warning(f"JSON output went off-schema: {validator.error}")
+
+    return result
+
+def predict_on_replica(replica, pil_image, prompt, structured, decoding, cancel):
+    """OCR every frame of an image on one replica (runs on the replica's worker thread)"""
+    # The client may have gone away (or run out of time) while this request was queued
+    cancel.check()
+    memory = MemoryTracker(torch, replica.model.device, shared=replica.batcher is not None)
+    pages = []
+    # No-op unless an /admin/profile session is armed
+    with PROFILER.request() as profile:
+        for index, frame in enumerate(upload_frames(pil_image), 1):
+            pages.append({"page": index, **run_ocr(replica, frame, prompt, structured, decoding, cancel, profile)})
+            del frame
+    return pages, memory.report()
+
+async def watch_disconnect(request, cancel, interval=0.25):
+    """Trip the cancellation token as soon as the client disconnects"""
+    while not cancel.cancelled:
+        if await request.is_disconnected():
+            cancel.cancel("disconnect")
+            return
+        await asyncio.sleep(interval)
+
 @app.post("/predict")
 async def predict(
+    request: Request,
     image: UploadFile = File(...),
-    prompt: str = Form("Text Recognition:")
+    prompt: str = Form("Text Recognition:"),
+    structured: bool = Form(True),
+    decoding: str = Form("greedy"),
+    timeout: float = Form(None)
 ):
     """
     Perform OCR prediction on uploaded image
 
     Parameters:
-    - image: Image file
+    - image: Image file (multi-frame TIFFs are processed frame by frame, one page per frame)
     - prompt: Task prompt (e.g., "Text Recognition:", "Table Recognition:")
+    - structured: Validate JSON output while generating and return parsed objects / table cells
+    - decoding: "greedy" (default), "prompt_lookup" or "assisted" (draft model); same output, fewer decode steps
+    - timeout: Seconds the client will wait; generation is aborted once it passes
+
+    Headers:
+    - Idempotency-Key: Retries with the same key (and API key, and body) share one execution /
+      replay its response; the same key with a different body gets 422
+    - X-API-Key: Tenant the request's tokens are counted and rate limited against
 
     Returns:
     - JSON with prediction result
     """
+    key = request.headers.get("Idempotency-Key")
+    if key:
+        fingerprint = await asyncio.to_thread(
+            request_fingerprint, image.file, prompt=prompt, structured=structured, decoding=decoding
+        )
+        return await IDEMPOTENCY.run(
+            key, lambda: _predict(request, image, prompt, structured, decoding, timeout),
+            request.headers.get("X-API-Key") or ANONYMOUS, fingerprint
+        )
+    return await _predict(request, image, prompt, structured, decoding, timeout)
+
+async def _predict(request, image, prompt, structured, decoding, timeout):
+    cancel = CancellationToken(timeout)
+    watcher = asyncio.create_task(watch_disconnect(request, cancel))
+    api_key = request.headers.get("X-API-Key") or ANONYMOUS
+    try:
+        # The upload is already spooled (to disk above the threshold); decode lazily from it
+        status_code, content = await infer(
+            lambda: open_image(image.file), prompt, structured, decoding, cancel, api_key
+        )
+    finally:
+        watcher.cancel()
+    headers = {"Retry-After": str(math.ceil(content["retry_after"]))} if status_code == 429 else None
+    return JSONResponse(status_code=status_code, content=content, headers=headers)
+
+async def infer(opener, prompt, structured, decoding, cancel, api_key=ANONYMOUS):
+    """
+    OCR the image returned by opener(); returns (HTTP status code, response dict).
+    Shared by /predict and the binary stream API, so both see the same backend, quotas and errors.
+    """
     try:
-        # Read image
-        image_bytes = await image.read()
-        pil_image = Image.open(io.BytesIO(image_bytes))
-
-        # Save temporarily
-        temp_path = "temp_server_image.png"
-        pil_image.save(temp_path)
-
-        # Prepare message
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "url": temp_path
-                    },
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ],
-            }
-        ]
-
-        # Process
-        inputs = PROCESSOR.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_dict=True,
-            return_tensors="pt"
-        ).to(MODEL.device)
+        generation_kwargs(decoding, DRAFT_MODEL)
+        USAGE.admit(api_key)
+    except ValueError as e:
+        return 400, {"success": False, "error": str(e)}
+    except UnknownKey as e:
+        return 401, {"success": False, "error": str(e)}
+    except QuotaExceeded as e:
+        return 429, {"success": False, "error": str(e), "retry_after": round(e.retry_after, 1)}
 
-        inputs.pop("token_type_ids", None)
+    try:
+        pil_image = opener()
 
-        # Generate
+        # Generation runs on whichever replica is idle, off the event loop
         logger.info(f"Processing image with prompt: {prompt}")
-        generated_ids = MODEL.generate(**inputs, max_new_tokens=8192)
-        output_text = PROCESSOR.decode(
-            generated_ids[0][inputs["input_ids"].shape[1]:],
-            skip_special_tokens=True
-        )
+        pages, memory = await POOL.run(predict_on_replica, pil_image, prompt, structured, decoding, cancel)
 
         logger.info("Prediction completed successfully")
 
-        return JSONResponse({
+        response = {
             "success": True,
-            "output": output_text,
+            "output": pages[0]["output"] if len(pages) == 1 else "\n\n".join(p["output"] for p in pages),
             "prompt": prompt
-        })
+        }
+        if len(pages) == 1:
+            response["generation"] = pages[0]["generation"]
+            if structured:
+                response["structured"] = pages[0]["structured"]
+        else:
+            response["pages"] = pages
+            if structured and is_table_prompt(prompt):
+                # Multi-page TIFFs: tables that run across frames come back as one
+                response["tables"] = stitch_tables([page_block(p) for p in pages])
+        response["usage"] = sum_usage([p["usage"] for p in pages])
+        response["memory"] = memory
+        USAGE.record(api_key, response["usage"])
+
+        return 200, response
+
+    except UploadTooLarge as e:
+        logger.warning(f"Rejected upload: {str(e)}")
+        return 413, {"success": False, "error": str(e)}
+
+    except (InvalidDescriptor, InvalidImage) as e:
+        # The request itself is bad: retrying it can't help, so not a 5xx
+        return 400, {"success": False, "error": str(e)}
+
+    except RequestCancelled as e:
+        CANCELLATION_METRICS.record_cancelled(e.reason, e.generated_tokens)
+        USAGE.record(api_key, request_usage(0, 0, e.generated_tokens, 0))
+        logger.warning(f"Generation aborted ({e.reason}) after {e.generated_tokens} tokens")
+        # 499: client closed request (nginx convention); 504 for an expired deadline
+        return 499 if e.reason == "disconnect" else 504, {
+            "success": False,
+            "error": str(e),
+            "cancelled": e.reason
+        }
 
     except Exception as e:
         logger.error(f"Prediction error: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={
-                "success": False,
-                "error": str(e)
-            }
-        )
+        return 500, {
+            "success": False,
+            "error": str(e)
+        }
+
+async def stream_request(header, payload, cancel, shared):
+    """
+    Answer one stream frame; same semantics as /predict, Idempotency-Key included.
+    A "shm" descriptor (same-host clients only, `shared` is None otherwise) replaces the payload.
+    """
+    if "shm" in header:
+        if shared is None:
+            return 403, {"success": False, "error": "Shared memory is only accepted from this host"}
+        opener = lambda: shared.open(header["shm"])
+    elif payload is None:
+        return 413, {"success": False, "error": f"Image exceeds {MAX_UPLOAD_BYTES} bytes"}
+    else:
+        opener = lambda: open_image(io.BytesIO(payload))
+    prompt = header.get("prompt", "Text Recognition:")
+    structured = bool(header.get("structured", True))
+    decoding = header.get("decoding", "greedy")
+    api_key = header.get("api_key") or ANONYMOUS
+    key = header.get("idempotency_key")
+    if not key:
+        return await infer(opener, prompt, structured, decoding, cancel, api_key)
+
+    async def handler():
+        status_code, content = await infer(opener, prompt, structured, decoding, cancel, api_key)
+        return JSONResponse(status_code=status_code, content=content)
+
+    try:
+        data = shared.view(header["shm"])[1] if "shm" in header else payload
+    except (InvalidDescriptor, UploadTooLarge) as e:
+        return (413 if isinstance(e, UploadTooLarge) else 400), {"success": False, "error": str(e)}
+    fingerprint = request_fingerprint(data, prompt=prompt, structured=structured, decoding=decoding)
+    del data  # a view into the client's segment; don't pin it while the request runs
+    response = await IDEMPOTENCY.run(key, handler, api_key, fingerprint)
+    return response.status_code, json.loads(response.body)
+
+async def handle_stream(reader, writer):
+    """
+    One persistent binary-stream connection. Each request frame runs as soon as it is read
+    (up to STREAM_MAX_IN_FLIGHT at once) and its response frame is written when it finishes,
+    tagged with the request's "id". If the client goes away, its in-flight requests are cancelled.
+    """
+    STREAM_STATS["connections"] += 1
+    STREAM_STATS["open_connections"] += 1
+    slots = asyncio.Semaphore(STREAM_MAX_IN_FLIGHT)
+    write_lock = asyncio.Lock()
+    in_flight = {}
+    peer = writer.get_extra_info("peername")
+    shared = SharedImages(MAX_IMAGE_PIXELS) if peer and peer[0] in ("127.0.0.1", "::1") else None
+
+    async def send(header):
+        async with write_lock:
+            writer.write(encode_frame(header))
+            await writer.drain()
+
+    async def answer(header, payload, cancel):
+        try:
+            status_code, content = await stream_request(header, payload, cancel, shared)
+            await send({"id": header.get("id"), "status": status_code, **content})
+        except ConnectionError:
+            # Peer is gone: stop the rest of this connection's work too
+            for token in in_flight.values():
+                token.cancel("disconnect")
+        finally:
+            slots.release()
+
+    tasks = set()
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                frame = await read_frame(reader, MAX_UPLOAD_BYTES)
+            except FrameError as e:
+                logger.warning(f"Closing stream connection: {e}")
+                await send({"id": None, "status": 400, "success": False, "error": str(e)})
+                break
+            if frame is None:
+                break
+            header, payload = frame
+            STREAM_STATS["requests"] += 1
+            cancel = CancellationToken(header.get("timeout"))
+            task = asyncio.create_task(answer(header, payload, cancel))
+            in_flight[task] = cancel
+            tasks.add(task)
+            task.add_done_callback(lambda t: (tasks.discard(t), in_flight.pop(t, None)))
+        # End of input: the client may have only shut down its sending side, so finish the work
+        await asyncio.gather(*tasks, return_exceptions=True)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        for token in in_flight.values():
+            token.cancel("disconnect")
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        STREAM_STATS["open_connections"] -= 1
+        if shared is not None:
+            shared.close()
+        writer.close()
+
+@app.get("/metrics")
+async def metrics():
+    """Cancellation counters (aborted requests, decode tokens saved), idempotent replays, stream usage and batching"""
+    return {
+        "cancellation": CANCELLATION_METRICS.report(),
+        "idempotency": IDEMPOTENCY.status(),
+        "stream": STREAM_STATS,
+        "batching": [r.batcher.status() for r in POOL.replicas if r.batcher] if POOL else [],
+    }
+
+@app.get("/usage")
+async def usage(request: Request):
+    """Lifetime token usage and current quota of the caller's X-API-Key"""
+    try:
+        return USAGE.report(request.headers.get("X-API-Key") or ANONYMOUS)
+    except UnknownKey as e:
+        return JSONResponse(status_code=401, content={"success": False, "error": str(e)})
+
+def admin_denied(request):
+    """403 response unless the request carries ADMIN_TOKEN (or, with no token set, comes from loopback)"""
+    if ADMIN_TOKEN:
+        allowed = request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+    else:
+        allowed = request.client is not None and request.client.host in ("127.0.0.1", "::1", "localhost")
+    if allowed:
+        return None
+    return JSONResponse(status_code=403, content={"success": False, "error": "Admin access denied"})
+
+@app.get("/admin/usage")
+async def usage_by_key(request: Request):
+    """Lifetime token usage of every API key"""
+    return admin_denied(request) or USAGE.store.totals()
+
+@app.post("/admin/profile")
+async def start_profile(request: Request, requests: int = 0, seconds: float = 0,
+                        interval_ms: float = 5, torch_trace: bool = True):
+    """
+    Profile the next `requests` requests or `seconds` seconds, whichever ends first (10 s if neither):
+    Python stack samples every `interval_ms` plus per-request torch profiler traces
+    """
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    try:
+        session = PROFILER.start(requests, seconds, interval_ms, torch_trace)
+    except ProfilerBusy as e:
+        return JSONResponse(status_code=409, content={"success": False, "error": str(e)})
+    logger.info(f"Profiling session {session.id} started")
+    return {"success": True, **session.info()}
+
+@app.delete("/admin/profile")
+async def stop_profile(request: Request):
+    """End the running profiling session early; its artifacts are still written"""
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    session = PROFILER.stop()
+    return {"success": session is not None, "id": session.id if session else None}
+
+@app.get("/admin/profile")
+async def profile_status(request: Request):
+    """Running session (if any) and the artifacts of finished sessions"""
+    return admin_denied(request) or PROFILER.status()
+
+@app.get("/admin/profile/{session_id}/{name}")
+async def profile_artifact(request: Request, session_id: str, name: str):
+    """Download an artifact: stacks.folded, summary.json, trace-NNN.json or ops-NNN.txt"""
+    denied = admin_denied(request)
+    if denied:
+        return denied
+    path = PROFILER.artifact_path(session_id, name)
+    if path is None:
+        return JSONResponse(status_code=404, content={"success": False, "error": "No such artifact"})
+    return FileResponse(path, filename=f"{session_id}-{name}")
 
 if __name__ == "__main__":
     print("\n" + "="*80)
     print("GLM-OCR Model Server")
     print("="*80)
-    print("\nStarting server on http://localhost:8508")
+    port = int(os.getenv("GLM_OCR_PORT", 8508))
+    print(f"\nStarting server on http://localhost:{port}")
     print("\nEndpoints:")
     print("  GET  /          - Health check")
     print("  POST /predict   - OCR prediction")
+    print("  GET  /metrics   - Server metrics")
+    print("  GET  /usage     - Token usage and quota of your X-API-Key")
+    print("  POST /admin/profile - Capture a profile (stack samples + torch traces)")
+    if STREAM_PORT:
+        print(f"  TCP  :{STREAM_PORT}     - Binary stream API (stream_client.py)")
     print("\nThe model will load once and stay in memory.")
     print("Use this server with the Streamlit app for fast inference!")
     print("="*80 + "\n")
 
-    uvicorn.run(app, host="0.0.0.0", port=8508, log_level="info")
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
@@ -0,0 +1,244 @@
+"""
+Same-host shared-memory transport for the GLM-OCR server
+A client on the server's host copies raw page pixels into a shared-memory ring buffer and
+sends only a small descriptor over the binary stream API; the server wraps those bytes in a
+PIL image in place. No PNG encode/decode, and the pixels never cross a socket.
+Standard library plus Pillow; descriptors are only accepted from loopback connections.
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeout
+from multiprocessing import resource_tracker, shared_memory
+
+from ocr_client import DEADLINE_MARGIN, RETRY_STATUS
+from stream_client import DEFAULT_STREAM_HOST, DEFAULT_STREAM_PORT, StreamClient, StreamError
+
+# Only segments with this prefix can be attached, so a client can't point the server at
+# another program's shared memory
+SEGMENT_PREFIX = "glm_ocr_"
+RING_BYTES = int(float(os.getenv("GLM_OCR_SHM_RING_MB", 256)) * 1024 * 1024)
+MODES = {"RGB": 3, "L": 1}
+
+
+class InvalidDescriptor(ValueError):
+    """A shared-memory descriptor that doesn't describe a valid image in a GLM-OCR segment"""
+
+
+class ShmRing:
+    """
+    Client-side ring buffer in one shared-memory segment.
+    Images are placed one after another and wrap to the start; put() blocks while the ring is
+    full until release() frees the oldest entries. Entries may be released in any order.
+    """
+
+    def __init__(self, size=RING_BYTES):
+        self.segment = shared_memory.SharedMemory(
+            name=f"{SEGMENT_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:8]}", create=True, size=size
+        )
+        self.size = self.segment.size
+        self._entries = deque()  # [offset, size, released], oldest first
+        self._cond = threading.Condition()
+
+    def _free_offset(self, size):
+        """Offset where `size` bytes fit without overwriting a live entry, or None"""
+        if not self._entries:
+            return 0
+        tail = self._entries[0][0]
+        newest = self._entries[-1]
+        head = newest[0] + newest[1]
+        if newest[0] >= tail:
+            # Live entries span [tail, head): use the end, else wrap to the start
+            if head + size <= self.size:
+                return head
+            return 0 if size <= tail else None
+        # Wrapped: live entries span [tail, end) and [0, head)
+        return head if head + size <= tail else None
+
+    def put(self, image, timeout=None):
+        """Copy an RGB or L image into the ring; returns its descriptor"""
+        if image.mode not in MODES:
+            image = image.convert("RGB")
+        data = image.tobytes()
+        if len(data) > self.size:
+            raise ValueError(f"Image of {len(data)} bytes doesn't fit the {self.size}-byte ring")
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free_offset(len(data)) is not None, timeout):
+                raise TimeoutError("Shared-memory ring stayed full")
+            offset = self._free_offset(len(data))
+            self._entries.append([offset, len(data), False])
+        self.segment.buf[offset:offset + len(data)] = data
+        return {
+            "name": self.segment.name,
+            "offset": offset,
+            "size": len(data),
+            "width": image.width,
+            "height": image.height,
+            "mode": image.mode,
+        }
+
+    def release(self, descriptor):
+        """Free a descriptor's space once the server has answered for it"""
+        with self._cond:
+            for entry in self._entries:
+                if entry[0] == descriptor["offset"] and not entry[2]:
+                    entry[2] = True
+                    break
+            while self._entries and self._entries[0][2]:
+                self._entries.popleft()
+            self._cond.notify_all()
+
+    def close(self):
+        self.segment.close()
+        self.segment.unlink()
+
+
+def _attach_untracked(name):
+    """
+    Attach an existing segment without handing it to this process's resource tracker, which
+    would unlink it at exit although the client owns it. Python 3.13+ has track=False; before
+    that, attaching always registers the segment, so it is unregistered again right away via
+    resource_tracker.unregister and the segment's private _name (the usual workaround, bpo-39959)
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    segment = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+class SharedImages:
+    """Server side: segments attached for one stream connection, opened as images in place"""
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self._segments = {}
+
+    def _attach(self, name):
+        segment = self._segments.get(name)
+        if segment is None:
+            if not isinstance(name, str) or not name.startswith(SEGMENT_PREFIX) or "/" in name:
+                raise InvalidDescriptor(f"Not a GLM-OCR shared-memory segment: {name!r}")
+            try:
+                segment = _attach_untracked(name)
+            except FileNotFoundError:
+                raise InvalidDescriptor(f"Shared-memory segment {name} does not exist")
+            self._segments[name] = segment
+        return segment
+
+    def open(self, descriptor):
+        """PIL image backed directly by the segment's bytes (read-only, no copy)"""
+        from PIL import Image
+
+        (width, height, mode), pixels = self.view(descriptor)
+        return Image.frombuffer(mode, (width, height), pixels, "raw", mode, 0, 1)
+
+    def view(self, descriptor):
+        """((width, height, mode), memoryview of the pixels) of a validated descriptor"""
+        from uploads import UploadTooLarge
+
+        try:
+            name, offset, size = descriptor["name"], int(descriptor["offset"]), int(descriptor["size"])
+            width, height, mode = int(descriptor["width"]), int(descriptor["height"]), descriptor["mode"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidDescriptor(f"Malformed shared-memory descriptor: {e}")
+        if mode not in MODES or width <= 0 or height <= 0 or size != width * height * MODES[mode]:
+            raise InvalidDescriptor("Descriptor size doesn't match its width, height and mode")
+        if width * height > self.max_pixels:
+            raise UploadTooLarge(f"Image has {width * height} pixels, limit is {self.max_pixels}")
+
+        segment = self._attach(name)
+        if offset < 0 or offset + size > segment.size:
+            raise InvalidDescriptor("Descriptor lies outside its shared-memory segment")
+        return (width, height, mode), segment.buf[offset:offset + size]
+
+    def close(self):
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # An image still references the mapping; it's unmapped when that is collected
+                pass
+        self._segments.clear()
+
+
+class SharedMemoryClient:
+    """
+    OCR client for a server on the same host: pages go through a ShmRing and a descriptor
+    frame on the stream API. Offers predict_image() like OCRClient, with the same retries:
+    429 / 502 / 503 / 504 answers, timeouts and a dropped connection (which reconnects) are
+    retried with jittered backoff under one idempotency key per page. The page stays in the
+    ring until its last attempt. There's one server, so no hedging.
+    """
+
+    def __init__(self, host=DEFAULT_STREAM_HOST, port=DEFAULT_STREAM_PORT, ring_bytes=RING_BYTES, timeout=120,
+                 api_key=None, retries=3, backoff=0.5, max_backoff=8.0):
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.stream = StreamClient(host, port, api_key=api_key)
+        self.ring = ShmRing(ring_bytes)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "replayed": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _reconnect(self, failed):
+        """Replace the stream connection, unless another thread already has"""
+        with self._lock:
+            if self.stream is failed:
+                failed.close()
+                self.stream = StreamClient(self.host, self.port, api_key=self.api_key)
+
+    def _attempt(self, descriptor, prompt, key, options):
+        stream = self.stream
+        try:
+            future = stream.submit(None, prompt, timeout=self.timeout * (1 - DEADLINE_MARGIN), shm=descriptor,
+                                   idempotency_key=key, **options)
+            return future.result(timeout=self.timeout)
+        except (StreamError, OSError):
+            self._reconnect(stream)
+            raise
+
+    def predict_image(self, image, prompt, **options):
+        """OCR one PIL image; returns the server's JSON plus `attempts`"""
+        descriptor = self.ring.put(image, timeout=self.timeout)
+        key = str(uuid.uuid4())
+        self._count("requests")
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = self._attempt(descriptor, prompt, key, options)
+                    if result.get("status") not in RETRY_STATUS or attempt == self.retries:
+                        if result.get("cached"):
+                            self._count("replayed")
+                        result["attempts"] = attempt + 1
+                        return result
+                except (StreamError, OSError, FutureTimeout):
+                    if attempt == self.retries:
+                        raise
+                self._count("retries")
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+        finally:
+            self.ring.release(descriptor)
+
+    def close(self):
+        self.stream.close()
+        self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
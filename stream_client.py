@@ -0,0 +1,120 @@
+"""
+Client for the GLM-OCR binary stream API
+Sends many images over one persistent TCP connection without waiting for earlier results;
+a reader thread matches response frames to requests by id, so results complete out of order.
+"""
+
+import itertools
+import os
+import socket
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from stream_protocol import FrameError, encode_frame, read_frame_sync
+
+DEFAULT_STREAM_HOST = "localhost"
+DEFAULT_STREAM_PORT = int(os.getenv("GLM_OCR_STREAM_PORT", 8509))
+
+
+class StreamError(Exception):
+    """The stream connection failed; raised by every request still waiting on it"""
+
+
+class StreamClient:
+    """
+    One connection to the server's stream port.
+    submit() returns a Future per image (use concurrent.futures.as_completed for completion
+    order); map() keeps up to `window` images in flight and yields results in input order.
+    Results are the same dicts /predict returns, plus "id" and "status".
+    """
+
+    def __init__(self, host=DEFAULT_STREAM_HOST, port=DEFAULT_STREAM_PORT, connect_timeout=10, api_key=None):
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.sock.makefile("rb")
+        self.api_key = api_key
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._error = None
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    def submit(self, image_bytes, prompt="Text Recognition:", structured=True, decoding="greedy",
+               timeout=None, idempotency_key=None, shm=None):
+        """
+        Send one image; returns a Future for its result dict.
+        With `shm` (a descriptor from shm_transport.ShmRing), the pixels are read from shared
+        memory instead and image_bytes is ignored.
+        """
+        request_id = next(self._ids)
+        header = {"id": request_id, "prompt": prompt, "structured": structured, "decoding": decoding}
+        if timeout is not None:
+            header["timeout"] = timeout
+        if idempotency_key:
+            header["idempotency_key"] = idempotency_key
+        if self.api_key:
+            header["api_key"] = self.api_key
+        if shm is not None:
+            header["shm"] = shm
+            image_bytes = b""
+
+        future = Future()
+        with self._lock:
+            if self._error:
+                raise self._error
+            self._pending[request_id] = future
+        with self._send_lock:
+            self.sock.sendall(encode_frame(header, image_bytes))
+        return future
+
+    def predict(self, image_bytes, prompt="Text Recognition:", **options):
+        return self.submit(image_bytes, prompt, **options).result()
+
+    def map(self, images, prompt="Text Recognition:", window=64, **options):
+        """Yield the result for each image bytes in `images`, in order, pipelining `window` at a time"""
+        in_flight = deque()
+        for image_bytes in images:
+            in_flight.append(self.submit(image_bytes, prompt, **options))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def _read_responses(self):
+        try:
+            while True:
+                frame = read_frame_sync(self._file)
+                if frame is None:
+                    raise StreamError("Server closed the stream")
+                header, _ = frame
+                with self._lock:
+                    future = self._pending.pop(header.get("id"), None)
+                if future is not None:
+                    future.set_result(header)
+                elif header.get("id") is None:
+                    raise StreamError(header.get("error", "Protocol error"))
+        except (OSError, ValueError, FrameError, StreamError) as e:
+            error = e if isinstance(e, StreamError) else StreamError(str(e))
+            with self._lock:
+                self._error = error
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(error)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._reader.join(timeout=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
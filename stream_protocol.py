@@ -0,0 +1,77 @@
+"""
+Length-prefixed binary framing for the GLM-OCR streaming API
+Each frame is an 8-byte prefix (header length, payload length; big-endian uint32), a JSON
+header and a raw payload. Clients send many requests on one connection, each with an "id";
+the server answers each as soon as it finishes, so responses arrive out of order and are
+matched by id. Standard library only, so the client side stays dependency-free.
+"""
+
+import asyncio
+import json
+import struct
+
+PREFIX = struct.Struct(">II")
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class FrameError(Exception):
+    """Malformed frame; the connection can't be resynchronised and is closed"""
+
+
+def encode_frame(header, payload=b""):
+    data = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return PREFIX.pack(len(data), len(payload)) + data + payload
+
+
+def parse_header(data):
+    try:
+        header = json.loads(data)
+    except ValueError as e:
+        raise FrameError(f"Invalid frame header: {e}")
+    if not isinstance(header, dict):
+        raise FrameError("Frame header must be a JSON object")
+    return header
+
+
+async def read_frame(reader, max_payload):
+    """
+    Read one frame; returns (header, payload) or None at a clean end of stream.
+    An oversized payload is skipped and returned as None so the request can be rejected
+    without buffering it.
+    """
+    try:
+        prefix = await reader.readexactly(PREFIX.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise FrameError("Connection closed mid-frame")
+        return None
+    header_len, payload_len = PREFIX.unpack(prefix)
+    if header_len > MAX_HEADER_BYTES:
+        raise FrameError(f"Frame header of {header_len} bytes exceeds {MAX_HEADER_BYTES}")
+    try:
+        header = parse_header(await reader.readexactly(header_len))
+
+        if payload_len > max_payload:
+            remaining = payload_len
+            while remaining:
+                # readexactly, not read(): read() returns b'' forever once the client hangs up
+                remaining -= len(await reader.readexactly(min(remaining, 1 << 20)))
+            return header, None
+        return header, await reader.readexactly(payload_len)
+    except asyncio.IncompleteReadError:
+        raise FrameError("Connection closed mid-frame")
+
+
+def read_frame_sync(sock_file):
+    """Blocking read of one frame from a socket makefile('rb'); None at end of stream"""
+    prefix = sock_file.read(PREFIX.size)
+    if not prefix:
+        return None
+    if len(prefix) < PREFIX.size:
+        raise FrameError("Connection closed mid-frame")
+    header_len, payload_len = PREFIX.unpack(prefix)
+    header = parse_header(sock_file.read(header_len))
+    payload = sock_file.read(payload_len)
+    if len(payload) < payload_len:
+        raise FrameError("Connection closed mid-frame")
+    return header, payload
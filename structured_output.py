@@ -0,0 +1,450 @@
+"""
+Structured output post-processing for GLM-OCR
+Validates JSON-mode generations against the prompt's schema while tokens stream in,
+and turns raw model output into parsed objects and table cell arrays
+"""
+
+import json
+import re
+from html.parser import HTMLParser
+
+# Tokens that can make up a JSON number or literal (true/false/null)
+_SCALAR_CHARS = set("0123456789+-.eEtrufalsn")
+# Characters allowed after a backslash in a string; \u is followed by 4 hex digits
+_ESCAPES = set('"\\/bfnrt')
+_HEX_DIGITS = set("0123456789abcdefABCDEF")
+_NUMBER_RE = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$')
+_LITERALS = ("true", "false", "null")
+_ANY = object()
+
+
+def is_json_prompt(prompt):
+    """True if the prompt asks for JSON output"""
+    return "JSON" in prompt
+
+
+def is_table_prompt(prompt):
+    """True if the prompt asks for table (HTML) output"""
+    return "Table" in prompt
+
+
+def _find_balanced(text, start):
+    """Return the end index (exclusive) of the JSON container opening at text[start], or None"""
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def schema_from_prompt(prompt):
+    """
+    Extract the JSON template embedded in a prompt, e.g. the invoice prompt in SAMPLE_CONFIGS.
+    Returns the parsed template, or None if the prompt carries no template.
+    """
+    start = prompt.find('{')
+    if start < 0:
+        return None
+    end = _find_balanced(prompt, start)
+    if end is None:
+        return None
+    try:
+        return json.loads(prompt[start:end])
+    except ValueError:
+        return None
+
+
+def extract_json(output):
+    """
+    Recover the JSON document from model output.
+    Prefers a ```json fenced block, then the first balanced object/array.
+    Returns (json_str, parsed) where parsed is None if the text is not valid JSON.
+    """
+    fence = re.search(r'```json\s*(.*?)\s*```', output, re.DOTALL)
+    if fence:
+        json_str = fence.group(1)
+    else:
+        match = re.search(r'[\{\[]', output)
+        end = _find_balanced(output, match.start()) if match else None
+        json_str = output[match.start():end] if end else output
+
+    try:
+        return json_str, json.loads(json_str)
+    except ValueError:
+        return json_str, None
+
+
+class IncrementalJSONValidator:
+    """
+    Character-level JSON validator that can be fed partial output as it is generated.
+
+    `schema` is a JSON template as found in prompts: objects list the allowed keys,
+    a list's first element describes its items, and scalars accept any scalar.
+    After each feed, `error` is set once the output goes off-schema and
+    `complete` is set once the top-level value has been closed.
+    """
+
+    def __init__(self, schema=None, max_prefix=256):
+        self.schema = schema
+        self.max_prefix = max_prefix
+        self.error = None
+        self.complete = False
+        self.consumed = 0
+        self._started = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._hex_digits = 0
+        self._string_is_key = False
+        self._key = []
+        self._scalar = []
+        self._scalar_schema = _ANY
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def feed(self, text):
+        """Validate the next chunk of output; returns True while the output is still on-schema"""
+        for char in text:
+            if self.error or self.complete:
+                break
+            self._feed_char(char)
+            self.consumed += 1
+        return self.error is None
+
+    def _fail(self, message):
+        self.error = f"{message} (at char {self.consumed})"
+
+    def _feed_char(self, char):
+        if not self._started:
+            if char in '{[':
+                self._started = True
+                self._open_value(char, self.schema)
+            elif self.consumed >= self.max_prefix:
+                self._fail("no JSON value found")
+            return
+
+        if self._in_string:
+            self._string_char(char)
+            return
+
+        if self._scalar:
+            if char in _SCALAR_CHARS:
+                self._scalar.append(char)
+                return
+            self._close_scalar()
+            if self.error:
+                return
+
+        if char.isspace():
+            return
+
+        frame = self._stack[-1]
+        state = frame['state']
+
+        if frame['type'] == 'object':
+            if state in ('key_or_end', 'key'):
+                if char == '"':
+                    self._in_string = True
+                    self._string_is_key = True
+                    self._key = []
+                elif char == '}' and state == 'key_or_end':
+                    self._close_container()
+                else:
+                    self._fail(f"expected object key, got {char!r}")
+            elif state == 'colon':
+                if char == ':':
+                    frame['state'] = 'value'
+                else:
+                    self._fail(f"expected ':', got {char!r}")
+            elif state == 'value':
+                self._start_value(char, frame['value_schema'])
+            elif state == 'comma_or_end':
+                if char == ',':
+                    frame['state'] = 'key'
+                elif char == '}':
+                    self._close_container()
+                else:
+                    self._fail(f"expected ',' or '}}', got {char!r}")
+        else:
+            if state == 'value_or_end' and char == ']':
+                self._close_container()
+            elif state in ('value_or_end', 'value'):
+                self._start_value(char, frame['item_schema'])
+            elif state == 'comma_or_end':
+                if char == ',':
+                    frame['state'] = 'value'
+                elif char == ']':
+                    self._close_container()
+                else:
+                    self._fail(f"expected ',' or ']', got {char!r}")
+
+    def _string_char(self, char):
+        if self._hex_digits:
+            # \u takes exactly 4 hex digits
+            if char not in _HEX_DIGITS:
+                self._fail(f"invalid \\u escape digit {char!r}")
+                return
+            self._hex_digits -= 1
+        elif self._escape:
+            self._escape = False
+            if char == 'u':
+                self._hex_digits = 4
+            elif char not in _ESCAPES:
+                self._fail(f"invalid escape \\{char}")
+                return
+        elif char == '\\':
+            self._escape = True
+        elif char == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._close_key(''.join(self._key))
+            else:
+                self._value_done()
+            return
+        if self._string_is_key:
+            self._key.append(char)
+
+    def _close_key(self, key):
+        frame = self._stack[-1]
+        schema = frame['schema']
+        if isinstance(schema, dict) and schema:
+            if key not in schema:
+                self._fail(f"unexpected key {key!r}")
+                return
+            frame['value_schema'] = schema[key]
+        else:
+            frame['value_schema'] = _ANY
+        frame['state'] = 'colon'
+
+    def _start_value(self, char, schema):
+        if char in '{[':
+            self._open_value(char, schema)
+        elif char == '"':
+            if isinstance(schema, (dict, list)):
+                self._fail("expected a container, got a string")
+                return
+            self._in_string = True
+            self._string_is_key = False
+        elif char in _SCALAR_CHARS:
+            self._scalar = [char]
+            self._scalar_schema = schema
+        else:
+            self._fail(f"unexpected character {char!r}")
+
+    def _open_value(self, char, schema):
+        if char == '{':
+            if schema is not None and schema is not _ANY and not isinstance(schema, dict):
+                self._fail("unexpected object")
+                return
+            self._stack.append({'type': 'object', 'state': 'key_or_end', 'schema': schema})
+        else:
+            if schema is not None and schema is not _ANY and not isinstance(schema, list):
+                self._fail("unexpected array")
+                return
+            item_schema = schema[0] if isinstance(schema, list) and schema else _ANY
+            self._stack.append({'type': 'array', 'state': 'value_or_end', 'item_schema': item_schema})
+
+    def _close_scalar(self):
+        token = ''.join(self._scalar)
+        self._scalar = []
+        if token not in _LITERALS and not _NUMBER_RE.match(token):
+            self._fail(f"invalid literal {token!r}")
+            return
+        if token != 'null' and isinstance(self._scalar_schema, (dict, list)):
+            self._fail("expected a container, got a scalar")
+            return
+        self._value_done()
+
+    def _close_container(self):
+        self._stack.pop()
+        self._value_done()
+
+    def _value_done(self):
+        if not self._stack:
+            self.complete = True
+        else:
+            self._stack[-1]['state'] = 'comma_or_end'
+
+    def finish(self):
+        """Signal end of output; flags truncated JSON as an error"""
+        if self._scalar and not self.error:
+            self._close_scalar()
+        if not self.error and not self.complete:
+            self._fail("truncated JSON" if self._started else "no JSON value found")
+        return self.error is None
+
+
+class TableParser(HTMLParser):
+    """
+    Collects <table> elements as grids of cell text, expanding rowspan/colspan.
+    Also keeps each table's unexpanded rows with a header flag per row (inside <thead> or all
+    <th>), and where the tables sit in the text, for the table pipeline in tables.py.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self.sources = []  # (rows of (text, (rowspan, colspan)), header flag per row)
+        self.spans = []    # (start, end) character offsets of each table in the fed text
+        self._rows = None
+        self._heads = None
+        self._row = None
+        self._row_head = False
+        self._cell = None
+        self._span = (1, 1)
+        self._depth = 0
+        self._in_head = False
+        self._start = None
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_offsets[line - 1] + column
+
+    def feed(self, data):
+        self._line_offsets = [0]
+        for line in data.splitlines(keepends=True):
+            self._line_offsets.append(self._line_offsets[-1] + len(line))
+        super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self._depth += 1
+            if self._depth == 1:
+                self._rows, self._heads = [], []
+                self._start = self._offset()
+        elif self._depth != 1:
+            return
+        elif tag == 'thead':
+            self._in_head = True
+        elif tag == 'tr':
+            self._row = []
+            self._row_head = True
+        elif tag in ('td', 'th'):
+            attrs = dict(attrs)
+            self._cell = []
+            self._span = (_int_attr(attrs, 'rowspan'), _int_attr(attrs, 'colspan'))
+            self._row_head = self._row_head and (tag == 'th' or self._in_head)
+        elif tag == 'br' and self._cell is not None:
+            self._cell.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'table':
+            if self._depth == 1:
+                self.tables.append(expand_spans(self._rows))
+                self.sources.append((self._rows, self._heads))
+                self.spans.append((self._start, self._offset() + len('</table>')))
+                self._rows = None
+            self._depth = max(0, self._depth - 1)
+        elif self._depth != 1:
+            return
+        elif tag == 'thead':
+            self._in_head = False
+        elif tag in ('td', 'th') and self._cell is not None:
+            if self._row is None:
+                self._row = []
+                self._row_head = self._in_head
+            self._row.append((' '.join(''.join(self._cell).split()), self._span))
+            self._cell = None
+        elif tag == 'tr' and self._row is not None:
+            self._rows.append(self._row)
+            self._heads.append(self._row_head and bool(self._row))
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def close(self):
+        super().close()
+        # Output cut off inside a table (e.g. at max_new_tokens): keep the rows that did arrive
+        if self._rows is not None:
+            if self._cell is not None:
+                self.handle_endtag('td')
+            if self._row is not None:
+                self.handle_endtag('tr')
+            self.tables.append(expand_spans(self._rows))
+            self.sources.append((self._rows, self._heads))
+            self.spans.append((self._start, self._line_offsets[-1]))
+            self._rows = None
+
+
+def _int_attr(attrs, name):
+    try:
+        return max(1, int(attrs.get(name) or 1))
+    except ValueError:
+        return 1
+
+
+def expand_spans(rows, fill=False):
+    """
+    Lay out (text, (rowspan, colspan)) cells on a rectangular grid; spanned slots are empty,
+    or repeat the cell's text with `fill`
+    """
+    grid = {}
+    for r, row in enumerate(rows):
+        c = 0
+        for text, (rowspan, colspan) in row:
+            while (r, c) in grid:
+                c += 1
+            for dr in range(rowspan):
+                for dc in range(colspan):
+                    grid[(r + dr, c + dc)] = text if fill or dr == dc == 0 else ""
+            c += colspan
+    if not grid:
+        return []
+    n_rows = max(r for r, _ in grid) + 1
+    n_cols = max(c for _, c in grid) + 1
+    return [[grid.get((r, c), "") for c in range(n_cols)] for r in range(n_rows)]
+
+
+def parse_html_tables(html):
+    """Parse every top-level <table> in the HTML into a list of rows of cell strings"""
+    parser = TableParser()
+    parser.feed(html)
+    parser.close()
+    return parser.tables
+
+
+def structure_output(output, prompt, validator=None):
+    """
+    Build the `structured` block returned by /predict.
+    `validator` is the streaming validator used during generation, if any.
+    """
+    if is_json_prompt(prompt):
+        if validator is None:
+            validator = IncrementalJSONValidator(schema_from_prompt(prompt))
+            validator.feed(output)
+        validator.finish()
+        json_str, parsed = extract_json(output)
+        return {
+            "type": "json",
+            "valid": validator.ok and parsed is not None,
+            "error": validator.error,
+            "data": parsed,
+            "json": json_str,
+        }
+
+    if is_table_prompt(prompt):
+        from tables import table_block  # tables.py builds on the parser above
+
+        return {"type": "table", **table_block(output)}
+
+    return None
@@ -0,0 +1,236 @@
+"""
+Stub model backend for the GLM-OCR server (GLM_OCR_BACKEND=stub)
+Stands in for the processor and model so server.py runs its normal /predict path without
+downloading zai-org/GLM-OCR or a GPU: prefill time scales with image pixels, decode time with
+generated tokens, and the output is deterministic for a given image and prompt.
+Used for load tests, client/caching work and CI on plain CPU machines.
+"""
+
+import hashlib
+import json
+import os
+import random
+import time
+
+import torch
+from transformers import BatchEncoding
+
+from batching import KV_BLOCK_SIZE, kv_pool_bytes
+from structured_output import is_json_prompt, is_table_prompt, schema_from_prompt
+
+# Latency model (override with env vars); defaults are in the range of a single-GPU deployment
+PREFILL_BASE_MS = float(os.getenv("GLM_OCR_STUB_PREFILL_BASE_MS", 40))
+PREFILL_MS_PER_MPIXEL = float(os.getenv("GLM_OCR_STUB_PREFILL_MS_PER_MPIXEL", 120))
+DECODE_MS_PER_TOKEN = float(os.getenv("GLM_OCR_STUB_DECODE_MS_PER_TOKEN", 8))
+# Output length: tokens per megapixel of input, scaled by a per-image factor in [0.5, 1.5)
+TOKENS_PER_MPIXEL = float(os.getenv("GLM_OCR_STUB_TOKENS_PER_MPIXEL", 600))
+# Log-normal jitter on every request's latency, plus rare slow outliers (e.g. to exercise hedging)
+JITTER = float(os.getenv("GLM_OCR_STUB_JITTER", 0.15))
+SLOW_RATE = float(os.getenv("GLM_OCR_STUB_SLOW_RATE", 0.0))
+SLOW_FACTOR = float(os.getenv("GLM_OCR_STUB_SLOW_FACTOR", 5.0))
+# Fraction of requests that fail with a simulated model error (HTTP 500)
+FAILURE_RATE = float(os.getenv("GLM_OCR_STUB_FAILURE_RATE", 0.0))
+# prompt_lookup / assisted decoding cut decode time by this factor (outputs are unchanged)
+SPECULATIVE_SPEEDUP = float(os.getenv("GLM_OCR_STUB_SPECULATIVE_SPEEDUP", 2.5))
+# Continuous batching: each extra sequence in a decode step adds this fraction of a step, and
+# recomputing preempted tokens costs this much per thousand
+BATCH_STEP_COST = float(os.getenv("GLM_OCR_STUB_BATCH_STEP_COST", 0.03))
+PREFILL_MS_PER_KTOKEN = float(os.getenv("GLM_OCR_STUB_PREFILL_MS_PER_KTOKEN", 20))
+SEED = os.getenv("GLM_OCR_STUB_SEED")
+
+# Vision tokens per image are roughly pixels / PATCH_PIXELS, capped like the real processor
+PATCH_PIXELS = 28 * 28
+MAX_VISION_TOKENS = 4096
+# KV cache per token of GLM-OCR's text model: 16 layers x (K + V) x 8 heads x 64 dims in bf16
+KV_BYTES_PER_TOKEN = 16 * 2 * 8 * 64 * 2
+
+WORDS = (
+    "invoice total amount date customer order number item quantity price tax subtotal "
+    "address name account payment due report summary table section page document report "
+    "figure result value method analysis data model sample record status period region"
+).split()
+
+
+class StubModelError(RuntimeError):
+    """Simulated model failure (GLM_OCR_STUB_FAILURE_RATE)"""
+
+
+class StubTokenizer:
+    """Byte-level tokenizer: one token per ASCII character"""
+
+    # End of sequence for continuous batching; decode() drops it like a special token
+    EOS = 128
+
+    def encode(self, text):
+        return list(text.encode("ascii", "replace"))
+
+    def decode(self, ids, skip_special_tokens=True):
+        return bytes(int(i) for i in ids if 0 < int(i) < 128).decode("ascii")
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(max(1, n)))
+
+
+def _fill(template, rng):
+    """Fill a JSON schema template (from schema_from_prompt) with deterministic values"""
+    if isinstance(template, dict):
+        return {key: _fill(value, rng) for key, value in template.items()}
+    if isinstance(template, list):
+        return [_fill(template[0], rng) for _ in range(rng.randint(1, 3))] if template else []
+    if isinstance(template, bool):
+        return rng.random() < 0.5
+    if isinstance(template, (int, float)):
+        return rng.randint(1, 999)
+    return _words(rng, rng.randint(1, 3))
+
+
+def stub_output(digest, prompt, tokens):
+    """Deterministic output of roughly `tokens` characters, shaped like the task's real output"""
+    rng = random.Random(digest)
+    if is_json_prompt(prompt):
+        template = schema_from_prompt(prompt)
+        data = _fill(template, rng) if template is not None else {"text": _words(rng, tokens // 8)}
+        return json.dumps(data, indent=2)
+    if is_table_prompt(prompt):
+        columns = rng.randint(2, 5)
+        rows = max(2, tokens // (columns * 24))
+        cells = "".join(
+            "<tr>" + "".join(f"<td>{_words(rng, 2)}</td>" for _ in range(columns)) + "</tr>"
+            for _ in range(rows)
+        )
+        return f"<table>{cells}</table>"
+    if "latex" in prompt.lower() or "formula" in prompt.lower():
+        lines = [f"$$ {rng.choice('xyzabc')}_{{{i}}} = \\frac{{{rng.randint(1, 99)}}}{{{rng.randint(2, 9)}}}"
+                 f" + {rng.choice('xyzabc')}^{{{rng.randint(2, 4)}}} $$" for i in range(max(1, tokens // 40))]
+        return "\n".join(lines)
+    lines = [_words(rng, rng.randint(4, 12)) for _ in range(max(1, tokens // 50))]
+    return "\n".join(lines)[:max(tokens, 1)]
+
+
+class StubProcessor:
+    """apply_chat_template stand-in: input ids are placeholder vision tokens plus the prompt bytes"""
+
+    image_token_id = 0
+
+    def __init__(self):
+        self.tokenizer = StubTokenizer()
+
+    def apply_chat_template(self, messages, **kwargs):
+        content = messages[0]["content"]
+        image = next(part["image"] for part in content if part["type"] == "image")
+        prompt = next(part["text"] for part in content if part["type"] == "text")
+
+        digest = hashlib.sha256(image.tobytes() + prompt.encode("utf-8")).hexdigest()
+        vision_tokens = min(MAX_VISION_TOKENS, image.width * image.height // PATCH_PIXELS)
+        input_ids = [0] * vision_tokens + self.tokenizer.encode(prompt)
+
+        # run_ocr passes the encoding to generate() as keyword arguments, request details included
+        return BatchEncoding({
+            "input_ids": torch.tensor([input_ids]),
+            "attention_mask": torch.ones(1, len(input_ids), dtype=torch.long),
+            "stub_request": (digest, prompt, image.width * image.height),
+        })
+
+    def decode(self, ids, skip_special_tokens=True):
+        return self.tokenizer.decode(ids, skip_special_tokens)
+
+
+class StubModel:
+    """
+    generate() stand-in: sleeps for the simulated prefill, then emits the deterministic output
+    one token per simulated decode step, calling the stopping criteria after every step
+    (so JSON validation and cancellation behave as with the real model).
+    """
+
+    def __init__(self):
+        self.device = torch.device("cpu")
+        self.dtype = "stub"
+        self._rng = random.Random(SEED)
+
+    def plan(self, stub_request, max_new_tokens=8192):
+        """(latency scale, prefill seconds, output token ids) of one simulated request"""
+        digest, prompt, pixels = stub_request
+        mpixels = pixels / 1e6
+
+        scale = self._rng.lognormvariate(0, JITTER) if JITTER else 1.0
+        if self._rng.random() < SLOW_RATE:
+            scale *= SLOW_FACTOR
+        prefill = (PREFILL_BASE_MS + PREFILL_MS_PER_MPIXEL * mpixels) * scale / 1000
+
+        length = int(TOKENS_PER_MPIXEL * mpixels * (0.5 + int(digest[:8], 16) / 0x100000000))
+        tokens = StubTokenizer().encode(stub_output(digest, prompt, max(16, length)))[:max_new_tokens]
+        return scale, prefill, tokens
+
+    def generate(self, input_ids, stub_request, max_new_tokens=8192, stopping_criteria=None, **kwargs):
+        scale, prefill, tokens = self.plan(stub_request, max_new_tokens)
+        time.sleep(prefill)
+        if self._rng.random() < FAILURE_RATE:
+            raise StubModelError("Simulated model failure")
+
+        step = DECODE_MS_PER_TOKEN * scale / 1000
+        if "prompt_lookup_num_tokens" in kwargs or "assistant_model" in kwargs:
+            step /= SPECULATIVE_SPEEDUP
+
+        full = torch.cat([input_ids, torch.tensor([tokens], dtype=input_ids.dtype)], dim=1)
+        prompt_length = input_ids.shape[1]
+        sequence = input_ids
+        start = time.perf_counter()
+        for n in range(1, len(tokens) + 1):
+            sequence = full[:, :prompt_length + n]
+            # Sleep to the step's deadline rather than per token, so timer overhead doesn't add up
+            delay = start + n * step - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if stopping_criteria and bool(stopping_criteria(sequence, None).all()):
+                break
+        return sequence
+
+
+class StubStepper:
+    """
+    Continuous-batching counterpart of StubModel.generate (see batching.ContinuousBatcher).
+    Prefill sleeps like a solo request; a decode step costs one token's time plus
+    BATCH_STEP_COST of it per extra sequence, since batched decode reads the weights once.
+    KV blocks are accounted as for GLM-OCR's text model, without allocating them.
+    """
+
+    greedy = True
+    eos_token_ids = {StubTokenizer.EOS}
+
+    def __init__(self, model, block_size=KV_BLOCK_SIZE):
+        self.model = model
+        self.block_size = block_size
+        self.num_blocks = max(1, kv_pool_bytes(model.device) // (KV_BYTES_PER_TOKEN * block_size))
+
+    def prefill(self, seq):
+        if seq.state is None:
+            seq.state = self.model.plan(seq.inputs["stub_request"], seq.max_new_tokens)
+        _, prefill, tokens = seq.state
+        # A preempted sequence recomputes its generated tokens as part of the prompt
+        time.sleep(prefill + PREFILL_MS_PER_KTOKEN * len(seq.generated) / 1e6)
+        if not seq.generated and self.model._rng.random() < FAILURE_RATE:
+            raise StubModelError("Simulated model failure")
+        seq.cached = seq.length
+        return self._next(seq)
+
+    def decode(self, seqs):
+        time.sleep(DECODE_MS_PER_TOKEN * (1 + BATCH_STEP_COST * (len(seqs) - 1)) / 1000)
+        tokens = []
+        for seq in seqs:
+            seq.cached += 1
+            tokens.append(self._next(seq))
+        return tokens
+
+    @staticmethod
+    def _next(seq):
+        tokens = seq.state[2]
+        return tokens[len(seq.generated)] if len(seq.generated) < len(tokens) else StubTokenizer.EOS
+
+
+def load_stub_replica(replica, draft=False):
+    """Give a replica the stub processor and model (and a stub draft model for assisted decoding)"""
+    replica.processor = StubProcessor()
+    replica.model = StubModel()
+    if draft:
+        replica.draft_model = StubModel()
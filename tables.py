@@ -0,0 +1,240 @@
+"""
+Table pipeline for GLM-OCR output
+The server parses the model's table HTML once into compact cell grids (header plus rows,
+normalized text) and notes whether a page starts or ends with a table. From those blocks,
+TableStitcher joins tables that run across page boundaries, so a 40-page statement becomes
+one table, and TableExporter writes each stitched table to CSV or Arrow as its pages arrive.
+"""
+
+import csv
+import html
+import io
+import re
+import unicodedata
+
+from result_writers import ARROW_SUPPORT
+from structured_output import TableParser, expand_spans
+
+# Non-table characters allowed between a table and the page edge (running headers, page
+# numbers, "continued") for the table to count as running off / onto the page
+MAX_EDGE_TEXT = 200
+
+_NUMBER_RE = re.compile(r'^[(\-+]?[$€£¥]?\s?\d[\d,.\s]*%?\)?$')
+_DASHES = dict.fromkeys(map(ord, "−‒–—﹣－"), "-")
+
+
+def normalize_cell(text):
+    """Unicode-normalized cell text: one space between words, ASCII minus in numbers"""
+    text = " ".join(unicodedata.normalize("NFKC", text).split())
+    return text.translate(_DASHES) if _NUMBER_RE.match(text.translate(_DASHES)) else text
+
+
+def is_numeric(text):
+    return bool(text) and bool(_NUMBER_RE.match(text))
+
+
+def _header_rows(rows, flags):
+    """Leading rows marked as header in the HTML; else the first row if it's all labels over numbers"""
+    count = 0
+    while count < len(flags) and flags[count]:
+        count += 1
+    if count or len(rows) < 2:
+        return count
+    first_is_labels = any(rows[0]) and not any(is_numeric(cell) for cell in rows[0])
+    numbers_below = any(is_numeric(cell) for row in rows[1:] for cell in row)
+    return 1 if first_is_labels and numbers_below else 0
+
+
+def compact_table(rows, flags):
+    """
+    {"header": column names, "rows": body rows} from one parsed table. Multi-row headers are
+    flattened to "Parent / Child" names; rows with no text are dropped.
+    """
+    body = [[normalize_cell(cell) for cell in row] for row in expand_spans(rows)]
+    filled = [[normalize_cell(cell) for cell in row] for row in expand_spans(rows, fill=True)]
+    count = _header_rows(body, flags)
+    header = []
+    if count:
+        for column in zip(*filled[:count]):
+            parts = []
+            for part in column:
+                if part and part not in parts:
+                    parts.append(part)
+            header.append(" / ".join(parts))
+    return {
+        "header": header,
+        "rows": [row for row in body[count:] if any(row)],
+        "columns": len(body[0]) if body else 0,
+    }
+
+
+def table_block(output):
+    """
+    Compact tables of one page's output, plus whether the page opens / closes with a table:
+    only short text, such as a running header, between it and the page edge
+    """
+    parser = TableParser()
+    parser.feed(output)
+    parser.close()
+    tables = [compact_table(rows, flags) for rows, flags in parser.sources]
+    spans = parser.spans
+    return {
+        "tables": tables,
+        "opens_page": bool(spans) and len(output[:spans[0][0]].strip()) <= MAX_EDGE_TEXT,
+        "closes_page": bool(spans) and len(output[spans[-1][1]:].strip()) <= MAX_EDGE_TEXT,
+    }
+
+
+def continues(previous, table):
+    """Whether `table` (first on its page) carries on `previous` (last on the page before)"""
+    if table["columns"] != previous["columns"]:
+        return False
+    # A repeated header is the usual sign; a headerless table with the same width is the other
+    return not table["header"] or table["header"] == previous["header"]
+
+
+def column_names(table):
+    """Unique, non-empty column names (col_N where the header has none)"""
+    names = []
+    for index in range(table["columns"]):
+        name = table["header"][index] if index < len(table["header"]) and table["header"][index] else f"col_{index + 1}"
+        while name in names:
+            name += "_"
+        names.append(name)
+    return names
+
+
+class TableStitcher:
+    """
+    Feed page blocks in page order; add() returns the chunks to emit for that page as
+    (table number, table, rows, new) where `new` means the chunk starts a table
+    """
+
+    def __init__(self):
+        self.tables = []     # stitched tables: header, rows, columns, pages
+        self.open_table = None  # last table of the previous page, if that page ended with it
+
+    def add(self, page, block):
+        chunks = []
+        tables = block["tables"] if block else []
+        for index, table in enumerate(tables):
+            if index == 0 and self.open_table is not None and block["opens_page"] and continues(self.open_table, table):
+                self.open_table["rows"].extend(table["rows"])
+                self.open_table["pages"].append(page)
+                chunks.append((len(self.tables), self.open_table, table["rows"], False))
+                continue
+            stitched = dict(table, rows=list(table["rows"]), pages=[page])
+            self.tables.append(stitched)
+            chunks.append((len(self.tables), stitched, table["rows"], True))
+        self.open_table = self.tables[-1] if tables and block["closes_page"] else None
+        return chunks
+
+
+def stitch_tables(blocks):
+    """Stitched tables of consecutive pages' blocks (None for a page without tables)"""
+    stitcher = TableStitcher()
+    for page, block in enumerate(blocks, 1):
+        stitcher.add(page, block)
+    return stitcher.tables
+
+
+def page_block(result):
+    """Table block of a page result: the server's, else parsed from the output here"""
+    structured = result.get('structured')
+    if structured and structured.get('type') == 'table' and 'opens_page' in structured:
+        return {key: structured[key] for key in ("tables", "opens_page", "closes_page")}
+    if result.get('success') and '<table' in (result.get('output') or ''):
+        return table_block(result['output'])
+    return None
+
+
+def to_html(table):
+    """Minimal escaped HTML for a compact table (safe to render, unlike the raw model output)"""
+    head = "".join(f"<th>{html.escape(name)}</th>" for name in table["header"])
+    body = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>" for row in table["rows"]
+    )
+    return f"<table>{f'<thead><tr>{head}</tr></thead>' if head else ''}<tbody>{body}</tbody></table>"
+
+
+def to_csv(table):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if table["header"]:
+        writer.writerow(table["header"])
+    writer.writerows(table["rows"])
+    return buf.getvalue()
+
+
+class TableExporter:
+    """
+    Writes stitched tables of a document as pages complete: <base>_table_001.csv (or .arrow,
+    an Arrow IPC stream with one record batch per page), each appended to while it continues
+    """
+
+    FORMATS = ('csv', 'arrow')
+
+    def __init__(self, base_path, fmt='csv'):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown table format {fmt!r}, expected one of {', '.join(self.FORMATS)}")
+        if fmt == 'arrow' and not ARROW_SUPPORT:
+            raise RuntimeError("Arrow table output requires pyarrow: pip install pyarrow")
+        self.base_path = base_path
+        self.fmt = fmt
+        self.stitcher = TableStitcher()
+        self.paths = []
+        self._files = {}
+
+    def write(self, result):
+        for number, table, rows, new in self.stitcher.add(result['page'], page_block(result)):
+            if new:
+                self._open(number, table)
+            self._append(number, table, rows)
+        # Only the table still open at the bottom of the page can grow; finish the others
+        open_number = len(self.stitcher.tables) if self.stitcher.open_table is not None else None
+        for number in [n for n in self._files if n != open_number]:
+            self._close(number)
+
+    def _open(self, number, table):
+        path = f"{self.base_path}_table_{number:03d}.{self.fmt}"
+        self.paths.append(path)
+        if self.fmt == 'csv':
+            f = open(path, 'w', newline='', encoding='utf-8')
+            writer = csv.writer(f)
+            if table["header"]:
+                writer.writerow(table["header"])
+            self._files[number] = (f, writer, None)
+        else:
+            import pyarrow as pa
+            import pyarrow.ipc
+
+            schema = pa.schema([(name, pa.string()) for name in column_names(table)])
+            sink = pa.OSFile(path, 'wb')
+            self._files[number] = (sink, pa.ipc.new_stream(sink, schema), schema)
+
+    def _append(self, number, table, rows):
+        f, writer, schema = self._files[number]
+        if self.fmt == 'csv':
+            writer.writerows(rows)
+            f.flush()
+        elif rows:
+            import pyarrow as pa
+
+            columns = [pa.array(list(column), pa.string()) for column in zip(*rows)]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+
+    def _close(self, number):
+        f, writer, _ = self._files.pop(number)
+        if self.fmt == 'arrow':
+            writer.close()
+        f.close()
+
+    def close(self):
+        for number in list(self._files):
+            self._close(number)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+# Tests import the top-level modules (server.py, replicas.py, ...) from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing server.py opens the usage store; keep test runs out of ./usage.db
+os.environ.setdefault("GLM_OCR_USAGE_DB", ":memory:")
+
+
+@pytest.fixture
+def stub_stream_port(monkeypatch):
+    """Port of the server's binary stream API on loopback, answering from one stub replica"""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    import server
+    from replicas import Replica, ReplicaPool
+    from stub_backend import load_stub_replica
+
+    replica = Replica(0, "cpu")
+    load_stub_replica(replica)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def start():
+        monkeypatch.setattr(server, "POOL", ReplicaPool([replica]))
+        return await asyncio.start_server(server.handle_stream, "127.0.0.1", 0)
+
+    stream_server = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    yield stream_server.sockets[0].getsockname()[1]
+    stream_server.close()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    replica.executor.shutdown()
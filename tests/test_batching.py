@@ -0,0 +1,77 @@
+"""
+Continuous batching against generate() on a tiny random GLM-OCR model: no download
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+if not hasattr(transformers, "GlmOcrForConditionalGeneration"):
+    pytest.skip("transformers has no GLM-OCR model", allow_module_level=True)
+
+import batching  # noqa: E402
+from batching import ContinuousBatcher, ModelStepper  # noqa: E402
+from replicas import Replica  # noqa: E402
+
+IMAGE_TOKEN, IMAGE_START, IMAGE_END = 299, 297, 296
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.GlmOcrConfig(
+        text_config=dict(vocab_size=300, hidden_size=128, intermediate_size=128, num_hidden_layers=2,
+                         num_attention_heads=2, num_key_value_heads=1, max_position_embeddings=4096),
+        vision_config=dict(hidden_size=32, intermediate_size=64, depth=1, num_heads=2, out_hidden_size=128,
+                           patch_size=14, spatial_merge_size=2, temporal_patch_size=2),
+        image_token_id=IMAGE_TOKEN, video_token_id=298, image_start_token_id=IMAGE_START,
+        image_end_token_id=IMAGE_END,
+    )
+    model = transformers.GlmOcrForConditionalGeneration(config).eval()
+    model.generation_config.eos_token_id = 5
+    model.generation_config.do_sample = False
+    return model
+
+
+def make_inputs(model, height, width, prompt):
+    """Processor-shaped inputs for a random image of height x width patches followed by `prompt` ids"""
+    vision = model.config.vision_config
+    image_tokens = height * width // vision.spatial_merge_size ** 2
+    ids = [10, IMAGE_START] + [IMAGE_TOKEN] * image_tokens + [IMAGE_END] + prompt
+    types = [0, 0] + [1] * image_tokens + [0] + [0] * len(prompt)
+    patch = vision.in_channels * vision.temporal_patch_size * vision.patch_size ** 2
+    return {
+        "input_ids": torch.tensor([ids]),
+        "attention_mask": torch.ones(1, len(ids), dtype=torch.long),
+        "pixel_values": torch.randn(height * width, patch),
+        "image_grid_thw": torch.tensor([[1, height, width]]),
+        "mm_token_type_ids": torch.tensor([types]),
+    }
+
+
+def test_batched_decode_matches_generate(model, monkeypatch):
+    # A pool this small (25 blocks of 4 tokens) can't hold every sequence at once, so some are preempted
+    monkeypatch.setattr(batching, "KV_CACHE_MB", 0.1)
+    requests = [
+        (make_inputs(model, 4, 4, [20, 21]), 40),
+        (make_inputs(model, 6, 4, [30]), 7),
+        (make_inputs(model, 8, 8, [40, 41, 42]), 60),
+        (make_inputs(model, 2, 2, [7]), 25),
+    ]
+    with torch.inference_mode():
+        expected = [model.generate(**inputs, max_new_tokens=n, do_sample=False) for inputs, n in requests]
+
+    replica = Replica(0, "cpu")
+    replica.model = model
+    batcher = ContinuousBatcher(replica, ModelStepper(model, block_size=4), max_batch=8)
+    with ThreadPoolExecutor(len(requests)) as pool:
+        outputs = list(pool.map(lambda request: batcher.generate(*request, None, {}), requests))
+
+    for reference, output in zip(expected, outputs):
+        assert torch.equal(reference, output[0])
+    status = batcher.status()
+    assert status["preemptions"] > 0 and status["mean_batch_size"] > 1
+    assert status["running"] == status["waiting"] == 0
+    assert status["kv_blocks_free"] == status["kv_blocks_total"]
@@ -0,0 +1,49 @@
+"""
+Decoding-mode parity on the tiny random CPU models from benchmark_decoding: always runs,
+no download. prompt_lookup and assisted must produce exactly greedy's token ids.
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from benchmark_decoding import tiny_cpu_models  # noqa: E402
+from decoding import generation_kwargs  # noqa: E402
+
+MAX_NEW_TOKENS = 48
+
+
+@pytest.fixture(scope="module")
+def models():
+    return tiny_cpu_models()
+
+
+def generate(model, input_ids, **kwargs):
+    with torch.no_grad():
+        output = model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=MAX_NEW_TOKENS,
+            min_new_tokens=MAX_NEW_TOKENS,
+            do_sample=False,
+            pad_token_id=0,
+            **kwargs
+        )
+    return output[0][input_ids.shape[1]:].tolist()
+
+
+@pytest.mark.parametrize("mode", ["prompt_lookup", "assisted"])
+def test_mode_matches_greedy(models, mode):
+    model, draft, prompts = models
+    for input_ids in prompts:
+        greedy = generate(model, input_ids)
+        assert len(greedy) == MAX_NEW_TOKENS
+        assert generate(model, input_ids, **generation_kwargs(mode, draft)) == greedy
+
+
+def test_unusable_modes_are_rejected():
+    with pytest.raises(ValueError):
+        generation_kwargs("beam")
+    with pytest.raises(ValueError):
+        generation_kwargs("assisted", None)
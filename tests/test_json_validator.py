@@ -0,0 +1,96 @@
+"""
+Incremental JSON validation of partial model output (structured_output.IncrementalJSONValidator)
+"""
+
+import json
+
+import pytest
+
+from structured_output import IncrementalJSONValidator
+
+SCHEMA = {"invoice_number": "", "items": [{"name": "", "price": 0}], "total": 0}
+
+VALID = json.dumps({
+    "invoice_number": "INV-001",
+    "items": [{"name": "Pens \"blue\"", "price": 4.5}, {"name": "Ink", "price": -1e2}],
+    "total": None,
+}, indent=2)
+
+
+def feed(text, schema=SCHEMA, chunk=3):
+    """Validator after feeding `text` a few characters at a time, as tokens arrive"""
+    validator = IncrementalJSONValidator(schema)
+    for start in range(0, len(text), chunk):
+        if not validator.feed(text[start:start + chunk]):
+            break
+    return validator
+
+
+def test_valid_output_completes_in_any_chunking():
+    for chunk in (1, 3, 64):
+        validator = feed(VALID, chunk=chunk)
+        assert validator.ok and validator.complete and validator.finish()
+
+
+def test_prose_before_the_value_is_skipped_and_trailing_text_ignored():
+    validator = feed("Here is the data:\n```json\n" + VALID + "\n```")
+    assert validator.complete and validator.finish()
+    assert validator.consumed == len("Here is the data:\n```json\n" + VALID)
+
+
+def test_no_value_within_the_prefix_limit():
+    validator = IncrementalJSONValidator(SCHEMA, max_prefix=16)
+    assert not validator.feed("I could not read this document, sorry.")
+    assert validator.error == "no JSON value found (at char 16)"
+
+
+@pytest.mark.parametrize("text, error", [
+    ('{"invoice_number": "1", "vendor": ', "unexpected key 'vendor'"),
+    ('{"items": "none"', "expected a container, got a string"),
+    ('{"items": [3]', "expected a container, got a scalar"),
+    ('{"total": {"net": 1}', "unexpected object"),
+    ('{"total": tru}', "invalid literal 'tru'"),
+    ('{"total" 1', "expected ':'"),
+    ('{"total": 1 "items"', "expected ',' or '}'"),
+    ('{"items": [{"name": "a"} {', "expected ',' or ']'"),
+])
+def test_off_schema_output_fails_as_soon_as_it_appears(text, error):
+    validator = feed(text, chunk=1)
+    assert not validator.ok and validator.error.startswith(error)
+    # Reported at the offending character, so generation can stop right there
+    assert validator.error.endswith(f"(at char {validator.consumed - 1})")
+
+
+def test_truncated_output_fails_on_finish():
+    validator = feed(VALID[:-10])
+    assert validator.ok and not validator.complete
+    assert not validator.finish() and validator.error.startswith("truncated JSON")
+
+
+def test_without_a_schema_any_json_is_accepted():
+    validator = feed('[{"anything": [1, 2.5e-3, "x"], "nested": {"deep": null}}, true]', schema=None)
+    assert validator.complete and validator.finish()
+
+
+@pytest.mark.parametrize("text", [
+    r'{"invoice_number": "a\"b\\c\/d\b\f\n\r\t"}',
+    r'{"invoice_number": "\u00e9\u20AC\ud83d\ude00"}',
+])
+def test_valid_escapes(text):
+    validator = feed(text, chunk=1)
+    assert validator.complete and validator.finish()
+    assert json.loads(text)
+
+
+@pytest.mark.parametrize("text, error", [
+    (r'{"invoice_number": "\q"}', r"invalid escape \q"),
+    (r'{"invoice_number": "\x41"}', r"invalid escape \x"),
+    (r'{"invoice_number": "\u12"}', "invalid \\u escape digit '\"'"),
+    (r'{"invoice_number": "\u12g4"}', "invalid \\u escape digit 'g'"),
+    (r'{"inv\oice_number": 1}', r"invalid escape \o"),
+])
+def test_invalid_escapes_fail(text, error):
+    validator = feed(text, chunk=1)
+    assert validator.error.startswith(error)
+    with pytest.raises(ValueError):
+        json.loads(text)
@@ -0,0 +1,83 @@
+"""
+End-to-end run_ocr on the real model, on CPU
+Skipped unless the model is already in the local Hugging Face cache (or GLM_OCR_TEST_MODEL
+points at a local copy): the test never downloads it.
+"""
+
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+import server  # noqa: E402
+from replicas import Replica  # noqa: E402
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+MODEL = os.getenv("GLM_OCR_TEST_MODEL", server.MODEL_PATH)
+# Enough tokens to check the pipeline, few enough for a CPU
+MAX_NEW_TOKENS = 24
+
+
+@pytest.fixture(scope="module")
+def replica():
+    try:
+        processor = transformers.AutoProcessor.from_pretrained(MODEL, local_files_only=True)
+        model = transformers.AutoModelForImageTextToText.from_pretrained(
+            MODEL, torch_dtype=torch.float32, local_files_only=True
+        )
+    except (OSError, ValueError) as e:
+        pytest.skip(f"{MODEL} not available locally: {e}")
+    replica = Replica(0, "cpu")
+    replica.processor = processor
+    replica.model = model.eval()
+    yield replica
+    replica.executor.shutdown()
+
+
+@pytest.fixture
+def page():
+    from PIL import Image
+
+    with Image.open(os.path.join(SAMPLES, "1_text_recognition.png")) as image:
+        image = image.convert("RGB")
+    image.thumbnail((448, 448))
+    return image
+
+
+@pytest.fixture(autouse=True)
+def short_outputs(monkeypatch):
+    monkeypatch.setattr(server, "MAX_NEW_TOKENS", MAX_NEW_TOKENS)
+
+
+def test_run_ocr_greedy(replica, page):
+    result = server.run_ocr(replica, page, "Text Recognition:", structured=False)
+
+    assert result["output"].strip()
+    assert 0 < result["generation"]["new_tokens"] <= MAX_NEW_TOKENS
+    usage = result["usage"]
+    assert usage["output_tokens"] == result["generation"]["new_tokens"]
+    assert usage["vision_tokens"] > 0
+    assert usage["input_tokens"] > usage["vision_tokens"]
+    assert usage["gpu_seconds"] > 0
+
+
+def test_prompt_lookup_matches_greedy(replica, page):
+    greedy = server.run_ocr(replica, page, "Text Recognition:", structured=False)
+    lookup = server.run_ocr(replica, page, "Text Recognition:", structured=False, decoding="prompt_lookup")
+
+    assert lookup["output"] == greedy["output"]
+    assert lookup["generation"]["mode"] == "prompt_lookup"
+
+
+def test_run_ocr_table_block(replica):
+    from PIL import Image
+
+    with Image.open(os.path.join(SAMPLES, "2_table_recognition.png")) as image:
+        image = image.convert("RGB")
+    image.thumbnail((448, 448))
+    result = server.run_ocr(replica, image, "Table Recognition:")
+
+    assert result["structured"]["type"] == "table"
+    assert set(result["structured"]) == {"type", "tables", "opens_page", "closes_page"}
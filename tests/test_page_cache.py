@@ -0,0 +1,70 @@
+"""
+PageCache reuse on a resubmitted document, with a recording client in place of the server
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("fitz")
+
+from page_cache import PageCache  # noqa: E402
+from pdf_processor import iter_document_results  # noqa: E402
+
+SAMPLE_PDF = os.path.join(os.path.dirname(__file__), "..", "samples", "sample_document.pdf")
+
+
+class RecordingClient:
+    """Answers every page with its size and counts the pages it was sent"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict_image(self, image, prompt):
+        self.calls += 1
+        return {'success': True, 'output': f"{prompt} {image.width}x{image.height}"}
+
+
+def run(cache, client):
+    return list(iter_document_results(SAMPLE_PDF, "Text Recognition:", workers=2, dpi=72, client=client,
+                                      cache=cache))
+
+
+def test_unchanged_pages_are_reused():
+    cache = PageCache(":memory:")
+    first = run(cache, RecordingClient())
+    client = RecordingClient()
+    second = run(cache, client)
+
+    assert client.calls == 0
+    assert all(r['reused'] for r in second)
+    assert [r['output'] for r in second] == [r['output'] for r in first]
+
+
+def test_page_evicted_between_lookup_and_reuse():
+    cache = PageCache(":memory:")
+    first = run(cache, RecordingClient())
+
+    lookup = cache.lookup
+
+    def evicting_lookup(prompt_key, dpi):
+        skip = lookup(prompt_key, dpi)
+
+        def evict_after(fingerprint):
+            hit = skip(fingerprint)
+            # The page is evicted right after it was found, before iter_document_results reuses it
+            with cache._lock, cache._conn:
+                cache._conn.execute("DELETE FROM pages WHERE key = ?", (cache.key(fingerprint, prompt_key, dpi),))
+            return hit
+
+        evict_after.found = skip.found
+        return evict_after
+
+    cache.lookup = evicting_lookup
+    client = RecordingClient()
+    second = run(cache, client)
+
+    # Each page is answered from the row lookup fetched, not read again after eviction
+    assert client.calls == 0
+    assert all(r['success'] and r['reused'] for r in second)
+    assert [r['output'] for r in second] == [r['output'] for r in first]
@@ -0,0 +1,132 @@
+"""
+ReplicaPool dispatch with stub replicas (stub_backend.py): no model, no GPU
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import server  # noqa: E402
+from batching import ContinuousBatcher  # noqa: E402
+from cancellation import CancellationToken  # noqa: E402
+from replicas import Replica, ReplicaPool, plan_replicas  # noqa: E402
+from stub_backend import StubStepper, load_stub_replica  # noqa: E402
+
+
+def stub_replicas(n, batching=False):
+    replicas = []
+    for index in range(n):
+        replica = Replica(index, "cpu")
+        load_stub_replica(replica)
+        if batching:
+            replica.batcher = ContinuousBatcher(replica, StubStepper(replica.model))
+        replicas.append(replica)
+    return replicas
+
+
+@pytest.fixture
+def page():
+    from PIL import Image
+
+    return Image.new("RGB", (240, 160), "white")
+
+
+class Tracker:
+    """Wraps predict_on_replica, recording which replica ran each call and peak concurrency"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = set(fail_on or ())
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, replica, *args):
+        with self._lock:
+            self.calls.append(replica.index)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            fail = len(self.calls) in self.fail_on
+        try:
+            if fail:
+                time.sleep(0.05)
+                raise RuntimeError(f"replica {replica.index} crashed")
+            return server.predict_on_replica(replica, *args)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_plan_replicas_explicit_devices():
+    assert plan_replicas(None, "cpu, cpu") == [("cpu", None), ("cpu", None)]
+    assert plan_replicas(None, "cuda:0,cuda:1") == [("cuda:0", None), ("cuda:1", None)]
+
+
+def test_pool_spreads_concurrent_requests(page):
+    replicas = stub_replicas(2)
+    tracker = Tracker()
+
+    async def main():
+        pool = ReplicaPool(replicas)
+        results = await asyncio.gather(*(
+            pool.run(tracker, page, "Text Recognition:", True, "greedy", CancellationToken()) for _ in range(8)
+        ))
+        return pool, results
+
+    pool, results = asyncio.run(main())
+
+    assert all(pages and pages[0]["output"] for pages, _ in results)
+    assert tracker.peak == 2
+    # Stub latency is jittered, so the split needn't be exactly even
+    assert sum(r.completed for r in replicas) == 8 and min(r.completed for r in replicas) >= 2
+    status = pool.status()
+    assert status["queue_depth"] == 0
+    assert not any(r["busy"] for r in status["replicas"])
+
+
+def test_pool_recovers_when_a_replica_fails(page):
+    replicas = stub_replicas(2)
+    # The first call crashes on whichever replica picked it up
+    tracker = Tracker(fail_on={1})
+
+    async def main():
+        pool = ReplicaPool(replicas)
+        calls = [pool.run(tracker, page, "Text Recognition:", True, "greedy", CancellationToken()) for _ in range(6)]
+        first = await asyncio.gather(*calls, return_exceptions=True)
+        # The failed replica went back to the pool: a second wave still uses both
+        second = await asyncio.gather(*(
+            pool.run(tracker, page, "Text Recognition:", True, "greedy", CancellationToken()) for _ in range(4)
+        ))
+        return pool, first, second
+
+    pool, first, second = asyncio.run(main())
+
+    failures = [r for r in first if isinstance(r, Exception)]
+    assert len(failures) == 1 and "crashed" in str(failures[0])
+    assert all(pages[0]["output"] for pages, _ in (r for r in first if not isinstance(r, Exception)))
+    assert len(second) == 4 and all(pages[0]["output"] for pages, _ in second)
+    assert set(tracker.calls[6:]) == {0, 1}
+    assert sum(r.completed for r in replicas) == 10
+    assert not any(r["busy"] for r in pool.status()["replicas"])
+
+
+def test_batched_pool_spreads_by_load(page):
+    replicas = stub_replicas(2, batching=True)
+
+    async def main():
+        pool = ReplicaPool(replicas)
+        return await asyncio.gather(*(
+            pool.run(server.predict_on_replica, page, "Text Recognition:", True, "greedy", CancellationToken())
+            for _ in range(6)
+        ))
+
+    results = asyncio.run(main())
+
+    assert all(pages[0]["output"] for pages, _ in results)
+    assert sorted(r.completed for r in replicas) == [3, 3]
+    assert all(r.in_flight == 0 for r in replicas)
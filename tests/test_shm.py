@@ -0,0 +1,97 @@
+"""
+Shared-memory ring (shm_transport.py): placement, wrap-around, server-side views and a stub round trip
+"""
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from shm_transport import InvalidDescriptor, SharedImages, ShmRing  # noqa: E402
+from uploads import UploadTooLarge  # noqa: E402
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRing(4096)
+    yield ring
+    ring.close()
+
+
+def gray(size, value):
+    """An L image of `size` bytes (size x 1 pixels)"""
+    return Image.new("L", (size, 1), value)
+
+
+def test_ring_wraps_once_the_oldest_entries_are_released(ring):
+    assert ring.size == 4096
+    first = ring.put(gray(1500, 1))
+    second = ring.put(gray(1500, 2))
+    assert (first["offset"], second["offset"]) == (0, 1500)
+
+    # 1500 more bytes don't fit after the second entry, and the first still holds the start
+    with pytest.raises(TimeoutError):
+        ring.put(gray(1500, 3), timeout=0.05)
+
+    ring.release(first)
+    third = ring.put(gray(1500, 3))
+    assert third["offset"] == 0
+    # Wrapped: free space is now only between the third and second entries
+    with pytest.raises(TimeoutError):
+        ring.put(gray(100, 4), timeout=0.05)
+
+
+def test_ring_releases_in_any_order(ring):
+    first, second, third = (ring.put(gray(1000, value)) for value in (1, 2, 3))
+    ring.release(second)
+    # The first entry is still live, so the second's space isn't reused yet
+    assert ring.put(gray(1000, 4))["offset"] == 3000
+    ring.release(first)
+    # Both the first and the already released second are freed together
+    assert ring.put(gray(2000, 5))["offset"] == 0
+    ring.release(third)
+
+
+def test_ring_rejects_an_image_larger_than_the_ring(ring):
+    with pytest.raises(ValueError, match="doesn't fit"):
+        ring.put(gray(5000, 0))
+
+
+def test_shared_images_open_the_pixels_in_place(ring):
+    image = Image.new("RGB", (20, 10), (10, 20, 30))
+    descriptor = ring.put(image)
+    shared = SharedImages(max_pixels=10_000)
+    try:
+        opened = shared.open(descriptor)
+        assert opened.size == (20, 10) and opened.tobytes() == image.tobytes()
+        del opened
+    finally:
+        shared.close()
+
+
+@pytest.mark.parametrize("change, error", [
+    ({"name": "not_ours"}, InvalidDescriptor),
+    ({"size": 100}, InvalidDescriptor),
+    ({"mode": "CMYK"}, InvalidDescriptor),
+    ({"offset": 4000}, InvalidDescriptor),
+    ({"width": None}, InvalidDescriptor),
+    ({"width": 200, "height": 100, "size": 60_000}, UploadTooLarge),
+])
+def test_shared_images_validate_descriptors(ring, change, error):
+    descriptor = dict(ring.put(Image.new("RGB", (20, 10))), **change)
+    shared = SharedImages(max_pixels=10_000)
+    try:
+        with pytest.raises(error):
+            shared.view(descriptor)
+    finally:
+        shared.close()
+
+
+def test_shared_memory_client_round_trip(stub_stream_port):
+    from shm_transport import SharedMemoryClient
+
+    with SharedMemoryClient("127.0.0.1", stub_stream_port, ring_bytes=1 << 20, timeout=30) as client:
+        results = [client.predict_image(Image.new("RGB", (120, 80), "white"), "Text Recognition:") for _ in range(3)]
+        # Every page's space went back to the ring after its answer
+        assert not client.ring._entries
+
+    assert all(r["status"] == 200 and r["success"] and r["output"] for r in results)
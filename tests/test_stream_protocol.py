@@ -0,0 +1,83 @@
+"""
+Length-prefixed framing (stream_protocol.py), alone and against the stream API on a stub replica
+"""
+
+import asyncio
+import io
+import socket
+
+import pytest
+
+from stream_protocol import PREFIX, FrameError, encode_frame, read_frame, read_frame_sync
+
+
+def read_all(data, max_payload=1 << 20):
+    """Frames read_frame returns for `data` followed by end of stream"""
+
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        frames = []
+        while (frame := await read_frame(reader, max_payload)) is not None:
+            frames.append(frame)
+        return frames
+
+    return asyncio.run(main())
+
+
+def png(width=64, height=48):
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_frames_round_trip():
+    data = encode_frame({"id": 1, "prompt": "Text Recognition:"}, b"\x89PNG") + encode_frame({"id": 2})
+    expected = [({"id": 1, "prompt": "Text Recognition:"}, b"\x89PNG"), ({"id": 2}, b"")]
+    assert read_all(data) == expected
+    sock_file = io.BytesIO(data)
+    assert [read_frame_sync(sock_file), read_frame_sync(sock_file), read_frame_sync(sock_file)] == expected + [None]
+
+
+def test_oversized_payload_is_skipped_not_buffered():
+    data = encode_frame({"id": 1}, b"x" * 100) + encode_frame({"id": 2}, b"ok")
+    # The big payload comes back as None and the next frame still lines up
+    assert read_all(data, max_payload=10) == [({"id": 1}, None), ({"id": 2}, b"ok")]
+
+
+@pytest.mark.parametrize("data, message", [
+    (encode_frame({"id": 1}, b"payload")[:-3], "mid-frame"),
+    (encode_frame({"id": 1})[:5], "mid-frame"),
+    (PREFIX.pack(5, 0) + b"[1,2]", "JSON object"),
+    (PREFIX.pack(3, 0) + b"{{{", "Invalid frame header"),
+    (PREFIX.pack(1 << 20, 0), "exceeds"),
+])
+def test_malformed_frames(data, message):
+    with pytest.raises(FrameError, match=message):
+        read_all(data)
+
+
+def test_stream_api_answers_by_id(stub_stream_port):
+    from stream_client import StreamClient
+
+    with StreamClient("127.0.0.1", stub_stream_port) as client:
+        futures = [client.submit(png(64 + 16 * i, 48)) for i in range(4)]
+        results = [future.result(timeout=30) for future in futures]
+
+    assert [r["id"] for r in results] == [1, 2, 3, 4]
+    assert all(r["status"] == 200 and r["success"] and r["output"] for r in results)
+
+
+def test_stream_api_rejects_a_malformed_frame(stub_stream_port):
+    with socket.create_connection(("127.0.0.1", stub_stream_port), timeout=30) as sock:
+        sock.sendall(PREFIX.pack(3, 0) + b"{{{")
+        sock_file = sock.makefile("rb")
+        header, _ = read_frame_sync(sock_file)
+        # The connection can't be resynchronised, so the server answers once and closes it
+        assert read_frame_sync(sock_file) is None
+
+    assert header["id"] is None and header["status"] == 400
+    assert "Invalid frame header" in header["error"]
@@ -0,0 +1,74 @@
+"""
+Table blocks and stitching across pages (tables.py)
+"""
+
+import csv
+
+from tables import TableExporter, stitch_tables, table_block
+
+HEADER = "<thead><tr><th>Date</th><th>Amount</th></tr></thead>"
+
+
+def table(rows, header=HEADER):
+    body = "".join(f"<tr><td>{date}</td><td>{amount}</td></tr>" for date, amount in rows)
+    return f"<table>{header}<tbody>{body}</tbody></table>"
+
+
+def test_table_block_reads_header_rows_and_page_edges():
+    block = table_block("Statement, page 1\n" + table([("01-02", "1,200.00"), ("01-03", "−45.10")]))
+    assert block["tables"] == [{
+        "header": ["Date", "Amount"],
+        "rows": [["01-02", "1,200.00"], ["01-03", "-45.10"]],
+        "columns": 2,
+    }]
+    assert block["opens_page"] and block["closes_page"]
+
+    block = table_block(table([("01-04", "3.00")]) + "\n" + "Closing remarks. " * 20)
+    assert block["opens_page"] and not block["closes_page"]
+
+
+def test_table_running_over_pages_is_stitched():
+    pages = [
+        table_block("Statement\n" + table([("01-02", "10.00"), ("01-03", "20.00")])),
+        # The header repeats on the next page
+        table_block(table([("01-04", "30.00")]) + "\nPage 2"),
+        # No header at all, same width
+        table_block(table([("01-05", "40.00")], header="")),
+    ]
+    tables = stitch_tables(pages)
+
+    assert len(tables) == 1
+    assert tables[0]["pages"] == [1, 2, 3]
+    assert tables[0]["rows"] == [["01-02", "10.00"], ["01-03", "20.00"], ["01-04", "30.00"], ["01-05", "40.00"]]
+
+
+def test_tables_that_do_not_continue_stay_apart():
+    other_header = "<thead><tr><th>Item</th><th>Qty</th></tr></thead>"
+    pages = [
+        table_block(table([("01-02", "10.00")])),
+        # Different header: a new table
+        table_block(table([("Pens", "4")], header=other_header)),
+        # Text before the table on the next page: it doesn't open the page
+        table_block("Notes on the inventory. " * 20 + table([("Ink", "2")], header=other_header)),
+        None,
+        # A page without tables in between breaks the run
+        table_block(table([("Pads", "1")], header=other_header)),
+    ]
+    tables = stitch_tables(pages)
+
+    assert [t["pages"] for t in tables] == [[1], [2], [3], [5]]
+
+
+def test_exporter_appends_stitched_pages_to_one_csv(tmp_path):
+    results = [
+        {"page": 1, "success": True, "output": table([("01-02", "10.00")])},
+        {"page": 2, "success": True, "output": table([("01-03", "20.00")])},
+        {"page": 3, "success": False, "error": "timeout"},
+    ]
+    with TableExporter(str(tmp_path / "statement")) as exporter:
+        for result in results:
+            exporter.write(result)
+
+    assert exporter.paths == [str(tmp_path / "statement_table_001.csv")]
+    with open(exporter.paths[0], newline="", encoding="utf-8") as f:
+        assert list(csv.reader(f)) == [["Date", "Amount"], ["01-02", "10.00"], ["01-03", "20.00"]]
@@ -0,0 +1,61 @@
+"""
+Upload byte limits (uploads.UploadLimitMiddleware) in front of a small app that reads the whole body
+"""
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+from uploads import UploadLimitMiddleware  # noqa: E402
+
+LIMIT = 1024
+
+
+async def echo_length(request):
+    return JSONResponse({"received": len(await request.body())})
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route("/upload", echo_length, methods=["GET", "POST"])])
+    return TestClient(UploadLimitMiddleware(app, max_bytes=LIMIT))
+
+
+def chunks(total, size=256):
+    """Body without a Content-Length: the client sends it chunked"""
+    for start in range(0, total, size):
+        yield b"x" * min(size, total - start)
+
+
+def test_body_within_the_limit_reaches_the_app(client):
+    assert client.post("/upload", content=b"x" * LIMIT).json() == {"received": LIMIT}
+    assert client.post("/upload", content=chunks(LIMIT)).json() == {"received": LIMIT}
+
+
+def test_content_length_over_the_limit_is_rejected_up_front(client):
+    response = client.post("/upload", content=b"x" * (LIMIT + 1))
+    assert response.status_code == 413
+    assert response.json() == {"success": False, "error": f"Upload exceeds {LIMIT} bytes"}
+
+
+def test_chunked_body_over_the_limit_is_cut_off(client):
+    response = client.post("/upload", content=chunks(4 * LIMIT))
+    assert response.status_code == 413
+    assert response.json()["error"] == f"Upload exceeds {LIMIT} bytes"
+
+
+@pytest.mark.parametrize("length", ["abc", "-1", "1e3", ""])
+def test_invalid_content_length_is_rejected(client, length):
+    response = client.post("/upload", content=b"x", headers={"Content-Length": length})
+    assert response.status_code == 400
+    assert response.json()["error"] == "Invalid Content-Length header"
+
+
+def test_only_uploads_are_limited(client):
+    # GET bodies pass through untouched
+    assert client.request("GET", "/upload", content=b"x" * (LIMIT + 1)).json() == {"received": LIMIT + 1}
@@ -0,0 +1,96 @@
+"""
+Token-bucket quotas and usage accounting (usage.py), plus a 429 from the stream API on a stub replica
+"""
+
+import pytest
+
+import usage
+from usage import QuotaExceeded, TokenBucket, UnknownKey, UsageStore, UsageTracker, request_usage
+
+
+class Clock:
+    """Stands in for time.monotonic so refills don't need real waiting"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(usage.time, "monotonic", clock)
+    return clock
+
+
+def page_usage(input_tokens, output_tokens):
+    return request_usage(input_tokens, input_tokens // 2, output_tokens, 0.5)
+
+
+def tracker(**kwargs):
+    return UsageTracker(UsageStore(":memory:"), **kwargs)
+
+
+def test_bucket_runs_out_and_refills(clock):
+    bucket = TokenBucket(600)  # 10 tokens per second
+    bucket.charge(900)
+    assert bucket.available() == -300
+    assert bucket.retry_after() == pytest.approx(30.1)
+
+    clock.now += 20
+    assert bucket.available() == -100
+    clock.now += 70
+    # Refills stop at one minute's worth
+    assert bucket.available() == 600
+
+
+def test_quota_exhausted_then_refilled(clock):
+    quotas = tracker(tokens_per_minute=600)
+    quotas.admit("team-a")
+    quotas.record("team-a", page_usage(500, 200))
+
+    # Admitted while positive, then charged the real 700 tokens: the next request waits
+    with pytest.raises(QuotaExceeded) as exceeded:
+        quotas.admit("team-a")
+    assert exceeded.value.retry_after == pytest.approx(10.1)
+    # Without listed keys every caller shares the bucket, so another key doesn't get around it
+    with pytest.raises(QuotaExceeded):
+        quotas.admit("team-b")
+
+    clock.now += 11
+    quotas.admit("team-a")
+    report = quotas.report("team-a")
+    assert report["shared_quota"] and report["available_tokens"] == 10
+    assert report["totals"]["requests"] == 1 and report["totals"]["output_tokens"] == 200
+
+
+def test_listed_keys_have_their_own_buckets(clock):
+    quotas = tracker(tokens_per_minute=1000, quotas={"team-a": 100, "batch": 0, "anonymous": None})
+    quotas.record("team-a", page_usage(150, 0))
+    with pytest.raises(QuotaExceeded):
+        quotas.admit("team-a")
+
+    # "batch" is unlimited and "anonymous" gets the default quota, both untouched by team-a
+    quotas.record("batch", page_usage(10_000, 10_000))
+    quotas.admit("batch")
+    quotas.admit("anonymous")
+    assert quotas.report("anonymous")["available_tokens"] == 1000
+    with pytest.raises(UnknownKey, match="Unknown API key"):
+        quotas.admit("team-c")
+
+
+def test_stream_api_answers_429_when_the_quota_runs_out(stub_stream_port, monkeypatch):
+    import server
+    from stream_client import StreamClient
+    from test_stream_protocol import png
+
+    monkeypatch.setattr(server, "USAGE", tracker(tokens_per_minute=30))
+    with StreamClient("127.0.0.1", stub_stream_port) as client:
+        first = client.predict(png())
+        second = client.predict(png())
+
+    # The first request is admitted on a full bucket, and its real usage empties it
+    assert first["status"] == 200 and first["usage"]["total_tokens"] > 30
+    assert second["status"] == 429 and second["retry_after"] > 0
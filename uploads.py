@@ -0,0 +1,218 @@
+"""
+Memory-bounded upload handling for the GLM-OCR server
+Enforces byte and pixel limits, spools large uploads to disk, iterates
+multi-frame images one frame at a time and tracks per-request peak memory
+"""
+
+import os
+import sys
+
+from fastapi.responses import JSONResponse
+from PIL import Image
+from starlette.formparsers import MultiPartParser
+
+from document_reader import iter_frames
+
+# Limits (override with env vars)
+MAX_UPLOAD_BYTES = int(os.getenv("GLM_OCR_MAX_UPLOAD_BYTES", 64 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("GLM_OCR_MAX_IMAGE_PIXELS", 40_000_000))
+MAX_FRAMES = int(os.getenv("GLM_OCR_MAX_FRAMES", 200))
+SPOOL_THRESHOLD_BYTES = int(os.getenv("GLM_OCR_SPOOL_THRESHOLD_BYTES", 4 * 1024 * 1024))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class UploadTooLarge(Exception):
+    """Upload exceeds the configured byte, pixel or frame limit"""
+
+
+class InvalidImage(ValueError):
+    """Upload isn't a readable image (unknown format, truncated or corrupt data)"""
+
+
+def apply_limits():
+    """
+    Set the process-wide Starlette and Pillow limits; the server calls this at startup, so
+    importing this module (e.g. for MemoryTracker) leaves them alone
+    """
+    # Starlette spools multipart file parts to a temp file above this size,
+    # so UploadFile.file never holds more than the threshold in memory
+    MultiPartParser.spool_max_size = SPOOL_THRESHOLD_BYTES
+    # Pillow's own decompression bomb guard errors out at twice this value
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+def too_large_response(message):
+    return JSONResponse(status_code=413, content={"success": False, "error": message})
+
+
+def bad_request_response(message):
+    return JSONResponse(status_code=400, content={"success": False, "error": message})
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that rejects request bodies above max_bytes.
+    Checks Content-Length up front and counts streamed bytes for chunked uploads,
+    so an oversized body is cut off before it is fully buffered.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        message = f"Upload exceeds {self.max_bytes} bytes"
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None:
+            if not length.strip().isdigit():
+                await bad_request_response("Invalid Content-Length header")(scope, receive, send)
+                return
+            if int(length) > self.max_bytes:
+                await too_large_response(message)(scope, receive, send)
+                return
+
+        received = 0
+        exceeded = False
+        replied = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            msg = await receive()
+            if msg["type"] == "http.request":
+                received += len(msg.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return msg
+
+        async def guarded_send(msg):
+            nonlocal replied
+            if not exceeded:
+                await send(msg)
+            elif not replied:
+                # The body was cut off; answer 413 instead of the app's parse error
+                replied = True
+                await too_large_response(message)(scope, receive, send)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+            # The app failed reading the body we cut off (e.g. ClientDisconnect): that's the 413
+            if not replied:
+                replied = True
+                await too_large_response(message)(scope, receive, send)
+
+
+def open_image(fileobj):
+    """
+    Open an uploaded image lazily and check its size before any pixels are decoded.
+    Image.open only reads the header, so oversized images are rejected without allocation.
+    """
+    try:
+        pil_image = Image.open(fileobj)
+    except Image.DecompressionBombError as e:
+        raise UploadTooLarge(str(e))
+    except OSError as e:
+        raise InvalidImage(f"Cannot read image: {e}")
+
+    pixels = pil_image.width * pil_image.height
+    if pixels > MAX_IMAGE_PIXELS:
+        raise UploadTooLarge(f"Image has {pixels} pixels, limit is {MAX_IMAGE_PIXELS}")
+
+    n_frames = getattr(pil_image, "n_frames", 1)
+    if n_frames > MAX_FRAMES:
+        raise UploadTooLarge(f"Image has {n_frames} frames, limit is {MAX_FRAMES}")
+
+    return pil_image
+
+
+def check_frame(index, pil_image):
+    """iter_frames hook: reject a frame over the pixel limit before it is decoded"""
+    if pil_image.width * pil_image.height > MAX_IMAGE_PIXELS:
+        raise UploadTooLarge(f"Frame {index + 1} exceeds {MAX_IMAGE_PIXELS} pixels")
+
+
+def upload_frames(pil_image):
+    """
+    Yield each frame of an uploaded image as RGB via document_reader.iter_frames, one at a time,
+    with the pixel limit checked per frame and decode errors raised as InvalidImage
+    """
+    frames = iter_frames(pil_image, before_decode=check_frame)
+    count = 0
+    while True:
+        try:
+            _, frame = next(frames)
+        except StopIteration:
+            return
+        except OSError as e:
+            raise InvalidImage(f"Cannot decode frame {count + 1}: {e}")
+        count += 1
+        yield frame
+
+
+def _rss_bytes():
+    """Current resident set size, or None where it can't be read cheaply"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryTracker:
+    """
+    Tracks memory used while serving one request.
+    Host peak comes from the process high-water mark (only grows when this request
+    pushes it higher). GPU peak is the request's own when its device runs one request at a
+    time; with `shared` (continuous batching) the peak isn't reset and covers the whole batch,
+    which the report flags as gpu_peak_shared.
+    """
+
+    def __init__(self, torch_module=None, device=None, shared=False):
+        self.torch = torch_module
+        self.device = device
+        self.shared = shared
+        self.rss_start = _rss_bytes()
+        self.max_rss_start = _max_rss_bytes()
+        self.cuda = (
+            torch_module is not None and torch_module.cuda.is_available()
+            and (device is None or str(device).startswith("cuda"))
+        )
+        if self.cuda and not shared:
+            self.torch.cuda.reset_peak_memory_stats(device)
+
+    def report(self):
+        mb = 1024 * 1024
+        rss = _rss_bytes()
+        max_rss = _max_rss_bytes()
+        stats = {
+            "rss_mb": round(rss / mb, 1) if rss is not None else None,
+            "rss_delta_mb": round((rss - self.rss_start) / mb, 1) if rss is not None and self.rss_start is not None else None,
+            "peak_rss_mb": round(max_rss / mb, 1) if max_rss is not None else None,
+            "peak_rss_growth_mb": round((max_rss - self.max_rss_start) / mb, 1) if max_rss is not None else None,
+        }
+        if self.cuda:
+            stats["gpu_peak_mb"] = round(self.torch.cuda.max_memory_allocated(self.device) / mb, 1)
+            if self.shared:
+                stats["gpu_peak_shared"] = True
+        return stats
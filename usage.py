@@ -0,0 +1,219 @@
+"""
+Token usage accounting and per-API-key quotas for the GLM-OCR server
+Every response reports vision, text and output tokens plus the replica (GPU) seconds it used.
+Lifetime totals per API key live in a small SQLite file, and quotas are token buckets in
+tokens per minute: a huge page costs its real token count, not one request.
+X-API-Key isn't authenticated, so per-key buckets only exist for the keys listed in
+GLM_OCR_KEY_QUOTAS (then the only keys accepted); otherwise all requests share one bucket.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+USAGE_DB = os.getenv("GLM_OCR_USAGE_DB", "usage.db")
+# Quota in tokens (input + output) per minute: shared by all requests when no keys are listed,
+# else the default of listed keys whose quota is null; 0 = unlimited
+TOKENS_PER_MINUTE = int(os.getenv("GLM_OCR_TOKENS_PER_MINUTE", 0))
+# Accepted API keys and their quotas as JSON, e.g. {"team-a": 200000, "batch": 0, "anonymous": null};
+# when set, other keys are rejected (list "anonymous" to allow requests without a key)
+KEY_QUOTAS = json.loads(os.getenv("GLM_OCR_KEY_QUOTAS", "{}"))
+# Keys with stored totals, beyond which the least recently active unlisted keys are dropped
+USAGE_MAX_KEYS = int(os.getenv("GLM_OCR_USAGE_MAX_KEYS", 10000))
+ANONYMOUS = "anonymous"
+# Bucket of every request when no keys are listed
+SHARED = "*"
+
+COUNTERS = ("requests", "input_tokens", "vision_tokens", "text_tokens", "output_tokens", "gpu_seconds")
+
+
+class UnknownKey(Exception):
+    """GLM_OCR_KEY_QUOTAS lists the accepted API keys and the request's key isn't one of them"""
+
+    def __init__(self, key):
+        super().__init__("Missing API key" if key == ANONYMOUS else "Unknown API key")
+
+
+class QuotaExceeded(Exception):
+    """The key's token bucket is empty; retry_after is when it is positive again"""
+
+    def __init__(self, key, retry_after):
+        super().__init__(f"Token quota exceeded for {key}; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def request_usage(input_tokens, vision_tokens, output_tokens, gpu_seconds):
+    """Usage block of one page"""
+    return {
+        "input_tokens": input_tokens,
+        "vision_tokens": vision_tokens,
+        "text_tokens": input_tokens - vision_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "gpu_seconds": round(gpu_seconds, 4),
+    }
+
+
+def sum_usage(usages):
+    """Usage of a multi-page request"""
+    total = {key: sum(usage[key] for usage in usages) for key in usages[0]}
+    total["gpu_seconds"] = round(total["gpu_seconds"], 4)
+    return total
+
+
+class TokenBucket:
+    """
+    Refills at per_minute / 60 tokens per second up to per_minute. Requests are admitted while
+    the balance is positive and charged their real usage afterwards, so a large request can push
+    the balance negative and delay the key's next requests accordingly.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.balance = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.per_minute, self.balance + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def available(self):
+        self._refill()
+        return self.balance
+
+    def charge(self, tokens):
+        self._refill()
+        self.balance -= tokens
+
+    def retry_after(self):
+        """Seconds until the balance is positive again"""
+        return max(0.0, -self.available()) * 60 / self.per_minute + 0.1
+
+
+class UsageStore:
+    """
+    Lifetime per-key totals in SQLite (":memory:" keeps them for the process only).
+    Beyond max_keys rows, the least recently updated keys not in `keep` are deleted, so
+    made-up X-API-Key values can't grow the table without bound.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path=USAGE_DB, max_keys=USAGE_MAX_KEYS, keep=()):
+        self.max_keys = max_keys
+        self.keep = set(keep)
+        self._adds = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage (key TEXT PRIMARY KEY, "
+            + ", ".join(f"{name} REAL NOT NULL DEFAULT 0" for name in COUNTERS)
+            + ", updated REAL)"
+        )
+        self._lock = threading.Lock()
+
+    def add(self, key, usage):
+        values = [1] + [usage.get(name, 0) for name in COUNTERS[1:]]
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO usage (key, {', '.join(COUNTERS)}, updated) VALUES (?, {', '.join('?' * len(COUNTERS))}, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                + ", ".join(f"{name} = {name} + excluded.{name}" for name in COUNTERS)
+                + ", updated = excluded.updated",
+                [key, *values, time.time()],
+            )
+            self._adds += 1
+            if self._adds % self.PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self):
+        keep = sorted(self.keep)
+        self._conn.execute(
+            f"DELETE FROM usage WHERE key NOT IN ({', '.join('?' * len(keep))}) AND key IN "
+            "(SELECT key FROM usage ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            [*keep, self.max_keys],
+        )
+
+    def totals(self, key=None):
+        """{key: totals} for one key or all of them"""
+        query = f"SELECT key, {', '.join(COUNTERS)} FROM usage"
+        with self._lock:
+            rows = self._conn.execute(query + " WHERE key = ?", (key,)) if key else self._conn.execute(query)
+            rows = rows.fetchall()
+        return {
+            row[0]: {name: round(value, 4) if name == "gpu_seconds" else int(value)
+                     for name, value in zip(COUNTERS, row[1:])}
+            for row in rows
+        }
+
+
+class UsageTracker:
+    """
+    Quota checks before a request runs and accounting after it finishes.
+    With quotas listed per key, only those keys are accepted and each has its own bucket.
+    Without, the key is just an accounting label and every request draws from one shared
+    bucket, so rotating or leaving out X-API-Key can't get around the quota.
+    """
+
+    def __init__(self, store=None, tokens_per_minute=TOKENS_PER_MINUTE, quotas=None):
+        self.quotas = KEY_QUOTAS if quotas is None else quotas
+        self.store = store or UsageStore(keep=self.quotas)
+        self.tokens_per_minute = tokens_per_minute
+        self._buckets = {}  # listed keys, or just SHARED
+        self._lock = threading.Lock()
+
+    def check_key(self, key):
+        """Raise UnknownKey if keys are listed and this isn't one of them"""
+        if self.quotas and key not in self.quotas:
+            raise UnknownKey(key)
+
+    def limit(self, key):
+        if not self.quotas:
+            return self.tokens_per_minute
+        limit = self.quotas.get(key)
+        return self.tokens_per_minute if limit is None else limit
+
+    def _bucket(self, key):
+        limit = self.limit(key)
+        if not limit:
+            return None
+        name = key if self.quotas else SHARED
+        bucket = self._buckets.get(name)
+        if bucket is None or bucket.per_minute != limit:
+            bucket = self._buckets[name] = TokenBucket(limit)
+        return bucket
+
+    def admit(self, key):
+        """Raise UnknownKey for a key that isn't accepted, QuotaExceeded if its bucket is empty"""
+        self.check_key(key)
+        with self._lock:
+            bucket = self._bucket(key)
+            if bucket is not None and bucket.available() <= 0:
+                raise QuotaExceeded(key, bucket.retry_after())
+
+    def record(self, key, usage):
+        """Charge a finished (or cancelled) request's tokens to the key"""
+        with self._lock:
+            bucket = self._bucket(key)
+            if bucket is not None:
+                bucket.charge(usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+        self.store.add(key, usage)
+
+    def report(self, key):
+        """Totals plus the current quota state of one key (raises UnknownKey like admit)"""
+        self.check_key(key)
+        with self._lock:
+            bucket = self._bucket(key)
+            available = bucket.available() if bucket is not None else None
+        return {
+            "key": key,
+            "totals": self.store.totals(key).get(key, dict.fromkeys(COUNTERS, 0)),
+            "tokens_per_minute": self.limit(key) or None,
+            # Without listed keys the quota is server-wide, shared with every other caller
+            "shared_quota": not self.quotas and bool(self.limit(key)),
+            "available_tokens": None if available is None else int(available),
+        }